@@ -0,0 +1,91 @@
+"""
+Сравнение стоимости выбора обработчика нажатия кнопки в aiogram: отдельный
+callback_query_handler с фильтром-лямбдой на каждую кнопку (как было) против
+одного обработчика CallbackRouter, который разбирает callback_data и ищет
+обработчик в словаре. В обоих вариантах обработчик получает разобранные поля.
+
+Запуск из корня репозитория: python benchmarks/bench_callbacks.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot, Dispatcher, types  # noqa: E402
+
+import callbacks  # noqa: E402
+
+# Фильтры в порядке регистрации обработчиков в main.py до перехода на CallbackRouter
+FILTERS = [
+    ("subs:", False), ("delete_", False), ("trial", True), ("topup_reject_", False), ("main_menu", True),
+    ("get_account", True), ("pay", True), ("pay_sbp", True), ("topup_sbp_amount_", False),
+    ("topup_sbp_paid_", False), ("topup_confirm_sbp_", False), ("pay_tg_wallet", True),
+    ("topup_tg_wallet_amount_", False), ("topup_tg_wallet_paid_", False), ("topup_confirm_tg_wallet_", False),
+    ("payment_reject_", False), ("pend:", False), ("status", True), ("reject_", False),
+]
+
+CASES = [
+    ("главное меню", "main_menu", callbacks.MAIN_MENU.encode()),
+    ("оплатил СБП", "topup_sbp_paid_300_ab12cd34", callbacks.SBP_PAID.encode(amount=300, payment_id="ab12cd34")),
+    ("статус", "status", callbacks.STATUS.encode()),
+]
+NUMBER = 20000
+
+
+def equals(key):
+    return lambda c: c.data == key
+
+
+def startswith(key):
+    return lambda c: c.data.startswith(key)
+
+
+def build_filters():
+    dp = Dispatcher(Bot("123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"))
+    for key, exact in FILTERS:
+        async def handler(callback_query):
+            # Разбор полей, как в прежних обработчиках
+            callback_query.data.split("_")
+        dp.register_callback_query_handler(handler, equals(key) if exact else startswith(key))
+    return dp
+
+
+def build_router():
+    dp = Dispatcher(Bot("123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"))
+    router = callbacks.CallbackRouter()
+
+    async def handler(callback_query, **values):
+        pass
+
+    router.route(*callbacks.ACTIONS.values(), callbacks.CONFIRM_SBP, callbacks.CONFIRM_TG_WALLET,
+                 callbacks.TOPUP_REJECT, callbacks.PAYMENT_REJECT, callbacks.REJECT)(handler)
+    dp.register_callback_query_handler(router.dispatch)
+    return dp
+
+
+async def measure(dp, data):
+    callback_query = types.CallbackQuery(id="1", data=data, **{"from": {"id": 1, "is_bot": False, "first_name": "a"}})
+    # Контекст пользователя, как при обработке обновления диспетчером (нужен фильтру состояния)
+    types.User.set_current(callback_query.from_user)
+    started = time.perf_counter()
+    for _ in range(NUMBER):
+        await dp.callback_query_handlers.notify(callback_query)
+    return (time.perf_counter() - started) / NUMBER
+
+
+async def main():
+    filters, router = build_filters(), build_router()
+    print(f"{'кнопка':<14} {'вариант':<24} {'мкс/нажатие':>12}")
+    for name, legacy, compact in CASES:
+        for label, dp, data in (
+            ("фильтры", filters, legacy),
+            ("роутер, старые кнопки", router, legacy),
+            ("роутер, новые кнопки", router, compact),
+        ):
+            print(f"{name:<14} {label:<24} {await measure(dp, data) * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
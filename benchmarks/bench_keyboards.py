@@ -0,0 +1,55 @@
+"""
+Сравнение стоимости клавиатуры на один ответ обработчика: создание
+InlineKeyboardMarkup и сериализация при каждом нажатии (как было) против
+готовой строки JSON из keyboards.py.
+
+Запуск из корня репозитория: python benchmarks/bench_keyboards.py
+"""
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.utils.payload import prepare_arg  # noqa: E402
+
+import keyboards  # noqa: E402
+
+CASES = [
+    ("главное меню", keyboards.build_main_menu, keyboards.MAIN_MENU),
+    ("тарифы СБП", keyboards.build_sbp_tariffs, keyboards.SBP_TARIFFS),
+    ("назад в меню", keyboards.build_back_to_main_menu, keyboards.BACK_TO_MAIN_MENU),
+]
+NUMBER = 20000
+
+
+def allocated_per_call(func, number=1000):
+    """
+    Средний пиковый объём памяти в байтах, выделяемой за один вызов.
+    """
+    total = 0
+    tracemalloc.start()
+    for _ in range(number):
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        func()
+        total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    return total / number
+
+
+def main():
+    print(f"{'клавиатура':<14} {'вариант':<10} {'мкс/вызов':>10} {'байт/вызов':>11}")
+    for name, build, cached in CASES:
+        variants = [
+            ("каждый раз", lambda: prepare_arg(build())),
+            ("готовая", lambda: prepare_arg(cached)),
+        ]
+        for label, func in variants:
+            seconds = timeit.timeit(func, number=NUMBER)
+            print(f"{name:<14} {label:<10} {seconds / NUMBER * 1e6:>10.2f} {allocated_per_call(func):>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
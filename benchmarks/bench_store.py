@@ -0,0 +1,231 @@
+"""
+Микробенчмарки слоя данных подписок на синтетических наборах из 1 тыс.,
+100 тыс. и 1 млн пользователей: load_json/save_json, запуск бота (перенос
+JSON в SQLite и загрузка хранилища), create_or_extend_torr_account,
+check_if_trial, delete_trial_account, schedule_reminders и запись пачки
+изменений хранилища. Для каждой операции фиксируются время и пиковая память.
+
+Каждый размер прогоняется в отдельном процессе со своим временным каталогом,
+перезагрузка TorrServer отключена, журнал бота пишет только предупреждения и ошибки. Результаты сравниваются с базовыми
+значениями из benchmarks/baselines/bench_store.json: операция, ставшая
+медленнее базовой больше чем в --threshold раз, отмечается как регрессия,
+и скрипт завершается с кодом 1.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_store.py                     # сравнить с базовыми значениями
+    python benchmarks/bench_store.py --sizes 1000,100000 --save-baseline
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines", "bench_store.json")
+FIRST_USER_ID = 100000
+# Количество вызовов для операций над одним пользователем
+CALLS = {"check_if_trial": 10000, "create_or_extend_torr_account": 500, "delete_trial_account": 500}
+
+
+# ====== Синтетические данные ======
+def generate_dataset(size, directory):
+    """
+    Создаёт accs.db, expiry.db и trial_usage.db в старом формате JSON.
+    Треть подписок истекла, треть истекает в ближайшие дни, остальные действуют дольше месяца.
+    """
+    rng = random.Random(size)
+    now = datetime.now()
+    accs, expiry, trials = {}, {}, []
+    for index in range(size):
+        user_id = FIRST_USER_ID + index
+        username = f"User{user_id}"
+        accs[username] = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(12))
+        if index % 3 == 0:
+            days = -rng.randint(1, 30)
+        elif index % 3 == 1:
+            days = rng.randint(4, 10)
+        else:
+            days = rng.randint(30, 180)
+        expiry[username] = (now + timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+        if index % 4 == 0:
+            trials.append(user_id)
+    for name, data in (("accs.db", accs), ("expiry.db", expiry), ("trial_usage.db", trials)):
+        with open(os.path.join(directory, name), "w") as f:
+            json.dump(data, f)
+
+
+# ====== Измерение ======
+def measure(func, number=1):
+    """
+    Среднее время вызова и пиковая память одного вызова (отдельный прогон под tracemalloc).
+    """
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    seconds = (time.perf_counter() - started) / number
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+async def measure_async(func, number=1):
+    started = time.perf_counter()
+    for _ in range(number):
+        await func()
+    seconds = (time.perf_counter() - started) / number
+    tracemalloc.start()
+    await func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def run_worker(size):
+    """
+    Прогон для одного размера набора; результаты печатаются в stdout как JSON.
+    """
+    workdir = tempfile.mkdtemp(prefix=f"bench-store-{size}-")
+    generate_dataset(size, workdir)
+    os.environ.update({
+        "BOT_TOKEN": "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA", "ADMIN_ID": "1", "TORRSERVER_RELOAD_MODE": "none",
+        "USERS_DB_PATH": os.path.join(workdir, "users.db"),
+        "ACCS_DB_PATH": os.path.join(workdir, "accs.db"),
+        "EXPIRY_DB_PATH": os.path.join(workdir, "expiry.db"),
+        "TRIAL_USAGE_DB_PATH": os.path.join(workdir, "trial_usage.db"),
+        "STORE_JOURNAL_PATH": os.path.join(workdir, "store.journal"),
+        # Измеряем только слой данных: информационные записи журнала в фоновом потоке
+        # конкурировали бы с измеряемым кодом за GIL
+        "LOG_LEVEL": "WARNING",
+    })
+    # bot.log пишется в текущий каталог
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    from database.store import load_json, save_json
+
+    results = {}
+    accs_path = os.path.join(workdir, "accs.db")
+    results["load_json"] = measure(lambda: load_json(accs_path))
+    accs = load_json(accs_path)
+    results["save_json"] = measure(lambda: save_json(os.path.join(workdir, "accs.copy.db"), accs))
+    del accs
+
+    # Запуск: перенос JSON в SQLite и загрузка хранилища при импорте main
+    started = time.perf_counter()
+    tracemalloc.start()
+    import main
+    results["startup"] = {"seconds": time.perf_counter() - started, "peak_bytes": tracemalloc.get_traced_memory()[1]}
+    tracemalloc.stop()
+
+    rng = random.Random(size)
+    user_ids = [FIRST_USER_ID + rng.randrange(size * 2) for _ in range(max(CALLS.values()) + 1)]
+
+    async def scenario():
+        trial_ids = iter(user_ids)
+        results["check_if_trial"] = measure(lambda: main.check_if_trial(next(trial_ids)), CALLS["check_if_trial"])
+
+        extend_ids = iter(user_ids)
+        results["create_or_extend_torr_account"] = await measure_async(
+            lambda: main.create_or_extend_torr_account(next(extend_ids), 30), CALLS["create_or_extend_torr_account"]
+        )
+        results["store_flush"] = await measure_async(main.store.flush)
+
+        async def delete_trial_account(usernames=(f"User{user_id}" for user_id in user_ids)):
+            # Срок совпадает с записанным в задаче — измеряем именно удаление
+            username = next(usernames)
+            await main.delete_trial_account(username, main.store.get_expiry(username))
+        results["delete_trial_account"] = await measure_async(delete_trial_account, CALLS["delete_trial_account"])
+        await main.store.flush()
+
+        async def schedule_reminders():
+            await main.db.run(main.db.set_meta, "reminders_scheduled", "")
+            await main.schedule_reminders()
+            # Дожидаемся фоновой записи задач в базу
+            await main.db.run(main.db.get_meta, "reminders_scheduled")
+        results["schedule_reminders"] = await measure_async(schedule_reminders)
+
+    asyncio.run(scenario())
+    main.store.close()
+    main.db.close()
+    os.chdir(ROOT)
+    shutil.rmtree(workdir)
+    json.dump(results, sys.stdout)
+
+
+# ====== Сравнение с базовыми значениями ======
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, "r") as f:
+        return json.load(f).get("results", {})
+
+
+def report(results, baseline, threshold):
+    regressions = []
+    print(f"{'размер':>8} {'операция':<30} {'мкс/вызов':>13} {'пик, КиБ':>10} {'база, мкс':>13} {'изм.':>7}")
+    for size, operations in results.items():
+        for name, value in operations.items():
+            base = baseline.get(size, {}).get(name)
+            ratio = value["seconds"] / base["seconds"] if base and base["seconds"] else None
+            flag = ""
+            if ratio is not None and ratio > threshold:
+                flag = "  РЕГРЕССИЯ"
+                regressions.append((size, name, ratio))
+            print(
+                f"{size:>8} {name:<30} {value['seconds'] * 1e6:>13.1f} {value['peak_bytes'] / 1024:>10.0f} "
+                f"{base['seconds'] * 1e6 if base else float('nan'):>13.1f} "
+                f"{f'x{ratio:.2f}' if ratio is not None else '-':>7}{flag}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки слоя данных подписок.")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="размеры наборов через запятую")
+    parser.add_argument("--threshold", type=float, default=1.5, help="допустимое замедление относительно базы")
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как базовые")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        run_worker(args.worker)
+        return 0
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", str(size)],
+            check=True, stdout=subprocess.PIPE, cwd=ROOT,
+        ).stdout
+        results[str(size)] = json.loads(output)
+
+    regressions = report(results, load_baseline(), args.threshold)
+    if args.save_baseline:
+        baseline = load_baseline()
+        baseline.update(results)
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump({
+                "python": platform.python_version(), "machine": platform.machine(), "results": baseline,
+            }, f, indent=4, ensure_ascii=False)
+            f.write("\n")
+        print(f"Базовые значения сохранены в {BASELINE_PATH}")
+        return 0
+    if regressions:
+        print(f"\nРегрессий: {len(regressions)} (порог x{args.threshold}).")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
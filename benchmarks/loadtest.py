@@ -0,0 +1,357 @@
+"""
+Нагрузочный прогон бота: настоящий Dispatcher из main.py в режиме polling
+работает с локальной заглушкой Telegram Bot API (getUpdates, sendMessage,
+editMessageText, answerCallbackQuery и др.), а сценарии пользователей
+(/start → пробный период → статус → оплата СБП → подтверждение администратором)
+запускаются с заданной частотой.
+
+Данные бота (база, журнал, accs.db, bot.log) создаются во временном каталоге,
+перезагрузка TorrServer отключена. Администратор в прогоне подтверждает
+платежи страницами через /pending, как это делал бы человек.
+
+Запуск из корня репозитория:
+    python benchmarks/loadtest.py --users 1000 --rate 50
+
+Итог: задержки ответа по шагам (p50/p95/p99), пропускная способность,
+количество ошибок (таймауты, ограничение частоты, исключения в боте) и
+число вызовов Bot API по методам.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import callbacks  # noqa: E402
+
+TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+ADMIN_ID = 1
+FIRST_USER_ID = 100000
+THROTTLED_TEXT = "Слишком много запросов"
+STEPS = ["start", "trial", "status", "pay", "pay_sbp", "tariff", "paid", "confirm"]
+
+
+class FakeBotAPI:
+    """
+    Заглушка Telegram Bot API. Обновления для бота ставятся в очередь и отдаются
+    через getUpdates; ответы бота передаются ожидающим их сценариям по chat_id.
+    """
+
+    def __init__(self):
+        self.updates = asyncio.Queue()
+        self.calls = Counter()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._waiters = defaultdict(list)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    def push(self, kind, payload):
+        self.updates.put_nowait({"update_id": next(self._update_ids), kind: payload})
+
+    def expect(self, chat_id, predicate=None):
+        """
+        Возвращает future, который получит (метод, параметры) первого подходящего ответа бота в чат.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((predicate, future))
+        return future
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+        handler = getattr(self, f"_{method.lower()}", None)
+        result = await handler(params) if handler else True
+        self._notify(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    def _notify(self, method, params):
+        chat_id = params.get("chat_id")
+        if chat_id is None and "callback_query_id" in params:
+            chat_id = params["callback_query_id"].split(":")[0]
+        if chat_id is None:
+            return
+        waiters = self._waiters.get(int(chat_id))
+        for waiter in list(waiters or ()):
+            predicate, future = waiter
+            if future.done():
+                waiters.remove(waiter)
+            elif predicate is None or predicate(method, params):
+                waiters.remove(waiter)
+                future.set_result((method, params))
+                return
+
+    async def _getupdates(self, params):
+        timeout = float(params.get("timeout", 0))
+        limit = int(params.get("limit") or 100)
+        try:
+            updates = [await asyncio.wait_for(self.updates.get(), timeout)] if timeout else []
+        except asyncio.TimeoutError:
+            return []
+        while len(updates) < limit and not self.updates.empty():
+            updates.append(self.updates.get_nowait())
+        return updates
+
+    async def _getme(self, params):
+        return {"id": 123456, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+
+    async def _sendmessage(self, params):
+        return self._message(params)
+
+    async def _editmessagetext(self, params):
+        return self._message(params)
+
+    def _message(self, params):
+        chat_id = int(params["chat_id"])
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", ""),
+        }
+
+
+class LoadTest:
+    def __init__(self, api, options):
+        self.api = api
+        self.options = options
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.completed = 0
+        self.updates_sent = 0
+        self._callback_ids = itertools.count(1)
+
+    # ====== Обновления от пользователей ======
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def _chat(self, user_id):
+        return {"id": user_id, "type": "private"}
+
+    async def send_message(self, user_id, text, predicate=None):
+        entities = []
+        if text.startswith("/"):
+            entities.append({"type": "bot_command", "offset": 0, "length": len(text.split()[0])})
+        future = self.api.expect(user_id, predicate)
+        self.api.push("message", {
+            "message_id": next(self._callback_ids), "from": self._user(user_id), "chat": self._chat(user_id),
+            "date": int(time.time()), "text": text, "entities": entities,
+        })
+        self.updates_sent += 1
+        return future
+
+    async def press(self, user_id, data, predicate=None):
+        future = self.api.expect(user_id, predicate)
+        self.api.push("callback_query", {
+            "id": f"{user_id}:{next(self._callback_ids)}", "from": self._user(user_id), "chat_instance": "1",
+            "data": data, "message": {
+                "message_id": 1, "date": int(time.time()), "chat": self._chat(user_id), "text": "-",
+            },
+        })
+        self.updates_sent += 1
+        return future
+
+    async def step(self, name, send):
+        """
+        Выполняет шаг сценария и учитывает задержку до первого ответа бота.
+        :return: (метод, параметры) ответа или None при ошибке.
+        """
+        started = time.monotonic()
+        try:
+            method, params = await asyncio.wait_for(await send, self.options.timeout)
+        except asyncio.TimeoutError:
+            self.errors[f"{name}: таймаут"] += 1
+            return None
+        self.latencies[name].append(time.monotonic() - started)
+        if THROTTLED_TEXT in params.get("text", ""):
+            self.errors[f"{name}: ограничение частоты"] += 1
+            return None
+        return method, params
+
+    # ====== Сценарии ======
+    async def journey(self, user_id):
+        think = self.options.think
+        steps = [
+            ("start", lambda: self.send_message(user_id, "/start")),
+            ("trial", lambda: self.press(user_id, callbacks.TRIAL.encode())),
+            ("status", lambda: self.press(user_id, callbacks.STATUS.encode())),
+            ("pay", lambda: self.press(user_id, callbacks.PAY.encode())),
+            ("pay_sbp", lambda: self.press(user_id, callbacks.PAY_SBP.encode())),
+            ("tariff", lambda: self.press(user_id, callbacks.SBP_AMOUNT.encode(amount=100))),
+        ]
+        response = None
+        for name, send in steps:
+            response = await self.step(name, send())
+            if response is None:
+                return
+            await asyncio.sleep(think)
+
+        paid_data = _buttons(response[1]).get("Оплатил")
+        if paid_data is None:
+            self.errors["tariff: нет кнопки «Оплатил»"] += 1
+            return
+        # Подтверждение приходит отдельным сообщением после того, как администратор обработает очередь
+        confirmed = self.api.expect(
+            user_id, lambda method, params: method == "sendMessage" and "подтверждён" in params.get("text", "")
+        )
+        if await self.step("paid", self.press(user_id, paid_data)) is None:
+            return
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(confirmed, self.options.confirm_timeout)
+        except asyncio.TimeoutError:
+            self.errors["confirm: таймаут"] += 1
+            return
+        self.latencies["confirm"].append(time.monotonic() - started)
+        self.completed += 1
+
+    async def admin(self, stop):
+        """
+        Администратор открывает /pending и подтверждает очередь страницами.
+        """
+        def is_page(method, params):
+            return method in ("sendMessage", "editMessageText") and (
+                params.get("text", "").startswith(("Ожидают проверки", "Нет платежей", "На этой странице"))
+            )
+
+        data = None
+        while not stop.is_set():
+            if data is None:
+                response = await self.step("admin_pending", self.send_message(ADMIN_ID, "/pending", is_page))
+            else:
+                response = await self.step("admin_confirm", self.press(ADMIN_ID, data, is_page))
+            data = None
+            if response is not None:
+                data = next((d for text, d in _buttons(response[1]).items() if text.startswith("✅ Все")), None)
+            # Не чаще одного действия в секунду, как у обычного пользователя
+            await asyncio.sleep(self.options.admin_interval)
+
+    async def run(self):
+        options = self.options
+        stop = asyncio.Event()
+        admin = asyncio.get_running_loop().create_task(self.admin(stop))
+        journeys = []
+        started = time.monotonic()
+        for index in range(options.users):
+            journeys.append(asyncio.get_running_loop().create_task(self.journey(FIRST_USER_ID + index)))
+            await asyncio.sleep(1 / options.rate)
+        await asyncio.gather(*journeys)
+        duration = time.monotonic() - started
+        stop.set()
+        await admin
+        return duration
+
+
+def _buttons(params):
+    markup = params.get("reply_markup")
+    if not markup:
+        return {}
+    return {
+        button["text"]: button.get("callback_data")
+        for row in json.loads(markup).get("inline_keyboard", []) for button in row
+    }
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class _ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+def report(test, api, duration, bot_errors):
+    print(f"{'шаг':<14} {'ответов':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9}")
+    for name in STEPS + ["admin_pending", "admin_confirm"]:
+        values = test.latencies.get(name)
+        if not values:
+            continue
+        print(
+            f"{name:<14} {len(values):>8} {percentile(values, 0.5) * 1000:>9.1f} "
+            f"{percentile(values, 0.95) * 1000:>9.1f} {percentile(values, 0.99) * 1000:>9.1f}"
+        )
+    print(
+        f"\nОбновлений: {test.updates_sent} за {duration:.1f} сек. ({test.updates_sent / duration:.1f} в сек.), "
+        f"сценариев завершено: {test.completed} из {test.options.users}."
+    )
+    print(f"Ошибок в логе бота: {bot_errors}")
+    for name, count in sorted(test.errors.items()):
+        print(f"  {name}: {count}")
+    print("Вызовы Bot API: " + ", ".join(f"{method} {count}" for method, count in api.calls.most_common()))
+
+
+async def main(options):
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", options.port)
+    await site.start()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.environ.update({
+        "BOT_TOKEN": TOKEN, "ADMIN_ID": str(ADMIN_ID), "TORRSERVER_RELOAD_MODE": "none",
+        "USERS_DB_PATH": os.path.join(workdir, "users.db"),
+        "ACCS_DB_PATH": os.path.join(workdir, "accs.db"),
+        "EXPIRY_DB_PATH": os.path.join(workdir, "expiry.db"),
+        "TRIAL_USAGE_DB_PATH": os.path.join(workdir, "trial_usage.db"),
+        "STORE_JOURNAL_PATH": os.path.join(workdir, "store.journal"),
+    })
+    # bot.log пишется в текущий каталог
+    os.chdir(workdir)
+    from aiogram.bot.api import TelegramAPIServer
+    import main as bot_main
+
+    bot_main.bot.server = TelegramAPIServer.from_base(f"http://127.0.0.1:{options.port}")
+    bot_main.restart_torrserver = lambda: None
+    errors = _ErrorCounter()
+    logging.getLogger().addHandler(errors)
+
+    await bot_main.on_startup(bot_main.dp)
+    polling = asyncio.get_running_loop().create_task(bot_main.dp.start_polling(relax=options.relax))
+    try:
+        test = LoadTest(api, options)
+        duration = await test.run()
+    finally:
+        bot_main.dp.stop_polling()
+        await polling
+        await bot_main.on_shutdown(bot_main.dp)
+        await (await bot_main.bot.get_session()).close()
+        await runner.cleanup()
+    report(test, api, duration, errors.count)
+    print(f"Данные прогона: {workdir}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота с заглушкой Telegram Bot API.")
+    parser.add_argument("--users", type=int, default=200, help="количество пользователей (сценариев)")
+    parser.add_argument("--rate", type=float, default=20.0, help="новых сценариев в секунду")
+    parser.add_argument("--think", type=float, default=1.2, help="пауза между шагами сценария, сек.")
+    parser.add_argument("--timeout", type=float, default=30.0, help="ожидание ответа на шаг, сек.")
+    parser.add_argument("--confirm-timeout", type=float, default=300.0,
+                        help="ожидание подтверждения платежа администратором, сек.")
+    parser.add_argument("--admin-interval", type=float, default=1.1, help="пауза между действиями администратора, сек.")
+    parser.add_argument("--relax", type=float, default=0.1, help="пауза между запросами getUpdates (как в executor)")
+    parser.add_argument("--port", type=int, default=8089, help="порт заглушки Bot API")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
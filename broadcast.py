@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from aiogram.utils.exceptions import (
+    BotBlocked, ChatNotFound, NetworkError, RetryAfter, TelegramAPIError, UserDeactivated
+)
+
+logger = logging.getLogger("broadcast")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты «корзина с токенами»: до capacity запросов подряд,
+    далее rate запросов в секунду. pause() блокирует выдачу токенов целиком,
+    например после ответа 429 от Telegram.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        :param rate: Скорость пополнения, токенов в секунду.
+        :param capacity: Размер корзины (по умолчанию равен rate).
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+
+class Broadcaster:
+    """
+    Очередь исходящих сообщений с учётом ограничений Telegram:
+    общий лимит (~30 сообщений в секунду) и не чаще одного сообщения в секунду в один чат.
+    Рассылки сохраняются в базе по получателям, поэтому прерванная рассылка
+    продолжается после перезапуска с того места, где остановилась.
+    Если отправители не запущены (процесс бота не ведущий), рассылка только
+    сохраняется, и её подхватывает ведущий процесс через resume().
+    """
+
+    def __init__(self, bot, db, admin_id, rate=25, per_chat_interval=1.0, workers=8, progress_interval=10.0,
+                 network_retries=3):
+        """
+        :param bot: Экземпляр aiogram.Bot.
+        :param db: Экземпляр database.db.Database.
+        :param admin_id: Telegram ID администратора для отчётов о ходе рассылки.
+        :param rate: Общий лимит сообщений в секунду.
+        :param per_chat_interval: Минимальный интервал между сообщениями в один чат, сек.
+        :param workers: Количество параллельных отправителей.
+        :param progress_interval: Период обновления отчёта администратору, сек.
+        :param network_retries: Сколько раз повторять отправку после сетевой ошибки или таймаута.
+        """
+        self.bot = bot
+        self.db = db
+        self.admin_id = admin_id
+        self.bucket = TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.workers = workers
+        self.progress_interval = progress_interval
+        self.network_retries = network_retries
+        self._queue = asyncio.Queue()
+        self._chat_next = {}
+        self._texts = {}
+        self._progress = {}
+        self._tasks = []
+
+    async def start(self):
+        """
+        Запускает отправителей и продолжает незавершённые рассылки.
+        """
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        await self.resume()
+
+    async def resume(self):
+        """
+        Ставит в очередь незавершённые рассылки, которые ещё не выполняются.
+        """
+        for broadcast_id, text, pending, sent, failed in await self.db.run(self.db.load_unfinished_broadcasts):
+            if broadcast_id in self._progress or not self._tasks:
+                continue
+            logger.info(f"Продолжение рассылки #{broadcast_id}: осталось {len(pending)} получателей.")
+            self._enqueue(broadcast_id, text, pending, sent, failed)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Неотправленное остаётся в базе и будет продолжено при следующем запуске
+        self._queue = asyncio.Queue()
+        self._progress.clear()
+        self._texts.clear()
+
+    def queued(self):
+        """
+        Количество сообщений рассылок, ожидающих отправки.
+        """
+        return self._queue.qsize()
+
+    async def broadcast(self, text, chat_ids):
+        """
+        Создаёт рассылку и ставит её в очередь.
+        :return: Номер рассылки.
+        """
+        chat_ids = list(dict.fromkeys(chat_ids))
+        broadcast_id = await self.db.run(self.db.create_broadcast, text, chat_ids)
+        if self._tasks and broadcast_id not in self._progress:
+            self._enqueue(broadcast_id, text, chat_ids, 0, 0)
+        return broadcast_id
+
+    async def send(self, chat_id, text, **kwargs):
+        """
+        Отправляет одно сообщение с соблюдением лимитов и повтором после 429
+        и сетевых ошибок (не больше network_retries раз, с растущей паузой).
+        :return: True, если сообщение доставлено.
+        """
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            await self._wait_chat(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.timeout} сек. (чат {chat_id}).")
+                self.bucket.pause(e.timeout)
+            except (BotBlocked, ChatNotFound, UserDeactivated) as e:
+                logger.info(f"Сообщение в чат {chat_id} не доставлено: {e}")
+                return False
+            except (NetworkError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                attempt += 1
+                if attempt > self.network_retries:
+                    logger.error(f"Сообщение в чат {chat_id} не доставлено после {attempt} попыток: {e!r}")
+                    return False
+                logger.warning(f"Сетевая ошибка при отправке в чат {chat_id} (попытка {attempt}): {e!r}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramAPIError as e:
+                logger.error(f"Ошибка при отправке сообщения в чат {chat_id}: {e}")
+                return False
+
+    async def _wait_chat(self, chat_id):
+        now = time.monotonic()
+        ready_at = self._chat_next.get(chat_id, 0.0)
+        self._chat_next[chat_id] = max(now, ready_at) + self.per_chat_interval
+        if ready_at > now:
+            await asyncio.sleep(ready_at - now)
+        # Не даём словарю расти без ограничений
+        if len(self._chat_next) > 10000:
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+
+    def _enqueue(self, broadcast_id, text, chat_ids, sent, failed):
+        self._texts[broadcast_id] = text
+        self._progress[broadcast_id] = {
+            "total": sent + failed + len(chat_ids), "sent": sent, "failed": failed, "message": None,
+            "reported_at": 0.0,
+        }
+        for chat_id in chat_ids:
+            self._queue.put_nowait((broadcast_id, chat_id))
+        if not chat_ids:
+            asyncio.get_running_loop().create_task(self._finish(broadcast_id))
+
+    async def _worker(self):
+        while True:
+            broadcast_id, chat_id = await self._queue.get()
+            try:
+                try:
+                    delivered = await self.send(chat_id, self._texts[broadcast_id])
+                except Exception as e:
+                    # Получатель не должен остаться в ожидании, иначе рассылка никогда не завершится
+                    logger.error(f"Ошибка при отправке рассылки #{broadcast_id} в чат {chat_id}: {e!r}")
+                    delivered = False
+                status = "sent" if delivered else "failed"
+                self.db.submit(self.db.set_recipient_status, broadcast_id, chat_id, status)
+                progress = self._progress[broadcast_id]
+                progress[status] += 1
+                if progress["sent"] + progress["failed"] >= progress["total"]:
+                    await self._finish(broadcast_id)
+                elif time.monotonic() - progress["reported_at"] >= self.progress_interval:
+                    await self._report(broadcast_id)
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике рассылки #{broadcast_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _report(self, broadcast_id, finished=False):
+        """
+        Отправляет или обновляет у администратора сообщение о ходе рассылки.
+        """
+        progress = self._progress[broadcast_id]
+        progress["reported_at"] = time.monotonic()
+        text = (
+            f"Рассылка #{broadcast_id} {'завершена' if finished else 'выполняется'}.\n"
+            f"Отправлено: {progress['sent']}, не доставлено: {progress['failed']}, всего: {progress['total']}."
+        )
+        try:
+            if progress["message"] is None:
+                progress["message"] = await self.bot.send_message(self.admin_id, text)
+            else:
+                await self.bot.edit_message_text(text, self.admin_id, progress["message"].message_id)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось обновить отчёт о рассылке #{broadcast_id}: {e}")
+
+    async def _finish(self, broadcast_id):
+        await self.db.run(self.db.finish_broadcast, broadcast_id)
+        await self._report(broadcast_id, finished=True)
+        logger.info(f"Рассылка #{broadcast_id} завершена: {self._progress[broadcast_id]}")
+        del self._progress[broadcast_id]
+        del self._texts[broadcast_id]
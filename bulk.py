@@ -0,0 +1,99 @@
+import csv
+import io
+import json
+
+# Ограничение размера загружаемого файла, байт
+MAX_DOCUMENT_SIZE = 5 * 1024 * 1024
+# Допустимое число дней в одной строке (не больше 10 лет)
+MAX_DAYS = 3650
+
+
+def parse_accounts_document(data, filename):
+    """
+    Разбирает файл массового создания/продления учётных записей.
+    CSV: строки «логин,дней[,пароль]», строка заголовка необязательна.
+    JSON: список объектов {"login", "days", "password"} или словарь {логин: дней}.
+    :param data: Содержимое файла (bytes).
+    :param filename: Имя файла, по расширению выбирается формат.
+    :return: Список кортежей (логин, дней, пароль или None) и список описаний ошибочных строк.
+    :raise ValueError: Если файл не разбирается как JSON нужного вида.
+    """
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        document = json.loads(text)
+        if not isinstance(document, (list, dict)):
+            raise ValueError("JSON должен содержать список объектов или словарь {логин: дней}")
+        rows = _json_rows(document)
+    else:
+        rows = _csv_rows(text)
+
+    items, errors, seen = [], [], set()
+    for line_no, login, days, password in rows:
+        login = str(login or "").strip()
+        parsed = _parse_days(days)
+        if parsed is None:
+            errors.append(f"{line_no}: неверное число дней «{days}»")
+            continue
+        days = parsed
+        if not login or any(c.isspace() for c in login):
+            errors.append(f"{line_no}: неверный логин «{login}»")
+        elif not 1 <= days <= MAX_DAYS:
+            errors.append(f"{line_no}: число дней должно быть от 1 до {MAX_DAYS}")
+        elif login in seen:
+            errors.append(f"{line_no}: логин {login} повторяется")
+        else:
+            seen.add(login)
+            items.append((login, days, str(password).strip() if password else None))
+    return items, errors
+
+
+def _parse_days(value):
+    """
+    Приводит число дней к int. Логические значения JSON и дробные числа (1.9) не принимаются.
+    :return: Число дней или None, если значение не является целым числом.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        try:
+            return int(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def _csv_rows(text):
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), 1):
+        if not row or not "".join(row).strip():
+            continue
+        if line_no == 1 and len(row) > 1 and not row[1].strip().lstrip("-").isdigit():
+            continue  # Заголовок
+        yield line_no, row[0], row[1] if len(row) > 1 else None, row[2] if len(row) > 2 else None
+
+
+def _json_rows(data):
+    if isinstance(data, dict):
+        for line_no, (login, days) in enumerate(data.items(), 1):
+            yield line_no, login, days, None
+        return
+    for line_no, item in enumerate(data, 1):
+        if not isinstance(item, dict):
+            yield line_no, None, None, None
+            continue
+        yield line_no, item.get("login"), item.get("days"), item.get("password")
+
+
+def accounts_csv(rows):
+    """
+    Формирует CSV с итоговыми данными учётных записей для отправки администратору.
+    :param rows: Кортежи (логин, пароль, срок действия, действие).
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["login", "password", "expiry", "action"])
+    writer.writerows(rows)
+    return output.getvalue().encode("utf-8")
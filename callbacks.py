@@ -0,0 +1,258 @@
+import logging
+import string
+
+logger = logging.getLogger("callbacks")
+
+# Версия формата callback_data: первый символ данных кнопки
+VERSION = "1"
+SEP = "|"
+# Ограничение Telegram на размер callback_data, байт
+MAX_DATA_BYTES = 64
+
+_DIGITS = string.digits + string.ascii_lowercase
+
+
+def _encode_int(value):
+    # Целые числа записываются в 36-ричной системе: ID пользователя занимает 7 символов вместо 10
+    if value < 0:
+        return "-" + _encode_int(-value)
+    digits = ""
+    while True:
+        value, rest = divmod(value, 36)
+        digits = _DIGITS[rest] + digits
+        if not value:
+            return digits
+
+
+class CallbackAction:
+    """
+    Схема данных одной кнопки: короткий код действия и типизированные поля (int или str).
+    Данные кнопки имеют вид "<версия><код>|поле|поле"; поля в конце можно опустить,
+    тогда при разборе они равны None. Разделитель допустим только в последнем поле.
+    """
+
+    def __init__(self, code, name, *fields):
+        """
+        :param code: Короткий код действия в callback_data (None — кнопка встречается только в старых сообщениях).
+        :param name: Имя действия для логов и метрик.
+        :param fields: Пары (имя поля, тип).
+        """
+        self.code = code
+        self.name = name
+        self.fields = fields
+
+    def encode(self, **values):
+        """
+        Формирует callback_data.
+        :raise ValueError: Если данные не помещаются в 64 байта или поле содержит разделитель.
+        """
+        parts = []
+        for index, (name, kind) in enumerate(self.fields):
+            value = values.get(name)
+            if value is None:
+                parts.append(None)
+                continue
+            value = _encode_int(value) if kind is int else str(value)
+            if SEP in value and index < len(self.fields) - 1:
+                raise ValueError(f"Поле {name} не может содержать «{SEP}».")
+            parts.append(value)
+        while parts and parts[-1] is None:
+            parts.pop()
+        data = VERSION + self.code + "".join(SEP + (part or "") for part in parts)
+        if len(data.encode()) > MAX_DATA_BYTES:
+            raise ValueError(f"callback_data длиннее {MAX_DATA_BYTES} байт: {data}")
+        return data
+
+    def decode(self, payload):
+        """
+        Разбирает поля одним split по разделителю.
+        :param payload: Часть callback_data после кода действия и первого разделителя.
+        :return: Словарь значений полей.
+        """
+        values = dict.fromkeys(name for name, _ in self.fields)
+        if payload is None or not self.fields:
+            return values
+        for (name, kind), value in zip(self.fields, payload.split(SEP, len(self.fields) - 1)):
+            if kind is int:
+                values[name] = int(value, 36) if value else None
+            else:
+                values[name] = value
+        return values
+
+
+# ====== Действия кнопок ======
+MAIN_MENU = CallbackAction("m", "main_menu")
+PAY = CallbackAction("p", "pay")
+STATUS = CallbackAction("s", "status")
+GET_ACCOUNT = CallbackAction("g", "get_account")
+TRIAL = CallbackAction("t", "trial")
+PAY_SBP = CallbackAction("ps", "pay_sbp")
+PAY_TG_WALLET = CallbackAction("pw", "pay_tg_wallet")
+SBP_AMOUNT = CallbackAction("sa", "topup_sbp_amount", ("amount", int))
+SBP_PAID = CallbackAction("sp", "topup_sbp_paid", ("amount", int), ("payment_id", str))
+TG_WALLET_AMOUNT = CallbackAction("wa", "topup_tg_wallet_amount", ("amount", int))
+TG_WALLET_PAID = CallbackAction("wp", "topup_tg_wallet_paid", ("amount", int), ("payment_id", str))
+DELETE_SUBSCRIPTION = CallbackAction("d", "delete", ("username", str))
+# op: "n" — вперёд от anchor, "p" — назад; логин-граница последним полем, так как может содержать что угодно
+SUBSCRIBERS = CallbackAction(
+    "b", "subs", ("op", str), ("prefix", str), ("expiry_from", str), ("expiry_to", str), ("anchor", str)
+)
+# op: "n" — страница, "c"/"r" — один платёж, "ca"/"ra" — вся страница из count платежей до payment_id
+PENDING = CallbackAction("q", "pend", ("op", str), ("anchor", str), ("payment_id", str), ("count", int))
+
+# Кнопки из сообщений, отправленных до очереди /pending, новые такие не создаются
+CONFIRM_SBP = CallbackAction(None, "topup_confirm_sbp")
+CONFIRM_TG_WALLET = CallbackAction(None, "topup_confirm_tg_wallet")
+TOPUP_REJECT = CallbackAction(None, "topup_reject")
+PAYMENT_REJECT = CallbackAction(None, "payment_reject")
+REJECT = CallbackAction(None, "reject")
+
+ACTIONS = {
+    action.code: action for action in (
+        MAIN_MENU, PAY, STATUS, GET_ACCOUNT, TRIAL, PAY_SBP, PAY_TG_WALLET, SBP_AMOUNT, SBP_PAID,
+        TG_WALLET_AMOUNT, TG_WALLET_PAID, DELETE_SUBSCRIPTION, SUBSCRIBERS, PENDING,
+    )
+}
+
+
+# ====== Старый формат callback_data ======
+class _TrieNode:
+    __slots__ = ("children", "exact", "prefix")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None
+        self.prefix = None
+
+
+_legacy_root = _TrieNode()
+
+
+def _legacy(key, action, parser=None):
+    """
+    Регистрирует разбор старого формата: без parser — точное совпадение, иначе префикс,
+    а parser получает остаток строки и возвращает значения полей.
+    """
+    node = _legacy_root
+    for char in key:
+        node = node.children.setdefault(char, _TrieNode())
+    if parser is None:
+        node.exact = action
+    else:
+        node.prefix = (action, parser)
+
+
+def _decode_legacy(data):
+    node, match = _legacy_root, None
+    for index, char in enumerate(data):
+        node = node.children.get(char)
+        if node is None:
+            break
+        if node.prefix is not None:
+            match = (node.prefix, index + 1)
+    else:
+        if node.exact is not None:
+            return node.exact, {}
+    if match is None:
+        return None, None
+    (action, parser), end = match
+    return action, parser(data[end:])
+
+
+def _amount_and_id(rest):
+    amount, payment_id = rest.split("_", 1)
+    return {"amount": int(amount), "payment_id": payment_id}
+
+
+def _id_and_amount(rest):
+    payment_id, amount = rest.rsplit("_", 1)
+    return {"amount": int(amount), "payment_id": payment_id}
+
+
+def _confirm(rest):
+    user_id, amount, payment_id = rest.split("_", 2)
+    return {"user_id": int(user_id), "amount": int(amount), "payment_id": payment_id}
+
+
+def _subscribers(rest):
+    op, rest = rest.split(":", 1)
+    anchor, prefix, expiry_from, expiry_to = rest.rsplit(":", 3)
+    return {"op": op, "prefix": prefix, "expiry_from": expiry_from, "expiry_to": expiry_to, "anchor": anchor}
+
+
+def _pending(rest):
+    parts = rest.split(":")
+    values = {"op": parts[0], "anchor": parts[1] if len(parts) > 1 else "", "payment_id": None, "count": None}
+    if values["op"] in ("c", "r"):
+        values["payment_id"] = parts[2]
+    elif values["op"] in ("ca", "ra"):
+        values["count"], values["payment_id"] = int(parts[2]), parts[3]
+    return values
+
+
+for _key, _action in (("main_menu", MAIN_MENU), ("pay", PAY), ("status", STATUS), ("get_account", GET_ACCOUNT),
+                      ("trial", TRIAL), ("pay_sbp", PAY_SBP), ("pay_tg_wallet", PAY_TG_WALLET)):
+    _legacy(_key, _action)
+_legacy("topup_sbp_amount_", SBP_AMOUNT, lambda rest: {"amount": int(rest)})
+_legacy("topup_sbp_paid_", SBP_PAID, _amount_and_id)
+_legacy("topup_tg_wallet_amount_", TG_WALLET_AMOUNT, lambda rest: {"amount": int(rest)})
+_legacy("topup_tg_wallet_paid_", TG_WALLET_PAID, _id_and_amount)
+_legacy("topup_confirm_sbp_", CONFIRM_SBP, _confirm)
+_legacy("topup_confirm_tg_wallet_", CONFIRM_TG_WALLET, _confirm)
+_legacy("topup_reject_", TOPUP_REJECT, lambda rest: {"user_id": int(rest.rsplit("_", 1)[-1])})
+_legacy("payment_reject_", PAYMENT_REJECT, lambda rest: {"payment_id": rest})
+_legacy("reject_", REJECT, lambda rest: {"user_id": int(rest)})
+# Логин целиком, в том числе с подчёркиваниями
+_legacy("delete_", DELETE_SUBSCRIPTION, lambda rest: {"username": rest})
+_legacy("subs:", SUBSCRIBERS, _subscribers)
+_legacy("pend:", PENDING, _pending)
+
+
+def decode(data):
+    """
+    Разбирает callback_data нового или старого формата.
+    :return: (CallbackAction, словарь значений полей) или (None, None), если кнопка не распознана.
+    """
+    data = data or ""
+    try:
+        if data[:1].isdigit():
+            if not data.startswith(VERSION):
+                return None, None
+            head, sep, payload = data.partition(SEP)
+            action = ACTIONS.get(head[len(VERSION):])
+            if action is None:
+                return None, None
+            return action, action.decode(payload if sep else None)
+        return _decode_legacy(data)
+    except (ValueError, IndexError):
+        return None, None
+
+
+class CallbackRouter:
+    """
+    Единая точка обработки нажатий кнопок: действие определяется по коду
+    (или по префиксному дереву для старых кнопок), обработчик ищется в словаре.
+    Обработчик вызывается с callback_query и значениями полей как именованными аргументами.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def route(self, *actions):
+        """
+        Декоратор, назначающий обработчик одному или нескольким действиям.
+        """
+        def decorator(handler):
+            for action in actions:
+                self._handlers[action] = handler
+            return handler
+        return decorator
+
+    async def dispatch(self, callback_query):
+        action, values = decode(callback_query.data)
+        handler = self._handlers.get(action)
+        if handler is None:
+            logger.warning(f"Нераспознанная кнопка: {callback_query.data!r}")
+            await callback_query.answer("Кнопка устарела. Откройте меню заново: /start", show_alert=True)
+            return
+        return await handler(callback_query, **values)
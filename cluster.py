@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+logger = logging.getLogger("cluster")
+
+LEADER_LEASE = "leader"
+
+
+class Cluster:
+    """
+    Согласование нескольких процессов бота, работающих с общей базой SQLite.
+    Процессы соревнуются за аренду роли ведущего: ведущий выполняет отложенные
+    задачи, рассылки, очистку подписок и единственный пишет accs.db.
+    Аренда продлевается каждые interval секунд; если ведущий пропал,
+    по истечении lease_ttl роль перехватывает другой процесс.
+
+    В режиме одного процесса (enabled=False) процесс сразу становится ведущим,
+    а аренда и периодические проверки не используются.
+    """
+
+    def __init__(self, db, worker_id, enabled=False, lease_ttl=15.0, interval=5.0):
+        """
+        :param db: Экземпляр database.db.Database.
+        :param worker_id: Уникальное имя процесса.
+        :param enabled: Включён ли режим нескольких процессов.
+        :param lease_ttl: Срок аренды роли ведущего в секундах.
+        :param interval: Период продления аренды и синхронизации в секундах.
+        """
+        self.db = db
+        self.worker_id = worker_id
+        self.enabled = enabled
+        self.lease_ttl = lease_ttl
+        self.interval = interval
+        self.is_leader = False
+        self._handlers = {"elected": [], "demoted": [], "tick": []}
+        self._task = None
+
+    def register(self, event, handler):
+        """
+        Регистрирует корутину на событие: "elected" (процесс стал ведущим),
+        "demoted" (потерял роль) или "tick" (каждые interval секунд, во всех процессах).
+        """
+        self._handlers[event].append(handler)
+
+    async def start(self):
+        if not self.enabled:
+            self.is_leader = True
+            await self._emit("elected")
+            return
+        await self._step()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.enabled and self.is_leader:
+            # Освобождаем роль сразу, не дожидаясь истечения аренды
+            await self.db.run(self.db.release_lease, LEADER_LEASE, self.worker_id)
+        self.is_leader = False
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._step()
+
+    async def _step(self):
+        try:
+            leader = await self.db.run(self.db.acquire_lease, LEADER_LEASE, self.worker_id, self.lease_ttl)
+        except Exception as e:
+            logger.error(f"Не удалось продлить аренду роли ведущего: {e}")
+            leader = False
+        if leader != self.is_leader:
+            self.is_leader = leader
+            logger.info(f"Процесс {self.worker_id} {'стал ведущим' if leader else 'больше не ведущий'}.")
+            await self._emit("elected" if leader else "demoted")
+        await self._emit("tick")
+
+    async def _emit(self, event):
+        for handler in self._handlers[event]:
+            try:
+                await handler()
+            except Exception as e:
+                logger.error(f"Ошибка в обработчике события {event}: {e}")
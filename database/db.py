@@ -1,44 +1,770 @@
+import asyncio
+import json
+import logging
+import os
 import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-def init_db():
-    conn = sqlite3.connect("database/users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        telegram_id INTEGER UNIQUE,
-        username TEXT,
-        subscription_expiry DATE
-    )
-    """)
-    conn.commit()
-    conn.close()
-
-def add_user(telegram_id, username):
-    conn = sqlite3.connect("database/users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT OR IGNORE INTO users (telegram_id, username, subscription_expiry)
-    VALUES (?, ?, NULL)
-    """, (telegram_id, username))
-    conn.commit()
-    conn.close()
-
-def update_subscription(telegram_id, expiry_date):
-    conn = sqlite3.connect("database/users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-    UPDATE users SET subscription_expiry = ? WHERE telegram_id = ?
-    """, (expiry_date, telegram_id))
-    conn.commit()
-    conn.close()
-
-def get_subscription_status(telegram_id):
-    conn = sqlite3.connect("database/users.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-    SELECT subscription_expiry FROM users WHERE telegram_id = ?
-    """, (telegram_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+logger = logging.getLogger("db")
+
+DB_PATH = os.environ.get("USERS_DB_PATH", "database/users.db")
+
+# Запись журнала платежей; id — уникальный идентификатор из комментария к переводу
+Payment = namedtuple("Payment", ["id", "user_id", "method", "amount", "status", "created_at", "updated_at"])
+PAYMENT_COLUMNS = "id, user_id, method, amount, status, created_at, updated_at"
+
+# Формат срока действия подписки (старые записи могут содержать только дату)
+EXPIRY_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class Database:
+    """
+    Постоянное подключение к SQLite в режиме WAL.
+    Запросы из обработчиков выполняются в отдельном потоке через run(),
+    чтобы не блокировать цикл событий.
+    """
+
+    def __init__(self, path=DB_PATH, track_changes=False):
+        """
+        :param path: Путь к файлу базы данных.
+        :param track_changes: Вести журнал изменённых учётных записей и пробных периодов
+                              (нужен, когда с базой работают несколько процессов бота).
+        """
+        self.path = path
+        self.track_changes = track_changes
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("PRAGMA busy_timeout=5000")
+
+    async def run(self, func, *args):
+        """
+        Выполняет метод базы в фоновом потоке.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def submit(self, func, *args):
+        """
+        Ставит запись в очередь фонового потока, не дожидаясь результата.
+        Задачи выполняются строго в порядке постановки.
+        """
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(_log_failure)
+        return future
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+    # ====== Схема ======
+    def init_db(self):
+        with self._lock, self._conn:
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE,
+                username TEXT,
+                subscription_expiry DATE
+            )
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(users)")}
+            # Логин и пароль TorrServer добавлены позже исходной схемы
+            if "login" not in columns:
+                self._conn.execute("ALTER TABLE users ADD COLUMN login TEXT")
+            if "password" not in columns:
+                self._conn.execute("ALTER TABLE users ADD COLUMN password TEXT")
+            self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_login ON users (login)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_users_expiry ON users (subscription_expiry)")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS trial_usage (
+                telegram_id INTEGER PRIMARY KEY,
+                used_at TEXT
+            )
+            """)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                run_at TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_run_at ON jobs (run_at)")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text TEXT NOT NULL,
+                created_at TEXT,
+                finished_at TEXT
+            )
+            """)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS broadcast_recipients (
+                broadcast_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                PRIMARY KEY (broadcast_id, chat_id)
+            )
+            """)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS payments (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                method TEXT NOT NULL,
+                amount INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_status ON payments (status, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_user ON payments (user_id, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_payments_created ON payments (created_at)")
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_payments_queue ON payments (status, updated_at, id)"
+            )
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                at REAL NOT NULL
+            )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_changes_at ON changes (at)")
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+            self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+            """)
+
+    def get_meta(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT INTO meta (key, value) VALUES (?, ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (key, value))
+
+    # ====== Пользователи ======
+    def add_user(self, telegram_id, username):
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT OR IGNORE INTO users (telegram_id, username, subscription_expiry)
+            VALUES (?, ?, NULL)
+            """, (telegram_id, username))
+
+    def update_subscription(self, telegram_id, expiry_date):
+        with self._lock, self._conn:
+            self._conn.execute("""
+            UPDATE users SET subscription_expiry = ? WHERE telegram_id = ?
+            """, (expiry_date, telegram_id))
+
+    def get_subscription_status(self, telegram_id):
+        with self._lock:
+            result = self._conn.execute("""
+            SELECT subscription_expiry FROM users WHERE telegram_id = ?
+            """, (telegram_id,)).fetchone()
+        return result[0] if result else None
+
+    # ====== Учётные записи TorrServer ======
+    def export_accounts(self):
+        """
+        Возвращает номер последней записи журнала изменений и словарь {логин: пароль}
+        для выгрузки accs.db из общей базы.
+        """
+        seq = self.last_change()
+        accs, _ = self.load_accounts()
+        return seq, accs
+
+    def load_accounts(self):
+        """
+        Возвращает словари {логин: пароль} и {логин: срок действия}.
+        """
+        accs, expiry = {}, {}
+        with self._lock:
+            rows = self._conn.execute("""
+            SELECT login, password, subscription_expiry FROM users WHERE login IS NOT NULL ORDER BY id
+            """).fetchall()
+        for login, password, expiry_str in rows:
+            if password is not None:
+                accs[login] = password
+            if expiry_str is not None:
+                expiry[login] = expiry_str
+        return accs, expiry
+
+    def apply_accounts(self, upserts, deletes):
+        """
+        Применяет пачку изменений учётных записей одной транзакцией.
+        :param upserts: Список кортежей (логин, telegram_id или None, пароль, срок действия).
+        :param deletes: Список логинов для удаления.
+        """
+        with self._lock, self._conn:
+            for login in deletes:
+                self._conn.execute("DELETE FROM users WHERE login = ? AND telegram_id IS NULL", (login,))
+                self._conn.execute("""
+                UPDATE users SET login = NULL, password = NULL, subscription_expiry = NULL WHERE login = ?
+                """, (login,))
+            for login, telegram_id, password, expiry_str in upserts:
+                self._upsert_account(login, telegram_id, password, expiry_str)
+            self._log_changes("account", [*deletes, *(row[0] for row in upserts)])
+
+    def extend_accounts(self, extensions, now):
+        """
+        Создаёт или продлевает подписки в транзакции BEGIN IMMEDIATE. Новый срок
+        отсчитывается от срока в базе, а не от копии в памяти процесса, поэтому
+        продления одного пользователя из разных процессов бота не теряются.
+        :param extensions: Кортежи (логин, telegram_id или None, пароль для новой учётной записи, дней).
+        :param now: Текущее время.
+        :return: Список (логин, пароль, срок действия) в порядке extensions.
+        """
+        accounts, results = {}, []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for login, telegram_id, password, days in extensions:
+                    if login not in accounts:
+                        row = self._conn.execute(
+                            "SELECT password, subscription_expiry FROM users WHERE login = ?", (login,)
+                        ).fetchone()
+                        current_password, current_expiry = row if row is not None else (None, None)
+                        accounts[login] = (telegram_id, current_password or password, current_expiry)
+                    telegram_id, password, current_expiry = accounts[login]
+                    expiry_str = extend_expiry(current_expiry, now, days)
+                    accounts[login] = (telegram_id, password, expiry_str)
+                    results.append((login, password, expiry_str))
+                for login, (telegram_id, password, expiry_str) in accounts.items():
+                    self._upsert_account(login, telegram_id, password, expiry_str)
+                self._log_changes("account", list(accounts))
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return results
+
+    def _upsert_account(self, login, telegram_id, password, expiry_str):
+        cursor = self._conn.execute("""
+        UPDATE users SET password = ?, subscription_expiry = ? WHERE login = ?
+        """, (password, expiry_str, login))
+        if cursor.rowcount:
+            return
+        self._conn.execute("""
+        INSERT INTO users (telegram_id, login, password, subscription_expiry) VALUES (?, ?, ?, ?)
+        ON CONFLICT(telegram_id) DO UPDATE SET
+            login = excluded.login, password = excluded.password,
+            subscription_expiry = excluded.subscription_expiry
+        """, (telegram_id, login, password, expiry_str))
+
+    def expiring_between(self, start, end=None):
+        """
+        Возвращает (логин, срок действия) для подписок, истекающих в промежутке [start, end),
+        используя индекс по сроку действия.
+        """
+        query = "SELECT login, subscription_expiry FROM users WHERE login IS NOT NULL AND subscription_expiry >= ?"
+        params = [start]
+        if end is not None:
+            query += " AND subscription_expiry < ?"
+            params.append(end)
+        with self._lock:
+            return self._conn.execute(query + " ORDER BY subscription_expiry", params).fetchall()
+
+    def expired_before(self, moment, limit=1000, after=None):
+        """
+        Возвращает до limit пар (логин, срок действия) для подписок, истёкших раньше moment,
+        по возрастанию (срок действия, логин).
+        :param after: Последняя пара (логин, срок действия) предыдущей страницы: следующая
+                      страница начинается строго после неё (keyset-пагинация).
+        """
+        query = "SELECT login, subscription_expiry FROM users WHERE login IS NOT NULL AND subscription_expiry < ?"
+        params = [moment]
+        if after is not None:
+            query += " AND (subscription_expiry, login) > (?, ?)"
+            params += [after[1], after[0]]
+        with self._lock:
+            return self._conn.execute(
+                query + " ORDER BY subscription_expiry, login LIMIT ?", params + [limit]
+            ).fetchall()
+
+    def browse_accounts(self, prefix="", expiry_from=None, expiry_to=None, after=None, before=None, limit=10):
+        """
+        Возвращает страницу подписок (логин, срок действия) по возрастанию логина.
+        Страницы отсчитываются от граничного логина (keyset-пагинация по индексу логинов),
+        поэтому стоимость запроса не зависит от номера страницы.
+        :param prefix: Префикс логина.
+        :param expiry_from: Срок действия не раньше этой даты.
+        :param expiry_to: Срок действия раньше этой даты.
+        :param after: Следующая страница: логины строго после after.
+        :param before: Предыдущая страница: логины строго перед before.
+        :return: (строки страницы, есть ли ещё строки в направлении листания).
+        """
+        query = "SELECT login, subscription_expiry FROM users WHERE login IS NOT NULL AND subscription_expiry IS NOT NULL"
+        params = []
+        if prefix:
+            query += " AND login >= ? AND login < ?"
+            params += [prefix, prefix + "\U0010ffff"]
+        if expiry_from:
+            query += " AND subscription_expiry >= ?"
+            params.append(expiry_from)
+        if expiry_to:
+            query += " AND subscription_expiry < ?"
+            params.append(expiry_to)
+        if before is not None:
+            query += " AND login < ? ORDER BY login DESC LIMIT ?"
+            params += [before, limit + 1]
+        else:
+            if after is not None:
+                query += " AND login > ?"
+                params.append(after)
+            query += " ORDER BY login LIMIT ?"
+            params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before is not None:
+            rows.reverse()
+        return rows, has_more
+
+    def active_subscribers(self, moment):
+        """
+        Возвращает Telegram ID пользователей с подпиской, действующей на момент moment.
+        """
+        with self._lock:
+            rows = self._conn.execute("""
+            SELECT telegram_id FROM users
+            WHERE telegram_id IS NOT NULL AND login IS NOT NULL AND subscription_expiry >= ?
+            """, (moment,)).fetchall()
+        return [row[0] for row in rows]
+
+    # ====== Пробный период ======
+    def load_trial_users(self):
+        """
+        Возвращает множество Telegram ID пользователей, использовавших пробный период.
+        """
+        with self._lock:
+            return {row[0] for row in self._conn.execute("SELECT telegram_id FROM trial_usage")}
+
+    def add_trial_users(self, trials):
+        """
+        Дописывает пачку пар (Telegram ID, время активации) пробного периода.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO trial_usage (telegram_id, used_at) VALUES (?, ?)", trials
+            )
+            self._log_changes("trial", [telegram_id for telegram_id, _ in trials])
+
+    def claim_trial_user(self, telegram_id, used_at):
+        """
+        Отмечает использование пробного периода, если его ещё не было.
+        :return: True, если отметка сделана этим вызовом.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO trial_usage (telegram_id, used_at) VALUES (?, ?)", (telegram_id, used_at)
+            )
+            if cursor.rowcount:
+                self._log_changes("trial", [telegram_id])
+        return bool(cursor.rowcount)
+
+    # ====== Платежи ======
+    def create_payment(self, payment_id, user_id, method, amount):
+        """
+        Регистрирует платёж при выборе тарифа (статус created).
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT OR IGNORE INTO payments (id, user_id, method, amount, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'created', ?, ?)
+            """, (payment_id, user_id, method, amount, now, now))
+
+    def submit_payment(self, payment_id, user_id, method, amount):
+        """
+        Переводит платёж в ожидание проверки (created → pending), когда пользователь нажал «Оплатил».
+        Платёж, не зарегистрированный заранее, создаётся сразу в статусе pending.
+        :return: True, если статус изменён этим вызовом (повторное нажатие вернёт False).
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            cursor = self._conn.execute("""
+            INSERT INTO payments (id, user_id, method, amount, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, 'pending', ?, ?)
+            ON CONFLICT(id) DO UPDATE SET status = 'pending', updated_at = excluded.updated_at
+            WHERE payments.status = 'created' AND payments.user_id = excluded.user_id
+            """, (payment_id, user_id, method, amount, now, now))
+        return bool(cursor.rowcount)
+
+    def set_payment_status(self, payment_id, status, expected):
+        """
+        Меняет статус платежа, только если текущий статус равен expected.
+        Повторное подтверждение или отклонение того же платежа ничего не меняет.
+        :return: True, если статус изменён этим вызовом.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "UPDATE payments SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (status, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), payment_id, expected)
+            )
+        return bool(cursor.rowcount)
+
+    def set_payments_status(self, payment_ids, status, expected):
+        """
+        Меняет статус пачки платежей одной транзакцией (только тех, чей статус равен expected).
+        :return: Список id платежей, статус которых изменён этим вызовом.
+        """
+        changed = []
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self._lock, self._conn:
+            for payment_id in payment_ids:
+                if self._conn.execute(
+                    "UPDATE payments SET status = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (status, now, payment_id, expected)
+                ).rowcount:
+                    changed.append(payment_id)
+        return changed
+
+    def get_payments(self, payment_ids):
+        """
+        Возвращает платежи по списку id (отсутствующие пропускаются).
+        """
+        query = f"SELECT {PAYMENT_COLUMNS} FROM payments WHERE id = ?"
+        with self._lock:
+            rows = [self._conn.execute(query, (payment_id,)).fetchone() for payment_id in payment_ids]
+        return [Payment(*row) for row in rows if row]
+
+    def pending_payments(self, after=None, limit=10):
+        """
+        Возвращает страницу очереди ожидающих проверки платежей в порядке поступления.
+        :param after: Пара (время перехода в ожидание, id) последнего платежа предыдущей страницы.
+        :return: (платежи, есть ли ещё платежи после страницы).
+        """
+        query = f"SELECT {PAYMENT_COLUMNS} FROM payments WHERE status = 'pending'"
+        params = []
+        if after is not None:
+            query += " AND (updated_at, id) > (?, ?)"
+            params += list(after)
+        query += " ORDER BY updated_at, id LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [Payment(*row) for row in rows[:limit]], len(rows) > limit
+
+    def count_payments(self, status):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM payments WHERE status = ?", (status,)).fetchone()[0]
+
+    def get_payment(self, payment_id):
+        with self._lock:
+            row = self._conn.execute(f"SELECT {PAYMENT_COLUMNS} FROM payments WHERE id = ?", (payment_id,)).fetchone()
+        return Payment(*row) if row else None
+
+    def payment_history(self, user_id=None, status=None, since=None, limit=20):
+        """
+        Возвращает последние платежи (новые первыми) с отбором по пользователю, статусу
+        и времени создания; каждый вариант отбора покрыт индексом.
+        """
+        query = f"SELECT {PAYMENT_COLUMNS} FROM payments WHERE 1 = 1"
+        params = []
+        if user_id is not None:
+            query += " AND user_id = ?"
+            params.append(user_id)
+        if status is not None:
+            query += " AND status = ?"
+            params.append(status)
+        if since is not None:
+            query += " AND created_at >= ?"
+            params.append(since)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [Payment(*row) for row in self._conn.execute(query, params).fetchall()]
+
+    def payment_totals(self, since):
+        """
+        Сводка для сверки: количество и сумма платежей по способу оплаты и статусу с момента since.
+        """
+        with self._lock:
+            return self._conn.execute("""
+            SELECT method, status, COUNT(*), SUM(amount) FROM payments
+            WHERE created_at >= ? GROUP BY method, status ORDER BY method, status
+            """, (since,)).fetchall()
+
+    # ====== Журнал изменений (несколько процессов) ======
+    def _log_changes(self, kind, keys):
+        if self.track_changes and keys:
+            now = time.time()
+            self._conn.executemany(
+                "INSERT INTO changes (kind, key, at) VALUES (?, ?, ?)", [(kind, str(key), now) for key in keys]
+            )
+
+    def last_change(self):
+        """
+        Возвращает номер последней записи журнала изменений.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(seq) FROM changes").fetchone()
+            trimmed = self.get_meta("changes_trimmed_to")
+        return max(row[0] or 0, int(trimmed or 0))
+
+    def load_changes(self, after):
+        """
+        Возвращает изменения, сделанные после записи журнала с номером after.
+        :return: (номер последней записи, {логин: (пароль, срок действия) или None, если удалён},
+                 множество Telegram ID с пробным периодом) или None, если нужные записи
+                 журнала уже удалены и данные нужно перечитать целиком.
+        """
+        with self._lock:
+            trimmed = self.get_meta("changes_trimmed_to")
+            if trimmed is not None and after < int(trimmed):
+                return None
+            rows = self._conn.execute(
+                "SELECT seq, kind, key FROM changes WHERE seq > ? ORDER BY seq", (after,)
+            ).fetchall()
+            accounts, trials = {}, set()
+            for _, kind, key in rows:
+                if kind == "trial":
+                    trials.add(int(key))
+                elif key not in accounts:
+                    row = self._conn.execute(
+                        "SELECT password, subscription_expiry FROM users WHERE login = ?", (key,)
+                    ).fetchone()
+                    accounts[key] = row
+        return (rows[-1][0] if rows else after), accounts, trials
+
+    def trim_changes(self, before):
+        """
+        Удаляет записи журнала изменений старше момента before (Unix time).
+        """
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT MAX(seq) FROM changes WHERE at < ?", (before,)).fetchone()
+            if row[0] is None:
+                return 0
+            cursor = self._conn.execute("DELETE FROM changes WHERE seq <= ?", (row[0],))
+            self._conn.execute("""
+            INSERT INTO meta (key, value) VALUES ('changes_trimmed_to', ?)
+            ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (str(row[0]),))
+        return cursor.rowcount
+
+    # ====== Аренда ролей (несколько процессов) ======
+    def acquire_lease(self, name, holder, ttl):
+        """
+        Захватывает или продлевает аренду роли name на ttl секунд.
+        Чужая аренда перехватывается, только если она истекла.
+        :return: True, если аренда принадлежит holder.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """, (name, holder, now + ttl, now))
+            row = self._conn.execute("SELECT holder FROM leases WHERE name = ?", (name,)).fetchone()
+        return row is not None and row[0] == holder
+
+    def release_lease(self, name, holder):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    # ====== Отложенные задачи ======
+    def save_job(self, job_id, kind, run_at, payload):
+        """
+        Сохраняет задачу; задача с тем же id заменяется.
+        """
+        with self._lock, self._conn:
+            self._conn.execute("""
+            INSERT INTO jobs (id, kind, run_at, payload) VALUES (?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET kind = excluded.kind, run_at = excluded.run_at, payload = excluded.payload
+            """, (job_id, kind, run_at, json.dumps(payload)))
+
+    def save_jobs(self, jobs):
+        """
+        Сохраняет пачку задач (id, вид, время запуска, параметры) одной транзакцией.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("""
+            INSERT INTO jobs (id, kind, run_at, payload) VALUES (?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET kind = excluded.kind, run_at = excluded.run_at, payload = excluded.payload
+            """, [(job_id, kind, run_at, json.dumps(payload)) for job_id, kind, run_at, payload in jobs])
+
+    def delete_job(self, job_id, run_at=None):
+        """
+        Удаляет задачу; если указан run_at — только запланированную на это время.
+        """
+        with self._lock, self._conn:
+            if run_at is None:
+                self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            else:
+                self._conn.execute("DELETE FROM jobs WHERE id = ? AND run_at = ?", (job_id, run_at))
+
+    def delete_jobs_by_id(self, job_ids):
+        """
+        Удаляет пачку задач по id одной транзакцией.
+        """
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+    def claim_jobs(self, jobs):
+        """
+        Забирает наступившие задачи на выполнение, удаляя их одной транзакцией.
+        Задачу, которую уже забрал другой процесс, отменили или перепланировали, удалить не получится.
+        :param jobs: Список пар (id, время запуска).
+        :return: Множество действительно удалённых пар (id, время запуска).
+        """
+        claimed = set()
+        with self._lock, self._conn:
+            for job_id, run_at in jobs:
+                if self._conn.execute("DELETE FROM jobs WHERE id = ? AND run_at = ?", (job_id, run_at)).rowcount:
+                    claimed.add((job_id, run_at))
+        return claimed
+
+    def load_jobs(self, until=None):
+        """
+        Возвращает ожидающие задачи (id, вид, время запуска, параметры) по возрастанию времени.
+        :param until: Если задано — только задачи со временем запуска не позже until.
+        """
+        query, params = "SELECT id, kind, run_at, payload FROM jobs", []
+        if until is not None:
+            query += " WHERE run_at <= ?"
+            params.append(until)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY run_at", params).fetchall()
+        return [(job_id, kind, run_at, json.loads(payload)) for job_id, kind, run_at, payload in rows]
+
+    # ====== Рассылки ======
+    def create_broadcast(self, text, chat_ids):
+        """
+        Сохраняет рассылку вместе со списком получателей.
+        :return: Номер рассылки.
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO broadcasts (text, created_at) VALUES (?, ?)",
+                (text, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            )
+            broadcast_id = cursor.lastrowid
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, chat_id) VALUES (?, ?)",
+                [(broadcast_id, chat_id) for chat_id in chat_ids]
+            )
+        return broadcast_id
+
+    def set_recipient_status(self, broadcast_id, chat_id, status):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcast_recipients SET status = ? WHERE broadcast_id = ? AND chat_id = ?",
+                (status, broadcast_id, chat_id)
+            )
+
+    def finish_broadcast(self, broadcast_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE broadcasts SET finished_at = ? WHERE id = ?",
+                (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), broadcast_id)
+            )
+
+    def load_unfinished_broadcasts(self):
+        """
+        Возвращает незавершённые рассылки: (номер, текст, ожидающие получатели, отправлено, не доставлено).
+        """
+        result = []
+        with self._lock:
+            broadcasts = self._conn.execute(
+                "SELECT id, text FROM broadcasts WHERE finished_at IS NULL ORDER BY id"
+            ).fetchall()
+            for broadcast_id, text in broadcasts:
+                counts = dict(self._conn.execute("""
+                SELECT status, COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ? GROUP BY status
+                """, (broadcast_id,)).fetchall())
+                pending = [row[0] for row in self._conn.execute("""
+                SELECT chat_id FROM broadcast_recipients WHERE broadcast_id = ? AND status = 'pending'
+                """, (broadcast_id,))]
+                result.append((broadcast_id, text, pending, counts.get("sent", 0), counts.get("failed", 0)))
+        return result
+
+    # ====== Перенос из JSON ======
+    def import_json(self, accs_path, expiry_path, trial_usage_path):
+        """
+        Однократно переносит данные из accs.db, expiry.db и trial_usage.db.
+        Повторный вызов ничего не делает.
+        """
+        if self.get_meta("json_imported"):
+            return False
+
+        def read(path, default):
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, "r") as f:
+                    return json.load(f)
+            return default
+
+        accs = read(accs_path, {})
+        expiry = read(expiry_path, {})
+        trial_users = read(trial_usage_path, [])
+
+        upserts = []
+        for login in dict.fromkeys([*accs, *expiry]):
+            upserts.append((login, telegram_id_from_login(login), accs.get(login), expiry.get(login)))
+        self.apply_accounts(upserts, [])
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO trial_usage (telegram_id, used_at) VALUES (?, NULL)",
+                [(int(user_id),) for user_id in trial_users]
+            )
+        self.set_meta("json_imported", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        logger.info(f"Импортировано из JSON учётных записей: {len(upserts)}, пробных периодов: {len(trial_users)}.")
+        return True
+
+
+def _log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"Ошибка фоновой записи в базу: {future.exception()}")
+
+
+def extend_expiry(current_expiry, now, days):
+    """
+    Новый срок действия подписки: days дней от текущего срока или от now, если подписка
+    уже истекла, отсутствует или срок не разбирается.
+    :return: Строка в формате EXPIRY_FORMAT.
+    """
+    current = now
+    if current_expiry:
+        for fmt in (EXPIRY_FORMAT, "%Y-%m-%d"):
+            try:
+                current = datetime.strptime(current_expiry, fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            logger.error(f"Неверный формат срока действия: {current_expiry}")
+    return (max(current, now) + timedelta(days=days)).strftime(EXPIRY_FORMAT)
+
+
+def telegram_id_from_login(login):
+    """
+    Извлекает Telegram ID из логина вида User<ID>; для прочих логинов возвращает None.
+    """
+    if login.startswith("User") and login[4:].isdigit():
+        return int(login[4:])
+    return None
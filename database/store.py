@@ -0,0 +1,488 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+from datetime import datetime
+
+import metrics
+from database.db import extend_expiry, telegram_id_from_login
+
+logger = logging.getLogger("store")
+
+
+def load_json(file_path):
+    """
+    Загрузка данных из JSON-файла.
+    """
+    if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+        started = time.monotonic()
+        with open(file_path, "r") as f:
+            data = json.load(f)
+        metrics.JSON_LOAD_SECONDS.observe(time.monotonic() - started, file=os.path.basename(file_path))
+        return data
+    return {}
+
+
+def save_json(file_path, data):
+    """
+    Атомарное сохранение данных в JSON-файл: запись во временный файл рядом
+    с целевым и переименование поверх него. Читатель (TorrServer) всегда видит
+    либо старую, либо новую версию файла целиком.
+    """
+    started = time.monotonic()
+    directory = os.path.dirname(os.path.abspath(file_path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(file_path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp создаёт файл с правами 0600, а accs.db читает другой процесс
+        mode = stat.S_IMODE(os.stat(file_path).st_mode) if os.path.exists(file_path) else 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    _fsync_directory(directory)
+    name = os.path.basename(file_path)
+    metrics.JSON_SAVE_SECONDS.observe(time.monotonic() - started, file=name)
+    metrics.JSON_BYTES.set(os.path.getsize(file_path), file=name)
+
+
+def _fsync_directory(directory):
+    """
+    Фиксирует на диске запись каталога после переименования (только POSIX).
+    """
+    if os.name != "posix":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Journal:
+    """
+    Журнал изменений (write-ahead log) в формате JSON Lines.
+    Каждое изменение дописывается в конец файла до того, как попадёт в снимок,
+    поэтому после сбоя его можно восстановить повторным применением записей.
+    """
+
+    def __init__(self, path, fsync=True):
+        """
+        :param path: Путь к файлу журнала.
+        :param fsync: Сбрасывать ли каждую запись на диск (os.fsync).
+        """
+        self.path = path
+        self.segment_path = f"{path}.1"
+        self.fsync = fsync
+        self._file = None
+
+    def open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def append(self, record):
+        """
+        Дописывает одну запись в журнал.
+        """
+        self.append_many([record])
+
+    def append_many(self, records):
+        """
+        Дописывает пачку записей с одним сбросом на диск.
+        """
+        if self._file is None:
+            self.open()
+        data = "".join(
+            json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records
+        )
+        self._file.write(data)
+        metrics.STORE_JOURNAL_BYTES.inc(len(data.encode("utf-8")))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def rotate(self):
+        """
+        Переносит накопленные записи в сегмент, который удаляется после успешной
+        записи снимка. Новые изменения продолжают писаться в чистый журнал.
+        """
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.segment_path):
+                # Предыдущий снимок не был записан: дописываем к старому сегменту
+                with open(self.path, "rb") as src, open(self.segment_path, "ab") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.segment_path)
+        self.open()
+
+    def commit(self):
+        """
+        Удаляет сегмент, вошедший в записанный снимок.
+        """
+        if os.path.exists(self.segment_path):
+            os.remove(self.segment_path)
+
+    def replay(self):
+        """
+        Возвращает записи сегмента и журнала в порядке их добавления.
+        Оборванная при сбое последняя строка пропускается.
+        """
+        records = []
+        for path in (self.segment_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line_no, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        logger.warning(f"Пропущена повреждённая запись журнала {path}:{line_no}.")
+        return records
+
+
+class AccountStore:
+    """
+    Общее для процесса хранилище учётных записей TorrServer и сроков действия подписок.
+    Данные читаются из SQLite один раз при старте, чтение идёт из памяти,
+    а изменения сбрасываются в базу и в accs.db в фоне, объединяясь в пачки.
+
+    Каждое изменение сначала дописывается в журнал, поэтому между записями
+    пачек оно не теряется при сбое; при старте журнал применяется повторно.
+
+    Там же хранится множество пользователей, использовавших пробный период:
+    проверка и добавление стоят O(1), а в базу новые записи только дописываются.
+
+    Если с базой работают несколько процессов бота, refresh() подтягивает
+    чужие изменения по журналу изменений базы, а accs.db выгружает из базы
+    один ведущий процесс (у остальных accs_path не задаётся).
+    """
+
+    def __init__(self, db, accs_path, journal_path, flush_delay=5.0):
+        """
+        :param db: Экземпляр database.db.Database.
+        :param accs_path: Путь к файлу учётных записей (читается TorrServer); None — не записывать.
+        :param journal_path: Путь к журналу изменений.
+        :param flush_delay: Задержка в секундах, в течение которой изменения копятся перед записью.
+        """
+        self.db = db
+        self.accs_path = accs_path
+        self.journal = Journal(journal_path)
+        self.flush_delay = flush_delay
+        self._accs = {}
+        self._expiry = {}
+        self._trial_users = set()
+        self._dirty = set()
+        self._new_trials = []
+        self._flush_handle = None
+        self._flush_lock = None
+        self._seen_change = 0
+
+    def load(self):
+        """
+        Загружает учётные записи из базы и восстанавливает изменения из журнала.
+        """
+        started = time.monotonic()
+        self._seen_change = self.db.last_change()
+        self._accs, self._expiry = self.db.load_accounts()
+        self._trial_users = self.db.load_trial_users()
+
+        records = self.journal.replay()
+        for record in records:
+            self._apply(record)
+        if records:
+            logger.info(f"Из журнала восстановлено изменений: {len(records)}.")
+            self.journal.rotate()
+            self._write(*self._take_snapshot())
+            self.journal.commit()
+        else:
+            self.journal.open()
+        metrics.STORE_LOAD_SECONDS.set(time.monotonic() - started)
+
+        logger.info(
+            f"Загружено учётных записей: {len(self._accs)}, сроков действия: {len(self._expiry)}, "
+            f"пробных периодов: {len(self._trial_users)}."
+        )
+
+    def close(self):
+        self.journal.close()
+
+    async def refresh(self):
+        """
+        Применяет изменения, сделанные другими процессами бота.
+        Несохранённые изменения этого процесса не перезаписываются.
+        """
+        changes = await self.db.run(self.db.load_changes, self._seen_change)
+        if changes is None:
+            # Журнал изменений уже очищен дальше, чем мы успели прочитать
+            seq = await self.db.run(self.db.last_change)
+            accs, expiry = await self.db.run(self.db.load_accounts)
+            for username in self._dirty:
+                accs.pop(username, None)
+                expiry.pop(username, None)
+                if username in self._accs:
+                    accs[username] = self._accs[username]
+                if username in self._expiry:
+                    expiry[username] = self._expiry[username]
+            self._accs, self._expiry = accs, expiry
+            self._trial_users |= await self.db.run(self.db.load_trial_users)
+            self._seen_change = seq
+            logger.info("Хранилище учётных записей перечитано из базы целиком.")
+            return
+
+        seq, accounts, trials = changes
+        for username, row in accounts.items():
+            if username in self._dirty:
+                continue
+            password, expiry = row if row is not None else (None, None)
+            for data, value in ((self._accs, password), (self._expiry, expiry)):
+                if value is None:
+                    data.pop(username, None)
+                else:
+                    data[username] = value
+        self._trial_users |= trials
+        self._seen_change = seq
+
+    # ====== Чтение ======
+    def get_password(self, username):
+        return self._accs.get(username)
+
+    def get_expiry(self, username):
+        return self._expiry.get(username)
+
+    def has_account(self, username):
+        return username in self._accs
+
+    def has_used_trial(self, user_id):
+        return user_id in self._trial_users
+
+    def __len__(self):
+        return len(self._expiry)
+
+    # ====== Изменение ======
+    def set_account(self, username, password=None, expiry=None):
+        """
+        Создаёт или обновляет учётную запись и/или срок её действия.
+        """
+        record = {"op": "set", "u": username}
+        if password is not None and self._accs.get(username) != password:
+            record["p"] = password
+        if expiry is not None and self._expiry.get(username) != expiry:
+            record["e"] = expiry
+        if len(record) > 2:
+            self.journal.append(record)
+            self._apply(record)
+            self._schedule_flush()
+
+    def set_accounts(self, accounts):
+        """
+        Создаёт или обновляет пачку учётных записей одной записью журнала на диск.
+        :param accounts: Кортежи (логин, пароль или None, срок действия или None).
+        """
+        records = []
+        for username, password, expiry in accounts:
+            record = {"op": "set", "u": username}
+            if password is not None and self._accs.get(username) != password:
+                record["p"] = password
+            if expiry is not None and self._expiry.get(username) != expiry:
+                record["e"] = expiry
+            if len(record) > 2:
+                records.append(record)
+        if records:
+            self.journal.append_many(records)
+            for record in records:
+                self._apply(record)
+            self._schedule_flush()
+
+    def remove(self, username):
+        """
+        Удаляет учётную запись и срок её действия.
+        :return: True, если пользователь был в хранилище.
+        """
+        if username not in self._accs and username not in self._expiry:
+            return False
+        record = {"op": "del", "u": username}
+        self.journal.append(record)
+        self._apply(record)
+        self._schedule_flush()
+        return True
+
+    def remove_many(self, usernames):
+        """
+        Удаляет пачку учётных записей одной записью журнала на диск.
+        :return: Список действительно удалённых логинов.
+        """
+        removed = [u for u in usernames if u in self._accs or u in self._expiry]
+        records = [{"op": "del", "u": username} for username in removed]
+        if records:
+            self.journal.append_many(records)
+            for record in records:
+                self._apply(record)
+            self._schedule_flush()
+        return removed
+
+    def add_trial_usage(self, user_id):
+        """
+        Отмечает, что пользователь использовал пробный период.
+        """
+        if user_id in self._trial_users:
+            return
+        record = {"op": "trial", "t": user_id, "at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        self.journal.append(record)
+        self._apply(record)
+        self._schedule_flush()
+
+    async def extend_accounts(self, extensions):
+        """
+        Создаёт или продлевает подписки: срок прибавляется к текущему сроку или к текущему моменту.
+        При общей базе нескольких процессов продление выполняется в базе атомарно:
+        копия в памяти может отставать от изменений других процессов на несколько секунд.
+        :param extensions: Кортежи (логин, пароль для новой учётной записи, дней); логин может повторяться.
+        :return: Список (логин, пароль, срок действия) в порядке extensions.
+        """
+        now = datetime.now()
+        if not self.db.track_changes:
+            accounts, results = {}, []
+            for username, password, days in extensions:
+                if username not in accounts:
+                    accounts[username] = (self._accs.get(username) or password, self._expiry.get(username))
+                password, current_expiry = accounts[username]
+                expiry = extend_expiry(current_expiry, now, days)
+                accounts[username] = (password, expiry)
+                results.append((username, password, expiry))
+            self.set_accounts([(username, password, expiry) for username, (password, expiry) in accounts.items()])
+            return results
+
+        # Несохранённые изменения этих пользователей должны попасть в базу раньше продления
+        if any(username in self._dirty for username, _, _ in extensions):
+            await self.flush()
+        results = await self.db.run(self.db.extend_accounts, [
+            (username, telegram_id_from_login(username), password, days) for username, password, days in extensions
+        ], now)
+        # Запись уже в базе: обновляем только копию в памяти, не помечая изменённой
+        for username, password, expiry in results:
+            self._accs[username] = password
+            self._expiry[username] = expiry
+        return results
+
+    async def claim_trial(self, user_id):
+        """
+        Отмечает использование пробного периода, если его ещё не было.
+        При общей базе нескольких процессов проверка выполняется в базе атомарно.
+        :return: True, если пробный период достаётся пользователю.
+        """
+        if user_id in self._trial_users:
+            return False
+        if not self.db.track_changes:
+            self.add_trial_usage(user_id)
+            return True
+        used_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        claimed = await self.db.run(self.db.claim_trial_user, user_id, used_at)
+        self._trial_users.add(user_id)
+        return claimed
+
+    def _apply(self, record):
+        """
+        Применяет запись журнала к данным в памяти. Записи идемпотентны,
+        поэтому повторное применение уже сохранённых изменений безопасно.
+        """
+        if record["op"] == "trial":
+            self._trial_users.add(record["t"])
+            self._new_trials.append((record["t"], record["at"]))
+            return
+        username = record["u"]
+        self._dirty.add(username)
+        if record["op"] == "del":
+            self._accs.pop(username, None)
+            self._expiry.pop(username, None)
+            return
+        if "p" in record:
+            self._accs[username] = record["p"]
+        if "e" in record:
+            self._expiry[username] = record["e"]
+
+    # ====== Запись на диск ======
+    def _schedule_flush(self):
+        """
+        Откладывает запись на flush_delay секунд, чтобы объединить соседние изменения.
+        """
+        if not (self._dirty or self._new_trials) or self._flush_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне цикла событий (скрипты, тесты) пишем сразу.
+            self.journal.rotate()
+            self._write(*self._take_snapshot())
+            self.journal.commit()
+            return
+        self._flush_handle = loop.call_later(self.flush_delay, lambda: loop.create_task(self.flush()))
+
+    def _take_snapshot(self):
+        """
+        Собирает изменённые строки для базы и, если менялись учётные записи,
+        полную копию accs.db для TorrServer.
+        """
+        upserts, deletes = [], []
+        for username in self._dirty:
+            if username in self._accs or username in self._expiry:
+                upserts.append((
+                    username, telegram_id_from_login(username),
+                    self._accs.get(username), self._expiry.get(username)
+                ))
+            else:
+                deletes.append(username)
+        trials, self._new_trials = self._new_trials, []
+        accs = dict(self._accs) if self._dirty and self.accs_path is not None else None
+        self._dirty = set()
+        return upserts, deletes, trials, accs
+
+    def _write(self, upserts, deletes, trials, accs):
+        self.db.apply_accounts(upserts, deletes)
+        self.db.add_trial_users(trials)
+        if accs is not None:
+            save_json(self.accs_path, accs)
+
+    async def flush(self):
+        """
+        Записывает накопленные изменения в базу и accs.db в фоновом потоке.
+        Записи журнала, вошедшие в пачку, удаляются только после успешной записи.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not (self._dirty or self._new_trials):
+                return
+            self.journal.rotate()
+            upserts, deletes, trials, accs = self._take_snapshot()
+            started = time.monotonic()
+            try:
+                await self.db.run(self._write, upserts, deletes, trials, accs)
+                self.journal.commit()
+                metrics.STORE_FLUSH_SECONDS.observe(time.monotonic() - started)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении хранилища учётных записей: {e}")
+                self._dirty.update(row[0] for row in upserts)
+                self._dirty.update(deletes)
+                self._new_trials[:0] = trials
+                self._schedule_flush()
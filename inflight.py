@@ -0,0 +1,51 @@
+import asyncio
+import logging
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger("inflight")
+
+
+class InFlightMiddleware(BaseMiddleware):
+    def __init__(self):
+        """
+        Middleware, отслеживающий количество обновлений в обработке.
+        Нужен для корректного завершения: перед сохранением данных и остановкой
+        дожидаемся, пока уже начатые обработчики закончат работу.
+        """
+        super(InFlightMiddleware, self).__init__()
+        self.in_flight = 0
+        self.closing = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def close(self):
+        """
+        Начало остановки: новые обновления больше не обрабатываются.
+        В режиме polling их offset не подтверждается, и Telegram пришлёт их снова после перезапуска.
+        """
+        self.closing = True
+
+    async def on_pre_process_update(self, update, data):
+        if self.closing:
+            logger.info(f"Обновление {update.update_id} пропущено: бот останавливается.")
+            raise CancelHandler()
+        self.in_flight += 1
+        self._idle.clear()
+
+    async def on_post_process_update(self, update, result, data):
+        self.in_flight -= 1
+        if self.in_flight <= 0:
+            self.in_flight = 0
+            self._idle.set()
+
+    async def wait_idle(self, timeout):
+        """
+        Ждёт завершения всех начатых обработчиков не дольше timeout секунд.
+        :return: True, если все обработчики завершились.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
@@ -0,0 +1,237 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from datetime import datetime
+
+logger = logging.getLogger("jobs")
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Пауза перед повтором, если забрать наступившие задачи из базы не удалось, сек.
+RETRY_DELAY = 5.0
+
+
+class JobScheduler:
+    """
+    Отложенные задачи (напоминания, удаление пробных аккаунтов), сохраняемые в SQLite.
+    Задача определяется своим id: повторное планирование с тем же id заменяет
+    предыдущее, поэтому планировать можно идемпотентно. После перезапуска бота
+    restore() поднимает из базы только ожидающие задачи.
+
+    Все задачи лежат в одной min-куче по времени запуска, и одна фоновая задача
+    просыпается только к ближайшему сроку. Наступившие задачи обрабатываются
+    пачкой по видам. Перепланирование стоит O(log N): в кучу добавляется новая
+    запись, а устаревшая пропускается при извлечении.
+
+    Перед выполнением задачи забираются из базы условным удалением, поэтому
+    даже при нескольких процессах бота каждая задача выполняется один раз.
+    Задачи каждого вида выполняются в своей asyncio-задаче: медленная пачка
+    напоминаний (с ограничением частоты отправки) не задерживает удаление пробных аккаунтов.
+    Куча в памяти есть только у запущенного планировщика; задачи, созданные
+    другими процессами, он подхватывает через poll().
+    """
+
+    def __init__(self, db):
+        """
+        :param db: Экземпляр database.db.Database.
+        """
+        self.db = db
+        self._handlers = {}
+        self._heap = []
+        self._jobs = {}
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._running = set()
+
+    def register(self, kind, handler, batch=False):
+        """
+        Регистрирует корутину-обработчик для задач вида kind.
+        Обработчик вызывается с параметрами задачи как именованными аргументами;
+        при batch=True — один раз со списком параметров всех наступивших задач.
+        """
+        self._handlers[kind] = (handler, batch)
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def schedule(self, job_id, kind, run_at, **payload):
+        """
+        Планирует задачу и сохраняет её в базе (запись выполняется в фоне).
+        """
+        run_at_str = run_at.strftime(TIME_FORMAT)
+        self.db.submit(self.db.save_job, job_id, kind, run_at_str, payload)
+        if self._task is not None:
+            self._push(job_id, kind, run_at, payload)
+
+    def schedule_many(self, jobs):
+        """
+        Планирует пачку задач (id, вид, время запуска, параметры) с одной записью в базу.
+        """
+        self.db.submit(self.db.save_jobs, [
+            (job_id, kind, run_at.strftime(TIME_FORMAT), payload) for job_id, kind, run_at, payload in jobs
+        ])
+        if self._task is not None:
+            for job_id, kind, run_at, payload in jobs:
+                self._push(job_id, kind, run_at, payload)
+
+    def cancel(self, job_id):
+        """
+        Отменяет задачу (в том числе запланированную другим процессом).
+        """
+        self.db.submit(self.db.delete_job, job_id)
+        if self._jobs.pop(job_id, None) is not None:
+            self._compact()
+
+    def cancel_many(self, job_ids):
+        """
+        Отменяет пачку задач с одной записью в базу.
+        """
+        self.db.submit(self.db.delete_jobs_by_id, job_ids)
+        for job_id in job_ids:
+            self._jobs.pop(job_id, None)
+        self._compact()
+
+    async def restore(self):
+        """
+        Восстанавливает ожидающие задачи из базы и запускает обработку.
+        Просроченные за время простоя задачи выполняются сразу.
+        """
+        jobs = await self.db.run(self.db.load_jobs)
+        self._heap = []
+        self._jobs = {}
+        for job_id, kind, run_at, payload in jobs:
+            seq = next(self._counter)
+            run_at = datetime.strptime(run_at, TIME_FORMAT)
+            self._jobs[job_id] = (run_at, seq, kind, payload)
+            self._heap.append((run_at, seq, job_id))
+        heapq.heapify(self._heap)
+        logger.info(f"Восстановлено отложенных задач: {len(jobs)}.")
+        self.start()
+
+    async def poll(self, until):
+        """
+        Добавляет в кучу задачи из базы со сроком до until, которых в ней ещё нет
+        (запланированные другими процессами).
+        """
+        for job_id, kind, run_at, payload in await self.db.run(self.db.load_jobs, until.strftime(TIME_FORMAT)):
+            run_at = datetime.strptime(run_at, TIME_FORMAT)
+            job = self._jobs.get(job_id)
+            if job is None or job[0] != run_at:
+                self._push(job_id, kind, run_at, payload)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Забранные из базы задачи уже не вернуть, поэтому даём им завершиться
+        await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _push(self, job_id, kind, run_at, payload):
+        # Время храним с точностью базы (до секунды), иначе poll() не узнаёт уже известные задачи
+        run_at = run_at.replace(microsecond=0)
+        seq = next(self._counter)
+        self._jobs[job_id] = (run_at, seq, kind, payload)
+        heapq.heappush(self._heap, (run_at, seq, job_id))
+        # Будим цикл, только если новая задача стала ближайшей
+        if self._heap[0][1] == seq:
+            self._wakeup.set()
+
+    def _is_current(self, entry):
+        job = self._jobs.get(entry[2])
+        return job is not None and job[1] == entry[1]
+
+    def _compact(self):
+        """
+        Перестраивает кучу, когда устаревших записей становится больше актуальных.
+        """
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = [entry for entry in self._heap if self._is_current(entry)]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now):
+        """
+        Извлекает все наступившие задачи.
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_current(entry):
+                run_at, _, kind, payload = self._jobs.pop(entry[2])
+                due.append((entry[2], kind, run_at, payload))
+        return due
+
+    async def _run(self):
+        while True:
+            while self._heap and not self._is_current(self._heap[0]):
+                heapq.heappop(self._heap)
+            timeout = None
+            if self._heap:
+                timeout = max((self._heap[0][0] - datetime.now()).total_seconds(), 0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            due = self._pop_due(datetime.now())
+            if not due:
+                continue
+            try:
+                await self._dispatch(due)
+            except Exception:
+                logger.exception(f"Не удалось забрать на выполнение задач: {len(due)}, повтор через {RETRY_DELAY} сек.")
+                # Возвращаем задачи в кучу, если их не перепланировали за это время
+                for job_id, kind, run_at, payload in due:
+                    if job_id not in self._jobs:
+                        self._push(job_id, kind, run_at, payload)
+                await asyncio.sleep(RETRY_DELAY)
+
+    async def _dispatch(self, due):
+        """
+        Одной транзакцией забирает пачку наступивших задач из базы и выполняет их,
+        сгруппировав по видам. Отменённые, перепланированные и уже выполненные
+        другим процессом задачи пропускаются.
+        """
+        claimed = await self.db.run(
+            self.db.claim_jobs, [(job_id, run_at.strftime(TIME_FORMAT)) for job_id, _, run_at, _ in due]
+        )
+        by_kind = {}
+        for job_id, kind, run_at, payload in due:
+            if (job_id, run_at.strftime(TIME_FORMAT)) in claimed:
+                by_kind.setdefault(kind, []).append(payload)
+
+        loop = asyncio.get_running_loop()
+        for kind, payloads in by_kind.items():
+            handler, batch = self._handlers.get(kind, (None, False))
+            if handler is None:
+                logger.error(f"Нет обработчика для задач вида {kind}.")
+                continue
+            task = loop.create_task(self._run_kind(kind, handler, batch, payloads))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+        logger.info(f"Забрано на выполнение отложенных задач: {len(claimed)}.")
+
+    async def _run_kind(self, kind, handler, batch, payloads):
+        if batch:
+            await self._call(kind, handler, payloads)
+        else:
+            for payload in payloads:
+                await self._call(kind, handler, **payload)
+
+    @staticmethod
+    async def _call(kind, handler, *args, **kwargs):
+        try:
+            await handler(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Ошибка при выполнении задачи вида {kind}: {e}")
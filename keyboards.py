@@ -0,0 +1,114 @@
+import json
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+import callbacks
+
+SUPPORT_CHAT_URL = "https://t.me/RUtils_TorrServer_chat"
+
+
+def freeze(keyboard):
+    """
+    Один раз сериализует клавиатуру в JSON для параметра reply_markup.
+    aiogram передаёт строку в Bot API как есть, поэтому статичные клавиатуры
+    не создаются и не сериализуются заново при каждом нажатии кнопки.
+    """
+    return json.dumps(keyboard.to_python())
+
+
+# ====== Клавиатура бота ======
+def build_main_menu():
+    """
+    Создаёт клавиатуру с кнопками под сообщением.
+    """
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        InlineKeyboardButton("💳 Оплатить подписку", callback_data=callbacks.PAY.encode()),
+        InlineKeyboardButton("📅 Проверить статус подписки", callback_data=callbacks.STATUS.encode()),
+        InlineKeyboardButton("🔑 Получить данные учётной записи", callback_data=callbacks.GET_ACCOUNT.encode()),
+        InlineKeyboardButton("🎁 Пробный период", callback_data=callbacks.TRIAL.encode()),
+        InlineKeyboardButton("💬 Чат поддержки", url=SUPPORT_CHAT_URL)
+    )
+    return keyboard
+
+
+# ====== Кнопка чата поддержки ======
+def build_support_chat():
+    """
+    Создаёт клавиатуру с кнопкой для перехода в чат поддержки.
+    """
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("Чат поддержки", url=SUPPORT_CHAT_URL))
+    return keyboard
+
+
+# ====== Кнопка возврата в основное меню ======
+def build_back_to_main_menu():
+    """
+    Создаёт кнопку для возврата в главное меню.
+    """
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data=callbacks.MAIN_MENU.encode()))
+    return keyboard
+
+
+# ====== Оплата ======
+def build_pay_methods():
+    """
+    Создаёт клавиатуру выбора способа оплаты.
+    """
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        InlineKeyboardButton("Оплата через СБП Озон Банк", callback_data=callbacks.PAY_SBP.encode()),
+        InlineKeyboardButton("Оплата через Telegram-кошелёк", callback_data=callbacks.PAY_TG_WALLET.encode()),
+        InlineKeyboardButton("🔙 Главное меню", callback_data=callbacks.MAIN_MENU.encode())
+    )
+    return keyboard
+
+
+def build_sbp_tariffs():
+    """
+    Создаёт клавиатуру тарифов для оплаты через СБП Озон Банк.
+    """
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        InlineKeyboardButton("1 месяц - 100 руб", callback_data=callbacks.SBP_AMOUNT.encode(amount=100)),
+        InlineKeyboardButton("3 месяца - 300 руб", callback_data=callbacks.SBP_AMOUNT.encode(amount=300)),
+        InlineKeyboardButton("6 месяцев - 600 руб", callback_data=callbacks.SBP_AMOUNT.encode(amount=600)),
+        InlineKeyboardButton("🔙 Назад", callback_data=callbacks.PAY.encode())
+    )
+    return keyboard
+
+
+def build_tg_wallet_tariffs():
+    """
+    Создаёт клавиатуру тарифов для оплаты через Telegram-кошелёк.
+    """
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    keyboard.add(
+        InlineKeyboardButton("1 месяц - 1 USDT", callback_data=callbacks.TG_WALLET_AMOUNT.encode(amount=1)),
+        InlineKeyboardButton("3 месяца - 3 USDT", callback_data=callbacks.TG_WALLET_AMOUNT.encode(amount=3)),
+        InlineKeyboardButton("6 месяцев - 6 USDT", callback_data=callbacks.TG_WALLET_AMOUNT.encode(amount=6)),
+        InlineKeyboardButton("🔙 Назад", callback_data=callbacks.PAY.encode())
+    )
+    return keyboard
+
+
+# ====== Очередь платежей ======
+def build_pending_queue():
+    """
+    Создаёт кнопку перехода к очереди платежей, ожидающих проверки.
+    """
+    keyboard = InlineKeyboardMarkup()
+    keyboard.add(InlineKeyboardButton("📋 Открыть очередь", callback_data=callbacks.PENDING.encode(op="n", anchor="")))
+    return keyboard
+
+
+# Готовые клавиатуры, собранные при импорте
+MAIN_MENU = freeze(build_main_menu())
+SUPPORT_CHAT = freeze(build_support_chat())
+BACK_TO_MAIN_MENU = freeze(build_back_to_main_menu())
+PAY_METHODS = freeze(build_pay_methods())
+SBP_TARIFFS = freeze(build_sbp_tariffs())
+TG_WALLET_TARIFFS = freeze(build_tg_wallet_tariffs())
+PENDING_QUEUE = freeze(build_pending_queue())
@@ -0,0 +1,67 @@
+import asyncio
+import contextlib
+
+
+class KeyedLock:
+    """
+    Таблица блокировок по ключу (логину пользователя): изменения данных одного
+    пользователя выполняются по очереди, разных пользователей — параллельно.
+    В таблице хранятся только ключи, которые сейчас заняты или ожидаются:
+    блокировка удаляется, как только её отпускает последний ожидающий,
+    поэтому размер таблицы ограничен числом одновременных операций.
+    """
+
+    def __init__(self):
+        # Ключ -> [asyncio.Lock, число владельцев и ожидающих]
+        self._locks = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    async def _acquire(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release_entry(key, entry, acquired=False)
+            raise
+
+    def _release(self, key):
+        self._release_entry(key, self._locks[key], acquired=True)
+
+    def _release_entry(self, key, entry, acquired):
+        if acquired:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[key]
+
+    @contextlib.asynccontextmanager
+    async def lock(self, key):
+        """
+        Захватывает блокировку одного ключа: async with user_locks.lock(username): ...
+        """
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    @contextlib.asynccontextmanager
+    async def lock_many(self, keys):
+        """
+        Захватывает блокировки нескольких ключей. Ключи захватываются в отсортированном
+        порядке, поэтому две пачки с общими пользователями не блокируют друг друга навсегда.
+        """
+        acquired = []
+        try:
+            for key in sorted(set(keys)):
+                await self._acquire(key)
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
@@ -0,0 +1,116 @@
+import atexit
+import contextvars
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# ID обновления Telegram, в обработке которого сделана запись. Задачи, запущенные
+# из обработчика, наследуют значение, фоновые задачи планировщика — нет.
+update_id = contextvars.ContextVar("update_id", default=None)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    QueueHandler, который в потоке бота только подставляет аргументы в сообщение
+    и запоминает ID обновления; форматирование и запись выполняются в потоке QueueListener.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Объект трассировки нельзя безопасно передать в другой поток — только текст
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.update_id = update_id.get()
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна запись — одна строка JSON: время, уровень, логгер, сообщение и update_id.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "update_id", None) is not None:
+            entry["update_id"] = record.update_id
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def _gzip_name(name):
+    return name + ".gz"
+
+
+def _gzip_rotate(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def setup_logging(path, level=logging.INFO, json_format=False, max_bytes=0, when=None, backup_count=10):
+    """
+    Настраивает корневой логгер: записи складываются в очередь, а форматирует и пишет их
+    в файл отдельный поток. Старые файлы сжимаются gzip при ротации.
+    :param path: Путь к файлу журнала.
+    :param level: Уровень логирования.
+    :param json_format: Писать записи в виде JSON вместо текста.
+    :param max_bytes: Ротация по размеру файла, байт (0 — без ротации по размеру).
+    :param when: Ротация по времени, как в TimedRotatingFileHandler ("midnight", "H" и т.п.); имеет приоритет над max_bytes.
+    :param backup_count: Сколько сжатых файлов хранить.
+    :return: Запущенный QueueListener; останавливается автоматически при выходе из процесса.
+    """
+    if when:
+        handler = TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding="utf-8")
+    else:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    handler.namer = _gzip_name
+    handler.rotator = _gzip_rotate
+    handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(_QueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+
+    def stop():
+        # Дописываем оставшиеся в очереди записи и закрываем файл
+        listener.stop()
+        handler.close()
+    atexit.register(stop)
+    return listener
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    def __init__(self):
+        """
+        Middleware, запоминающий ID обрабатываемого обновления для записей журнала.
+        Каждое обновление aiogram обрабатывает в своей задаче, поэтому значения не смешиваются.
+        """
+        super(CorrelationMiddleware, self).__init__()
+
+    async def on_pre_process_update(self, update, data):
+        update_id.set(update.update_id)
@@ -1,17 +1,33 @@
+import asyncio
+import io
 import logging
 import os
-import json
 import secrets
 import string
-import subprocess
-import uuid
+import time
 from datetime import datetime, timedelta
-from aiogram import Bot, Dispatcher, types
+from aiogram import Dispatcher, types
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import MessageNotModified
+import bulk
+import callbacks
+import keyboards
+import logs
+import metrics
+import statements
 from throttling import ThrottlingMiddleware  # Импорт кастомного Middleware
+from inflight import InFlightMiddleware
+from torrserver import TorrServerReloader
+from broadcast import Broadcaster
+from jobs import JobScheduler
+from callbacks import CallbackRouter
+from cluster import Cluster
+from locks import KeyedLock
+from database.db import Database, telegram_id_from_login
+from database.store import AccountStore, save_json
 
 # Загрузка конфигурации из .env
 load_dotenv()
@@ -25,57 +41,178 @@ ADMIN_WALLET = os.getenv("ADMIN_WALLET")
 ACCS_DB_PATH = os.environ.get("ACCS_DB_PATH", "database/accs.db")
 EXPIRY_DB_PATH = os.environ.get("EXPIRY_DB_PATH", "database/expiry.db")
 TRIAL_USAGE_DB_PATH = os.environ.get("TRIAL_USAGE_DB_PATH", "database/trial_usage.db")
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    filename="bot.log",
+STORE_JOURNAL_PATH = os.environ.get("STORE_JOURNAL_PATH", "database/store.journal")
+USERS_DB_PATH = os.environ.get("USERS_DB_PATH", "database/users.db")
+
+# Перезагрузка TorrServer: окно объединения изменений и щадящий способ перезагрузки
+TORRSERVER_RELOAD_WINDOW = float(os.environ.get("TORRSERVER_RELOAD_WINDOW", "10"))
+TORRSERVER_RELOAD_URL = os.environ.get("TORRSERVER_RELOAD_URL")
+TORRSERVER_RELOAD_CMD = os.environ.get("TORRSERVER_RELOAD_CMD")
+TORRSERVER_RELOAD_MODE = os.environ.get("TORRSERVER_RELOAD_MODE")
+TORRSERVER_COMMAND_TIMEOUT = float(os.environ.get("TORRSERVER_COMMAND_TIMEOUT", "30"))
+
+# Очистка истёкших подписок: период в минутах и размер пачки
+SWEEP_INTERVAL_MINUTES = int(os.environ.get("SWEEP_INTERVAL_MINUTES", "10"))
+SWEEP_BATCH_SIZE = int(os.environ.get("SWEEP_BATCH_SIZE", "1000"))
+
+# Каталог, куда складываются выписки банка (CSV/OFX) для автоматического подтверждения СБП
+STATEMENTS_DIR = os.environ.get("STATEMENTS_DIR")
+STATEMENTS_INTERVAL = int(os.environ.get("STATEMENTS_INTERVAL", "60"))
+
+# Рассылки: общий лимит сообщений в секунду и число параллельных отправителей
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "8"))
+
+# Ограничение частоты запросов: допустимое число запросов подряд
+THROTTLE_BURST = int(os.environ.get("THROTTLE_BURST", "3"))
+
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST")  # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBAPP_HOST = os.environ.get("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.environ.get("WEBAPP_PORT", "8080"))
+# Сколько секунд при остановке ждём завершения уже начатых обработчиков
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", "30"))
+
+# Метрики в формате Prometheus на локальном порту (по умолчанию выключены).
+# При нескольких процессах у каждого должен быть свой METRICS_PORT.
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Журнал: формат text или json (с update_id обновления), ротация по размеру или по времени
+# (LOG_ROTATE_WHEN, например midnight), число хранимых сжатых файлов
+LOG_PATH = os.environ.get("LOG_PATH", "bot.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.environ.get("LOG_ROTATE_WHEN")
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", "10"))
+
+# Несколько процессов бота за балансировщиком с общей базой (только в режиме webhook)
+CLUSTER_MODE = os.environ.get("CLUSTER_MODE") == "1"
+WORKER_ID = os.environ.get("WORKER_ID")  # Уникальное имя процесса, например номер
+CLUSTER_INTERVAL = float(os.environ.get("CLUSTER_INTERVAL", "5"))
+CLUSTER_LEASE_TTL = float(os.environ.get("CLUSTER_LEASE_TTL", "15"))
+# Сколько секунд хранится журнал изменений базы для синхронизации процессов
+CLUSTER_CHANGES_TTL = float(os.environ.get("CLUSTER_CHANGES_TTL", "3600"))
+
+# Количество подписок на одной странице /delete_subscription
+SUBSCRIBERS_PAGE_SIZE = 10
+
+# Не чаще чем раз в столько секунд администратор получает сводку о новых платежах
+PENDING_DIGEST_INTERVAL = int(os.environ.get("PENDING_DIGEST_INTERVAL", "60"))
+# Количество платежей на одной странице /pending
+PENDING_PAGE_SIZE = 8
+
+if CLUSTER_MODE:
+    if BOT_MODE != "webhook" or not WORKER_ID:
+        raise ValueError("Для CLUSTER_MODE нужны BOT_MODE=webhook и уникальный WORKER_ID.")
+    # У каждого процесса свой журнал хранилища
+    root, ext = os.path.splitext(STORE_JOURNAL_PATH)
+    STORE_JOURNAL_PATH = f"{root}.{WORKER_ID}{ext}"
+
+# Настройка логирования: запись в файл идёт из отдельного потока, старые файлы сжимаются
+logs.setup_logging(
+    LOG_PATH,
+    level=LOG_LEVEL,
+    json_format=LOG_FORMAT == "json",
+    max_bytes=LOG_MAX_BYTES,
+    when=LOG_ROTATE_WHEN,
+    backup_count=LOG_BACKUP_COUNT,
 )
 logger = logging.getLogger("main")
 
 # Создание бота и диспетчера
-bot = Bot(token=API_TOKEN)
+bot = metrics.InstrumentedBot(token=API_TOKEN)
 dp = Dispatcher(bot)
-dp.middleware.setup(ThrottlingMiddleware(rate_limit=1))  # 1 запрос в секунду
+dp.middleware.setup(logs.CorrelationMiddleware())
+in_flight = InFlightMiddleware()
+dp.middleware.setup(in_flight)
+throttling = ThrottlingMiddleware(rate_limit=1, burst=THROTTLE_BURST)  # 1 запрос в секунду, до THROTTLE_BURST подряд
+dp.middleware.setup(throttling)
+dp.middleware.setup(metrics.MetricsMiddleware())
+# Все нажатия кнопок разбираются одним обработчиком и направляются по коду действия
+router = CallbackRouter()
+dp.register_callback_query_handler(router.dispatch)
 scheduler = AsyncIOScheduler()
 
+# База SQLite (при первом запуске переносит данные из JSON-файлов)
+db = Database(USERS_DB_PATH, track_changes=CLUSTER_MODE)
+db.init_db()
+db.import_json(ACCS_DB_PATH, EXPIRY_DB_PATH, TRIAL_USAGE_DB_PATH)
+
+# Хранилище учётных записей: читается один раз, изменения пишутся в фоне.
+# При нескольких процессах accs.db выгружает из базы только ведущий.
+store = AccountStore(db, None if CLUSTER_MODE else ACCS_DB_PATH, STORE_JOURNAL_PATH)
+store.load()
+
+# Выбор ведущего процесса (в режиме одного процесса он всегда ведущий)
+cluster = Cluster(
+    db, WORKER_ID or "main", enabled=CLUSTER_MODE, lease_ttl=CLUSTER_LEASE_TTL, interval=CLUSTER_INTERVAL
+)
+
+# Отложенные задачи хранятся в базе и переживают перезапуск бота
+job_scheduler = JobScheduler(db)
+
+# Очередь исходящих сообщений с учётом лимитов Telegram
+broadcaster = Broadcaster(bot, db, ADMIN_ID, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS)
+
+# Изменения учётной записи одного пользователя выполняются по очереди (ключ — логин)
+user_locks = KeyedLock()
+
+# Значения, которые метрики читают из компонентов при каждом запросе
+metrics.THROTTLED.set_function(lambda: throttling.throttled_count)
+metrics.IN_FLIGHT.set_function(lambda: in_flight.in_flight)
+metrics.JOBS_QUEUED.set_function(lambda: len(job_scheduler))
+metrics.BROADCAST_QUEUED.set_function(broadcaster.queued)
+metrics.USER_LOCKS.set_function(lambda: len(user_locks))
+metrics_runner = None
+
 # ====== Рестарт торрсервер ======
-def restart_torrserver():
-    """
-    Перезагружает TorrServer.
-    """
-    try:
-        subprocess.run(["systemctl", "restart", "torrserver"], check=True)
-        logging.info("TorrServer успешно перезагружен.")
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Ошибка при перезагрузке TorrServer: {e}")
+last_exported_change = 0
 
-# ====== Пробный период ======
-def load_trial_usage():
+
+async def export_accounts():
     """
-    Загружает данные о пользователях, использовавших пробный период.
+    Сохраняет изменения перед перезагрузкой TorrServer. При нескольких процессах
+    ведущий выгружает accs.db из общей базы со всеми их изменениями.
     """
-    if not os.path.exists(TRIAL_USAGE_DB_PATH):
-        with open(TRIAL_USAGE_DB_PATH, "w") as file:
-            json.dump([], file)
-    with open(TRIAL_USAGE_DB_PATH, "r") as file:
-        return json.load(file)
+    global last_exported_change
+    await store.flush()
+    if CLUSTER_MODE:
+        seq, accs = await db.run(db.export_accounts)
+        await db.run(save_json, ACCS_DB_PATH, accs)
+        last_exported_change = seq
+
+
+torrserver_reloader = TorrServerReloader(
+    before_reload=export_accounts,
+    window=TORRSERVER_RELOAD_WINDOW,
+    reload_url=TORRSERVER_RELOAD_URL,
+    reload_command=TORRSERVER_RELOAD_CMD,
+    mode=TORRSERVER_RELOAD_MODE,
+    timeout=TORRSERVER_COMMAND_TIMEOUT,
+)
 
 
-def save_trial_usage(trial_users):
+def restart_torrserver():
     """
-    Сохраняет данные о пользователях, использовавших пробный период.
+    Запрашивает перезагрузку TorrServer. Изменения за окно объединяются,
+    перед перезагрузкой accs.db сбрасывается на диск.
+    Перезагружает только ведущий процесс: изменения остальных он замечает
+    по журналу изменений базы.
     """
-    with open(TRIAL_USAGE_DB_PATH, "w") as file:
-        json.dump(trial_users, file, indent=4)
+    if cluster.is_leader:
+        torrserver_reloader.request()
 
+# ====== Пробный период ======
 def check_if_trial(user_id):
     """
     Проверяет, является ли подписка пробной.
     """
-    trial_users = load_trial_usage()
-    return user_id in trial_users
+    return store.has_used_trial(user_id)
 
 def parse_expiry_date(expiry_str):
     """
@@ -89,65 +226,44 @@ def parse_expiry_date(expiry_str):
     raise ValueError(f"Неверный формат времени: {expiry_str}")
 
 
-# ====== Клавиатура бота ======
-def inline_main_menu():
-    """
-    Создаёт клавиатуру с кнопками под сообщением.
-    """
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    keyboard.add(
-        InlineKeyboardButton("💳 Оплатить подписку", callback_data="pay"),
-        InlineKeyboardButton("📅 Проверить статус подписки", callback_data="status"),
-        InlineKeyboardButton("🔑 Получить данные учётной записи", callback_data="get_account"),
-        InlineKeyboardButton("🎁 Пробный период", callback_data="trial"),
-        InlineKeyboardButton("💬 Чат поддержки", url="https://t.me/RUtils_TorrServer_chat")
+# ====== Напоминание об истечение подписки ======
+def reminder_job(username, expiry_date):
+    """
+    Возвращает задачу уведомления за 3 дня до истечения подписки (id, вид, время, параметры)
+    или None, если напоминать некому или дата напоминания уже прошла.
+    """
+    user_id = telegram_id_from_login(username)  # Получаем ID пользователя
+    reminder_date = expiry_date - timedelta(days=3)
+    if user_id is None or reminder_date <= datetime.now():
+        return None
+    return (
+        f"reminder_{user_id}", "reminder", reminder_date,
+        {"user_id": user_id, "expiry_date": expiry_date.strftime("%Y-%m-%d")}
     )
-    return keyboard
-
-
-
-# ====== Кнопка чата поддержки ======
-def support_chat_button():
-    """
-    Создаёт клавиатуру с кнопкой для перехода в чат поддержки.
-    """
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("Чат поддержки", url="https://t.me/RUtils_TorrServer_chat"))
-    return keyboard
 
-# ====== Кнопка возврата в основное меню ======
-def back_to_main_menu():
-    """
-    Создаёт кнопку для возврата в главное меню.
-    """
-    keyboard = InlineKeyboardMarkup()
-    keyboard.add(InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu"))
-    return keyboard
 
-# ====== Напоминание об истечение подписки ======
-def schedule_reminders():
+async def schedule_reminders():
     """
-    Планирует уведомления за 3 дня до истечения подписки.
+    Однократно планирует напоминания для подписок, перенесённых из JSON-файлов.
+    Дальше напоминания планируются при создании и продлении подписки.
     """
-    expiry = load_json(EXPIRY_DB_PATH)
-    now = datetime.now()
+    if await db.run(db.get_meta, "reminders_scheduled"):
+        return
 
-    for username, expiry_str in expiry.items():
+    # По индексу выбираем только подписки, напоминание по которым ещё впереди
+    start = (datetime.now() + timedelta(days=3)).strftime("%Y-%m-%d %H:%M:%S")
+    jobs = []
+    for username, expiry_str in await db.run(db.expiring_between, start):
         try:
-            expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d")
-            reminder_date = expiry_date - timedelta(days=3)
-
-            # Планируем уведомление, если дата напоминания ещё не прошла
-            if reminder_date > now:
-                user_id = int(username.replace("User", ""))  # Получаем ID пользователя
-                scheduler.add_job(
-                    send_reminder,
-                    DateTrigger(run_date=reminder_date),
-                    args=[user_id, expiry_date.strftime("%Y-%m-%d")],
-                    id=f"reminder_{user_id}"
-                )
+            job = reminder_job(username, parse_expiry_date(expiry_str))
         except Exception as e:
             logger.error(f"Ошибка при планировании напоминания для {username}: {e}")
+            continue
+        if job is not None:
+            jobs.append(job)
+    # Все напоминания записываются в базу одной транзакцией
+    job_scheduler.schedule_many(jobs)
+    await db.run(db.set_meta, "reminders_scheduled", datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
 
 
 async def send_reminder(user_id, expiry_date):
@@ -156,47 +272,118 @@ async def send_reminder(user_id, expiry_date):
     :param user_id: Telegram ID пользователя.
     :param expiry_date: Дата истечения подписки.
     """
-    try:
-        await bot.send_message(
-            user_id,
-            f"⚠️ Напоминание: ваша подписка истекает через 3 дня (дата истечения: {expiry_date}).\n"
-            f"Продлите подписку, чтобы продолжить пользоваться сервисом."
-        )
+    delivered = await broadcaster.send(
+        user_id,
+        f"⚠️ Напоминание: ваша подписка истекает через 3 дня (дата истечения: {expiry_date}).\n"
+        f"Продлите подписку, чтобы продолжить пользоваться сервисом."
+    )
+    if delivered:
         logger.info(f"Напоминание отправлено пользователю {user_id}.")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке напоминания для пользователя {user_id}: {e}")
+    else:
+        logger.error(f"Не удалось отправить напоминание пользователю {user_id}.")
+
+
+# ====== Несколько процессов ======
+async def on_elected():
+    """
+    Процесс стал ведущим: запускаем отложенные задачи и рассылки.
+    """
+    await job_scheduler.restore()
+    await broadcaster.start()
+    await schedule_reminders()
+    if cluster.enabled:
+        # Прежний ведущий мог не успеть выгрузить accs.db
+        restart_torrserver()
+
+
+async def on_demoted():
+    await job_scheduler.stop()
+    await broadcaster.stop()
+
+
+async def on_cluster_tick():
+    """
+    Синхронизация с другими процессами бота.
+    """
+    await store.refresh()
+    if not cluster.is_leader:
+        return
+    await job_scheduler.poll(datetime.now() + timedelta(seconds=cluster.interval))
+    await broadcaster.resume()
+    if await db.run(db.last_change) > last_exported_change:
+        restart_torrserver()
+    await db.run(db.trim_changes, time.time() - CLUSTER_CHANGES_TTL)
+
+
+cluster.register("elected", on_elected)
+cluster.register("demoted", on_demoted)
+cluster.register("tick", on_cluster_tick)
 
 
 async def on_startup(dp):
     """
     Инициализация перед запуском бота.
     """
+    global metrics_runner
     logger.info("Инициализация перед запуском бота...")
 
-    # Запуск планировщика
+    if METRICS_PORT:
+        metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT)
+        logger.info(f"Метрики доступны на http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    if BOT_MODE == "webhook":
+        # Неполученные за время перезапуска обновления Telegram доставит повторно
+        await bot.set_webhook(
+            f"{WEBHOOK_HOST}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET, drop_pending_updates=False
+        )
+
+    # Запуск планировщика; отложенные задачи и рассылки запускает ведущий процесс
     if not scheduler.running:
         scheduler.start()
+    await cluster.start()
 
-    # Планирование напоминаний
-    schedule_reminders()
+    # Периодическая очистка истёкших подписок
+    scheduler.add_job(
+        sweep_expired_accounts,
+        IntervalTrigger(minutes=SWEEP_INTERVAL_MINUTES),
+        id="sweep_expired_accounts",
+        replace_existing=True,
+        next_run_time=datetime.now(),
+    )
 
-# ====== Работа с TorrServer аккаунтами ======
-def load_json(file_path):
-    """
-    Загрузка данных из JSON-файла.
-    """
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
-    return {}
+    # Автоматическая сверка выписок банка
+    if STATEMENTS_DIR:
+        scheduler.add_job(
+            import_statements,
+            IntervalTrigger(seconds=STATEMENTS_INTERVAL),
+            id="import_statements",
+            replace_existing=True,
+        )
 
-def save_json(file_path, data):
-    """
-    Сохранение данных в JSON-файл.
-    """
-    with open(file_path, "w") as f:
-        json.dump(data, f, indent=4)
 
+async def on_shutdown(dp):
+    """
+    Завершение работы бота: перестаём получать обновления, дожидаемся начатых
+    обработчиков и сохраняем несброшенные изменения.
+    """
+    # executor останавливает polling только после on_shutdown, а к тому времени база уже закрыта
+    if BOT_MODE != "webhook":
+        dp.stop_polling()
+    in_flight.close()
+    if not await in_flight.wait_idle(SHUTDOWN_TIMEOUT):
+        logger.warning(f"Не дождались завершения обработчиков: {in_flight.in_flight} в работе.")
+    scheduler.shutdown(wait=False)
+    await cluster.stop()
+    await job_scheduler.stop()
+    await broadcaster.stop()
+    await torrserver_reloader.flush()
+    await store.flush()
+    store.close()
+    db.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+# ====== Работа с TorrServer аккаунтами ======
 def generate_password(length=12):
     """
     Генерирует случайный, безопасный пароль.
@@ -205,38 +392,273 @@ def generate_password(length=12):
     return ''.join(secrets.choice(alphabet) for _ in range(length))
 
 
-def create_or_extend_torr_account(user_id, additional_days):
+async def create_or_extend_torr_account(user_id, additional_days):
     """
     Создаёт или продлевает учётную запись пользователя в TorrServer.
     """
-    username = f"User{user_id}"
-    password = generate_password()
-    accs = load_json(ACCS_DB_PATH)
-    expiry = load_json(EXPIRY_DB_PATH)
+    return (await extend_torr_accounts([(user_id, additional_days)]))[0]
+
+
+async def extend_torr_accounts(extensions):
+    """
+    Создаёт или продлевает пачку учётных записей одной записью в хранилище
+    и с одной перезагрузкой TorrServer. Пока пачка обрабатывается, другие
+    изменения тех же пользователей ждут.
+    :param extensions: Пары (Telegram ID, дней подписки); пользователь может встречаться несколько раз.
+    :return: Список (логин, пароль, срок действия) в порядке extensions.
+    """
+    usernames = [f"User{user_id}" for user_id, _ in extensions]
+    async with user_locks.lock_many(usernames):
+        # Новый срок считается от текущего; пароль нужен, только если учётной записи ещё нет
+        results = await store.extend_accounts([
+            (username, store.get_password(username) or generate_password(), days)
+            for username, (_, days) in zip(usernames, extensions)
+        ])
+        # Для повторяющихся пользователей итоговый срок — последний
+        expiries = {username: expiry for username, _, expiry in results}
+        jobs = [reminder_job(username, parse_expiry_date(expiry)) for username, expiry in expiries.items()]
+        job_scheduler.schedule_many([job for job in jobs if job is not None])
+
+    # Перезагружаем TorrServer
+    restart_torrserver()
+    return results
+
+# ====== Платежи ======
+PAYMENT_METHODS = {"sbp": ("СБП", "руб."), "tg_wallet": ("Telegram-кошелёк", "USDT")}
+# Допустимые суммы по тарифам для каждого способа оплаты
+PAYMENT_AMOUNTS = {"sbp": (100, 300, 600), "tg_wallet": (1, 3, 6)}
 
-    # Проверяем текущий срок действия подписки
-    current_expiry_str = expiry.get(username, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+async def register_legacy_payment(payment_id, user_id, method, amount):
+    """
+    Регистрирует платёж из сообщения, отправленного до появления журнала, по данным кнопки.
+    Уже зарегистрированный платёж не меняется: сумма и пользователь берутся из журнала.
+    :param payment_id: ID платежа из кнопки.
+    :param user_id: ID пользователя из кнопки.
+    :param method: Способ оплаты ("sbp" или "tg_wallet").
+    :param amount: Сумма из кнопки.
+    :return: False, если платежа нет в журнале, а сумма не совпадает ни с одним тарифом.
+    """
+    if await db.run(db.get_payment, payment_id) is not None:
+        return True
+    if amount not in PAYMENT_AMOUNTS[method]:
+        logging.warning(f"Отклонена регистрация платежа {payment_id}: неверная сумма {amount} ({method})")
+        return False
+    await db.run(db.submit_payment, payment_id, user_id, method, amount)
+    return True
+
+
+async def confirm_payment(payment_id):
+    """
+    Подтверждает ожидающий платёж (pending → confirmed) и продлевает подписку.
+    Повторное подтверждение того же платежа (двойное нажатие, повтор обновления)
+    ничего не меняет.
+    :return: (платёж, (логин, пароль, срок действия)) или (платёж или None, None),
+             если платёж уже обработан или не найден.
+    """
+    if not await db.run(db.set_payment_status, payment_id, "confirmed", "pending"):
+        return await db.run(db.get_payment, payment_id), None
+    payment = await db.run(db.get_payment, payment_id)
     try:
-        current_expiry = parse_expiry_date(current_expiry_str)
-    except ValueError as e:
-        logging.error(f"Ошибка при разборе даты для {username}: {e}")
-        current_expiry = datetime.now()
+        days = calculate_subscription_days(payment.amount)
+        account = await create_or_extend_torr_account(payment.user_id, additional_days=days)
+    except Exception:
+        # Возвращаем платёж в ожидание, чтобы его можно было подтвердить повторно
+        await db.run(db.set_payment_status, payment_id, "pending", "confirmed")
+        raise
+    return payment, account
+
+
+def payment_confirmed_text(payment, account):
+    """
+    Сообщение пользователю о подтверждённом платеже.
+    """
+    method, currency = PAYMENT_METHODS.get(payment.method, (payment.method, ""))
+    username, password, expiry_date = account
+    return (
+        f"Ваш платёж на сумму *{payment.amount} {currency}* через {method} успешно подтверждён.\n\n"
+        f"*Ваши данные для подключения к TorrServer:*\n"
+        f"🌐 *Адрес:* {TORR_SERVER_ADDRESS}\n"
+        f"🔑 *Логин:* `{username}`\n"
+        f"🔑 *Пароль:* `{password}`\n"
+        f"📅 *Срок действия:* {expiry_date}\n\n"
+        "Спасибо за использование нашего сервиса!"
+    )
 
-    # Вычисляем новый срок действия подписки
-    new_expiry = max(current_expiry, datetime.now()) + timedelta(days=additional_days)
-    expiry[username] = new_expiry.strftime("%Y-%m-%d %H:%M:%S")
 
-    # Создаём или обновляем учётную запись
-    accs[username] = accs.get(username, password)
+async def approve_payments(payment_ids):
+    """
+    Подтверждает пачку ожидающих платежей за один проход: статусы меняются одной
+    транзакцией, подписки продлеваются одной записью в хранилище, TorrServer
+    перезагружается один раз. Уже обработанные платежи пропускаются.
+    :return: Количество подтверждённых платежей.
+    """
+    changed = await db.run(db.set_payments_status, payment_ids, "confirmed", "pending")
+    try:
+        payments = []
+        for payment in await db.run(db.get_payments, changed):
+            try:
+                payments.append((payment, calculate_subscription_days(payment.amount)))
+            except ValueError:
+                await db.run(db.set_payment_status, payment.id, "pending", "confirmed")
+        if not payments:
+            return 0
+
+        accounts = await extend_torr_accounts([(payment.user_id, days) for payment, days in payments])
+    except Exception:
+        # Возвращаем пачку в ожидание, чтобы её можно было подтвердить повторно из /pending
+        await db.run(db.set_payments_status, changed, "pending", "confirmed")
+        raise
+    for (payment, _), account in zip(payments, accounts):
+        await broadcaster.send(payment.user_id, payment_confirmed_text(payment, account), parse_mode="Markdown")
+    logger.info(f"Подтверждено платежей: {len(payments)}.")
+    return len(payments)
+
+
+async def reject_payments(payment_ids):
+    """
+    Отклоняет пачку ожидающих платежей и уведомляет пользователей.
+    :return: Количество отклонённых платежей.
+    """
+    changed = await db.run(db.set_payments_status, payment_ids, "rejected", "pending")
+    for payment in await db.run(db.get_payments, changed):
+        await broadcaster.send(
+            payment.user_id,
+            "Ваш запрос на пополнение баланса был отклонён администратором.\n"
+            "Пожалуйста, проверьте данные перевода и попробуйте снова."
+        )
+    logger.info(f"Отклонено платежей: {len(changed)}.")
+    return len(changed)
 
-    # Сохраняем изменения
-    save_json(ACCS_DB_PATH, accs)
-    save_json(EXPIRY_DB_PATH, expiry)
 
-    # Перезагружаем TorrServer
-    restart_torrserver()
+def schedule_pending_digest():
+    """
+    Планирует сводку об ожидающих платежах администратору. Время отправки
+    округляется вверх до PENDING_DIGEST_INTERVAL, поэтому все нажатия «Оплатил»
+    за интервал дают одно сообщение (и в нескольких процессах бота тоже).
+    """
+    run_at = datetime.fromtimestamp((time.time() // PENDING_DIGEST_INTERVAL + 1) * PENDING_DIGEST_INTERVAL)
+    job_scheduler.schedule("pending_digest", "pending_digest", run_at)
+
+
+async def send_pending_digest():
+    count = await db.run(db.count_payments, "pending")
+    if count:
+        await broadcaster.send(ADMIN_ID, f"Платежей ожидают проверки: {count}.", reply_markup=keyboards.PENDING_QUEUE)
+
+
+def _pack_anchor(payment):
+    """
+    Граница страницы очереди для callback_data: время перехода в ожидание и id платежа.
+    """
+    return payment.updated_at.replace("-", "").replace(" ", "").replace(":", "") + payment.id
+
+
+def _unpack_anchor(packed):
+    if not packed:
+        return None
+    ts = packed[:14]
+    return f"{ts[:4]}-{ts[4:6]}-{ts[6:8]} {ts[8:10]}:{ts[10:12]}:{ts[12:14]}", packed[14:]
+
+
+async def render_pending_page(anchor=""):
+    """
+    Формирует страницу очереди платежей с кнопками подтверждения и отклонения.
+    :param anchor: Упакованная граница предыдущей страницы ("" — первая страница).
+    :return: Текст сообщения и клавиатура.
+    """
+    payments, has_more = await db.run(db.pending_payments, _unpack_anchor(anchor), PENDING_PAGE_SIZE)
+    total = await db.run(db.count_payments, "pending")
+    if not payments:
+        text = "Нет платежей, ожидающих проверки." if not total else "На этой странице платежей не осталось."
+        keyboard = keyboards.PENDING_QUEUE if total else None
+        return text, keyboard
+
+    lines = [f"Ожидают проверки: {total}.\n"]
+    keyboard = InlineKeyboardMarkup(row_width=2)
+    for payment in payments:
+        method, currency = PAYMENT_METHODS.get(payment.method, (payment.method, ""))
+        lines.append(
+            f"{payment.id} — {payment.amount} {currency}, {method}, ID {payment.user_id}, {payment.updated_at[5:16]}"
+        )
+        keyboard.row(
+            InlineKeyboardButton(
+                f"✅ {payment.id}", callback_data=callbacks.PENDING.encode(op="c", anchor=anchor, payment_id=payment.id)
+            ),
+            InlineKeyboardButton(
+                f"❌ {payment.id}", callback_data=callbacks.PENDING.encode(op="r", anchor=anchor, payment_id=payment.id)
+            ),
+        )
+    # Пачка задаётся размером страницы и последним платежом, чтобы не задеть платежи, которых администратор не видел
+    batch = {"anchor": anchor, "payment_id": payments[-1].id, "count": len(payments)}
+    keyboard.row(
+        InlineKeyboardButton(f"✅ Все ({len(payments)})", callback_data=callbacks.PENDING.encode(op="ca", **batch)),
+        InlineKeyboardButton(f"❌ Все ({len(payments)})", callback_data=callbacks.PENDING.encode(op="ra", **batch)),
+    )
+    navigation = []
+    if anchor:
+        navigation.append(InlineKeyboardButton("⏮ В начало", callback_data=callbacks.PENDING.encode(op="n", anchor="")))
+    if has_more:
+        navigation.append(InlineKeyboardButton(
+            "Далее ▶️", callback_data=callbacks.PENDING.encode(op="n", anchor=_pack_anchor(payments[-1]))
+        ))
+    if navigation:
+        keyboard.row(*navigation)
+    return "\n".join(lines), keyboard
+
+
+# ====== Выписки банка ======
+async def import_statements():
+    """
+    Разбирает новые выписки из STATEMENTS_DIR, сверяет идентификатор из комментария
+    и сумму с ожидающими платежами СБП и подтверждает совпавшие так же, как администратор.
+    Обработанные файлы переносятся в processed/, неразобранные — в failed/.
+    """
+    # При нескольких процессах выписки разбирает только ведущий
+    if not cluster.is_leader:
+        return
+    loop = asyncio.get_running_loop()
+    for path in await loop.run_in_executor(None, statements.pending_files, STATEMENTS_DIR):
+        try:
+            entries = await loop.run_in_executor(None, statements.parse_statement, path)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать выписку {path}: {e}")
+            await loop.run_in_executor(None, statements.archive, path, "failed")
+            continue
+
+        amounts = {}
+        for entry in entries:
+            for payment_id in statements.payment_ids(entry.text):
+                amounts[payment_id] = entry.amount
+
+        # Поиск по первичному ключу; пользователь мог перевести деньги, не нажав «Оплатил»
+        matched, mismatched, unsubmitted = [], [], []
+        for payment in await db.run(db.get_payments, list(amounts)):
+            if payment.method != "sbp" or payment.status not in ("created", "pending"):
+                continue
+            if amounts[payment.id] != payment.amount:
+                mismatched.append(f"{payment.id}: {amounts[payment.id]} вместо {payment.amount} руб.")
+            else:
+                matched.append(payment.id)
+            # Перевод пришёл, поэтому платёж попадает в очередь /pending, даже если сумма не совпала
+            if payment.status == "created":
+                unsubmitted.append(payment.id)
+        if unsubmitted:
+            await db.run(db.set_payments_status, unsubmitted, "pending", "created")
+        confirmed = await approve_payments(matched) if matched else 0
+        await loop.run_in_executor(None, statements.archive, path, "processed")
+
+        name = os.path.basename(path)
+        logger.info(
+            f"Выписка {name}: поступлений {len(entries)}, подтверждено {confirmed}, "
+            f"не совпала сумма {len(mismatched)}."
+        )
+        if confirmed or mismatched:
+            text = f"Выписка {name}: автоматически подтверждено платежей: {confirmed}."
+            if mismatched:
+                text += "\n\nНе совпала сумма (проверьте вручную в /pending):\n" + "\n".join(mismatched[:20])
+            await broadcaster.send(ADMIN_ID, text)
 
-    return username, accs[username], new_expiry.strftime("%Y-%m-%d %H:%M:%S")
 
 def calculate_subscription_days(amount):
     """
@@ -254,15 +676,39 @@ def calculate_subscription_days(amount):
         raise ValueError(f"Неверная сумма: {amount}")
 
 
-def restart_torrserver():
+@dp.message_handler(commands=["torrserver"])
+async def torrserver_command(message: types.Message):
     """
-    Перезапускает TorrServer.
+    Состояние TorrServer и перезагрузок; "/torrserver restart" перезагружает его сразу.
+    Доступно только администратору.
     """
-    try:
-        os.system("systemctl restart torrserver.service")
-        logger.info("TorrServer успешно перезапущен.")
-    except Exception as e:
-        logger.error(f"Ошибка при перезапуске TorrServer: {e}")
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+
+    if message.get_args() == "restart":
+        await message.reply("Перезагрузка TorrServer запущена.")
+        restart_torrserver()
+        await torrserver_reloader.flush()
+
+    status = torrserver_reloader.status()
+    service = await torrserver_reloader.service_status()
+    last = status["last_result"]
+    if last is None:
+        last_text = "нет"
+    elif last.returncode is None:
+        last_text = f"{' '.join(last.command)}: таймаут ({last.duration:.1f} сек.)"
+    else:
+        last_text = f"{' '.join(last.command)}: код {last.returncode} ({last.duration:.1f} сек.)"
+
+    await message.reply(
+        f"Служба TorrServer: {service.output or 'неизвестно'}\n"
+        f"Способ перезагрузки: {status['mode']}, окно {status['window']:g} сек.\n"
+        f"Ожидает перезагрузки: {'да' if status['pending'] else 'нет'}\n"
+        f"Перезагрузок: {status['reloads']}, ошибок: {status['failures']}\n"
+        f"Последняя: {status['last_reload_at'] or 'нет'}\n"
+        f"Результат: {last_text}"
+    )
 
 
 @dp.message_handler(commands=["delete_subscription"])
@@ -275,64 +721,151 @@ async def delete_subscription_command(message: types.Message):
         await message.reply("У вас нет прав для выполнения этой команды.")
         return
 
-    expiry = load_json(EXPIRY_DB_PATH)
-    accs = load_json(ACCS_DB_PATH)
+    try:
+        prefix, expiry_from, expiry_to = parse_subscribers_filter(message.get_args())
+    except ValueError:
+        await message.reply(
+            "Использование: /delete_subscription [ID или начало логина] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]"
+        )
+        return
+
+    text, keyboard = await render_subscribers_page(prefix, expiry_from, expiry_to)
+    await message.reply(text, reply_markup=keyboard)
 
-    if not expiry:
-        await message.reply("Нет пользователей с активными подписками.")
+
+@router.route(callbacks.SUBSCRIBERS)
+async def subscribers_page_callback(callback_query: types.CallbackQuery, op, prefix, expiry_from, expiry_to, anchor):
+    """
+    Листание списка подписок для удаления.
+    """
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
         return
 
-    # Генерируем список пользователей с кнопками для удаления
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    for username, expiry_date in expiry.items():
-        keyboard.add(InlineKeyboardButton(f"{username} (до {expiry_date})", callback_data=f"delete_{username}"))
+    text, keyboard = await render_subscribers_page(
+        prefix, _unpack_date(expiry_from), _unpack_date(expiry_to),
+        after=anchor if op == "n" else None, before=anchor if op == "p" else None,
+    )
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+    await callback_query.answer()
 
-    await message.reply(
-        "Выберите пользователя для удаления подписки:",
-        reply_markup=keyboard
+
+def parse_subscribers_filter(args):
+    """
+    Разбирает фильтр списка подписок: ID или начало логина и диапазон срока действия.
+    :return: (префикс логина, дата "с", дата "по" не включительно) — даты в формате ГГГГ-ММ-ДД или None.
+    """
+    prefix, expiry_from, expiry_to = "", None, None
+    for token in args.split():
+        if token.startswith("from="):
+            expiry_from = datetime.strptime(token[5:], "%Y-%m-%d").strftime("%Y-%m-%d")
+        elif token.startswith("to="):
+            expiry_to = (datetime.strptime(token[3:], "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+        elif token.isdigit():
+            prefix = f"User{token}"
+        else:
+            prefix = token
+    # Фильтр передаётся в callback_data, размер которой ограничен 64 байтами
+    if len(prefix) > 20 or callbacks.SEP in prefix:
+        raise ValueError("Неверный префикс логина.")
+    return prefix, expiry_from, expiry_to
+
+
+def _pack_date(date_str):
+    return date_str.replace("-", "") if date_str else ""
+
+
+def _unpack_date(packed):
+    return f"{packed[:4]}-{packed[4:6]}-{packed[6:]}" if packed else None
+
+
+async def render_subscribers_page(prefix, expiry_from, expiry_to, after=None, before=None):
+    """
+    Формирует одну страницу списка подписок с кнопками удаления и листания.
+    :return: Текст сообщения и клавиатура.
+    """
+    # База должна учитывать последние изменения хранилища
+    await store.flush()
+    rows, has_more = await db.run(
+        db.browse_accounts, prefix, expiry_from, expiry_to, after, before, SUBSCRIBERS_PAGE_SIZE
     )
+    if not rows:
+        return "Пользователи с подписками не найдены.", None
 
-@dp.callback_query_handler(lambda c: c.data.startswith("delete_"))
-async def delete_subscription_callback(callback_query: types.CallbackQuery):
+    keyboard = InlineKeyboardMarkup(row_width=1)
+    for username, expiry_date in rows:
+        try:
+            callback_data = callbacks.DELETE_SUBSCRIPTION.encode(username=username)
+        except ValueError:
+            continue  # Логин не помещается в callback_data
+        keyboard.add(InlineKeyboardButton(f"{username} (до {expiry_date})", callback_data=callback_data))
+
+    # Назад можно листать, если пришли вперёд или перед страницей есть ещё строки
+    has_prev = after is not None or (before is not None and has_more)
+    has_next = before is not None or has_more
+    filter_data = {"prefix": prefix, "expiry_from": _pack_date(expiry_from), "expiry_to": _pack_date(expiry_to)}
+    navigation = []
+    for show, label, op, anchor in ((has_prev, "◀️ Назад", "p", rows[0][0]), (has_next, "Далее ▶️", "n", rows[-1][0])):
+        if not show:
+            continue
+        try:
+            callback_data = callbacks.SUBSCRIBERS.encode(op=op, anchor=anchor, **filter_data)
+        except ValueError:
+            continue  # Слишком длинный логин-граница
+        navigation.append(InlineKeyboardButton(label, callback_data=callback_data))
+    if navigation:
+        keyboard.row(*navigation)
+
+    filters = []
+    if prefix:
+        filters.append(f"логин {prefix}*")
+    if expiry_from:
+        filters.append(f"с {expiry_from}")
+    if expiry_to:
+        last_day = datetime.strptime(expiry_to, "%Y-%m-%d") - timedelta(days=1)
+        filters.append(f"по {last_day.strftime('%Y-%m-%d')}")
+    text = "Выберите пользователя для удаления подписки"
+    if filters:
+        text += f" ({', '.join(filters)})"
+    return f"{text}:", keyboard
+
+@router.route(callbacks.DELETE_SUBSCRIPTION)
+async def delete_subscription_callback(callback_query: types.CallbackQuery, username):
     """
     Обработка удаления подписки.
     """
-    username = callback_query.data.split("_")[1]  # Извлекаем логин пользователя
-    expiry = load_json(EXPIRY_DB_PATH)
-    accs = load_json(ACCS_DB_PATH)
-
-    # Получаем ID пользователя из имени (User<ID>)
-    try:
-        user_id = int(username.replace("User", ""))
-    except ValueError:
-        await callback_query.answer("Ошибка в имени пользователя.", show_alert=True)
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
         return
 
-    # Проверяем, существует ли пользователь в базе
-    if username not in expiry:
-        await callback_query.message.edit_text(
-            f"Пользователь {username} уже удалён или не существует.",
-            reply_markup=None
-        )
-        return
+    # ID пользователя есть только у логинов вида User<ID>; прочие (из /admin_create, /admin_bulk) удаляются без уведомления
+    user_id = telegram_id_from_login(username)
 
-    # Удаляем пользователя из баз
-    del expiry[username]
-    if username in accs:
-        del accs[username]
+    async with user_locks.lock(username):
+        # Проверяем, существует ли пользователь в базе
+        if store.get_expiry(username) is None:
+            await callback_query.message.edit_text(
+                f"Пользователь {username} уже удалён или не существует.",
+                reply_markup=None
+            )
+            return
 
-    save_json(EXPIRY_DB_PATH, expiry)
-    save_json(ACCS_DB_PATH, accs)
+        # Удаляем пользователя из баз и отменяем связанные задачи
+        store.remove(username)
+        if user_id is not None:
+            job_scheduler.cancel(f"reminder_{user_id}")
+        job_scheduler.cancel(f"trial_{username}")
 
     # Уведомляем пользователя
-    try:
-        await bot.send_message(
-            user_id,
-            "Ваша подписка была удалена администратором. Обратитесь в поддержку, если у вас есть вопросы.",
-            reply_markup=support_chat_button()
-        )
-    except Exception as e:
-        logging.error(f"Не удалось отправить сообщение пользователю {username}: {e}")
+    if user_id is not None:
+        try:
+            await bot.send_message(
+                user_id,
+                "Ваша подписка была удалена администратором. Обратитесь в поддержку, если у вас есть вопросы.",
+                reply_markup=keyboards.SUPPORT_CHAT
+            )
+        except Exception as e:
+            logging.error(f"Не удалось отправить сообщение пользователю {username}: {e}")
 
     # Обновляем сообщение для администратора
     await callback_query.message.edit_text(
@@ -342,7 +875,7 @@ async def delete_subscription_callback(callback_query: types.CallbackQuery):
     await callback_query.answer("Подписка удалена.")
     
 
-@dp.callback_query_handler(lambda c: c.data == "trial")
+@router.route(callbacks.TRIAL)
 async def trial_button_callback(callback_query: types.CallbackQuery):
     """
     Обработка нажатия кнопки "Пробный период".
@@ -350,42 +883,39 @@ async def trial_button_callback(callback_query: types.CallbackQuery):
     user_id = callback_query.from_user.id
     username = f"User{user_id}"
 
-    # Проверка активной подписки
-    expiry = load_json(EXPIRY_DB_PATH)
-    if username in expiry:
-        expiry_date = parse_expiry_date(expiry[username])
-        if expiry_date > datetime.now():
+    # Без блокировки одновременное подтверждение платежа могло бы быть перезаписано пробным периодом
+    async with user_locks.lock(username):
+        # Проверка активной подписки
+        current_expiry = store.get_expiry(username)
+        if current_expiry:
+            expiry_date = parse_expiry_date(current_expiry)
+            if expiry_date > datetime.now():
+                await callback_query.message.edit_text(
+                    "У вас уже есть активная подписка. Пробный период недоступен.\n\n"
+                    "Продлите подписку через главное меню.",
+                    reply_markup=keyboards.BACK_TO_MAIN_MENU
+                )
+                return
+
+        # Проверка и отметка использования пробного периода (атомарно для всех процессов бота)
+        if not await store.claim_trial(user_id):
             await callback_query.message.edit_text(
-                "У вас уже есть активная подписка. Пробный период недоступен.\n\n"
-                "Продлите подписку через главное меню.",
-                reply_markup=back_to_main_menu()
+                "Вы уже использовали пробный период.\n\n"
+                "Если вы хотите продолжить пользоваться сервисом, оформите подписку через главное меню.",
+                reply_markup=keyboards.BACK_TO_MAIN_MENU
             )
             return
 
-    # Проверка, использовался ли пробный период
-    trial_users = load_trial_usage()
-    if user_id in trial_users:
-        await callback_query.message.edit_text(
-            "Вы уже использовали пробный период.\n\n"
-            "Если вы хотите продолжить пользоваться сервисом, оформите подписку через главное меню.",
-            reply_markup=back_to_main_menu()
-        )
-        return
+        # Активируем пробный период
+        password = generate_password()
+        trial_end_time = datetime.now() + timedelta(hours=8)
 
-    # Активируем пробный период
-    password = generate_password()
-    trial_end_time = datetime.now() + timedelta(hours=8)
-
-    accs = load_json(ACCS_DB_PATH)
-    accs[username] = password
-    expiry[username] = trial_end_time.strftime("%Y-%m-%d %H:%M:%S")
-
-    save_json(ACCS_DB_PATH, accs)
-    save_json(EXPIRY_DB_PATH, expiry)
-
-    # Сохраняем пользователя как использовавшего пробный период
-    trial_users.append(user_id)
-    save_trial_usage(trial_users)
+        trial_end_str = trial_end_time.strftime("%Y-%m-%d %H:%M:%S")
+        store.set_account(username, password, trial_end_str)
+        # Устанавливаем задачу на удаление подписки
+        job_scheduler.schedule(
+            f"trial_{username}", "trial_delete", trial_end_time, username=username, expiry_date=trial_end_str
+        )
 
     # Перезагружаем TorrServer
     restart_torrserver()
@@ -399,7 +929,7 @@ async def trial_button_callback(callback_query: types.CallbackQuery):
         f"*Пароль:* {password}\n"
         f"*Срок действия:* {trial_end_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n"
         "Спасибо, что выбрали наш сервис!",
-        reply_markup=back_to_main_menu(),
+        reply_markup=keyboards.BACK_TO_MAIN_MENU,
         parse_mode="Markdown"
     )
 
@@ -412,34 +942,114 @@ async def trial_button_callback(callback_query: types.CallbackQuery):
         f"Пароль: {password}",
         parse_mode="Markdown"
     )
-
-    # Устанавливаем задачу на удаление подписки
-    scheduler.add_job(
-        delete_trial_account,
-        trigger=DateTrigger(run_date=trial_end_time),
-        args=[username],
-        id=f"trial_{username}"
-    )
     await callback_query.answer()
 
 
 
-def delete_trial_account(username):
+async def delete_trial_account(username, expiry_date=None):
     """
-    Удаляет пробный аккаунт после истечения времени.
+    Удаляет пробный аккаунт после истечения времени. Если подписку успели
+    продлить (оплата во время пробного периода), аккаунт не трогаем.
+    :param expiry_date: Срок окончания пробного периода, записанный при активации
+                        (в задачах, созданных до его появления, отсутствует).
+    :return: True, если аккаунт удалён.
     """
-    accs = load_json(ACCS_DB_PATH)
-    expiry = load_json(EXPIRY_DB_PATH)
+    async with user_locks.lock(username):
+        current_expiry = store.get_expiry(username)
+        if current_expiry is None:
+            return False
+        if expiry_date is not None:
+            if current_expiry != expiry_date:
+                return False
+        elif parse_expiry_date(current_expiry) > datetime.now():
+            return False
+        store.remove(username)
 
-    if username in accs:
-        del accs[username]
-    if username in expiry:
-        del expiry[username]
+    logging.info(f"Пробный аккаунт {username} был удалён.")
+    return True
 
-    save_json(ACCS_DB_PATH, accs)
-    save_json(EXPIRY_DB_PATH, expiry)
 
-    logging.info(f"Пробный аккаунт {username} был удалён.")
+async def delete_trial_accounts(jobs):
+    """
+    Удаляет пачку истёкших пробных аккаунтов с одной перезагрузкой TorrServer.
+    """
+    removed = [await delete_trial_account(**job) for job in jobs]
+    if any(removed):
+        restart_torrserver()
+
+
+job_scheduler.register("reminder", send_reminder)
+job_scheduler.register("trial_delete", delete_trial_accounts, batch=True)
+job_scheduler.register("pending_digest", send_pending_digest)
+
+
+# ====== Очистка истёкших подписок ======
+async def sweep_expired_accounts():
+    """
+    Находит истёкшие подписки постранично, удаляет их одной пачкой и один раз перезагружает TorrServer.
+    :return: Количество удалённых учётных записей и длительность очистки в секундах.
+    """
+    # При нескольких процессах очистку выполняет только ведущий
+    if not cluster.is_leader:
+        return 0, 0.0
+    started = time.monotonic()
+    # Индекс в базе должен учитывать последние продления
+    await store.flush()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # Страницы выбираются по курсору (срок действия, логин), поэтому удалять
+    # и сбрасывать хранилище между страницами не нужно
+    found, after = [], None
+    while True:
+        rows = await db.run(db.expired_before, now, SWEEP_BATCH_SIZE, after)
+        found.extend(rows)
+        if len(rows) < SWEEP_BATCH_SIZE:
+            break
+        after = rows[-1]
+
+    async with user_locks.lock_many(username for username, _ in found):
+        # Пропускаем подписки, продлённые после выборки
+        removed = store.remove_many([username for username, expiry_str in found if store.get_expiry(username) == expiry_str])
+        if removed:
+            job_scheduler.cancel_many([f"trial_{username}" for username in removed])
+    if removed:
+        await store.flush()
+        restart_torrserver()
+    duration = time.monotonic() - started
+    logger.info(f"Очистка истёкших подписок: удалено {len(removed)} за {duration:.3f} сек.")
+    return len(removed), duration
+
+
+@dp.message_handler(commands=["broadcast"])
+async def broadcast_command(message: types.Message):
+    """
+    Рассылает сообщение всем пользователям с действующей подпиской (только для администратора).
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+
+    text = message.get_args()
+    if not text:
+        await message.reply("Использование команды:\n`/broadcast текст сообщения`", parse_mode="Markdown")
+        return
+
+    chat_ids = await db.run(db.active_subscribers, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    broadcast_id = await broadcaster.broadcast(text, chat_ids)
+    await message.reply(f"Рассылка #{broadcast_id} запущена: {len(chat_ids)} получателей.")
+
+
+@dp.message_handler(commands=["sweep"])
+async def sweep_command(message: types.Message):
+    """
+    Запускает очистку истёкших подписок вручную (только для администратора).
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+
+    removed, duration = await sweep_expired_accounts()
+    await message.reply(f"Удалено истёкших подписок: {removed}.\nВремя очистки: {duration:.3f} сек.")
 
 
 @dp.message_handler(commands=["start"])
@@ -449,15 +1059,17 @@ async def start_command(message: types.Message):
     """
     await message.reply(
         "Привет! Я бот для подписок TorrServer. Выберите нужное действие из меню ниже:",
-        reply_markup=inline_main_menu()
+        reply_markup=keyboards.MAIN_MENU
     )
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_reject_"))
-async def topup_reject_callback(callback_query: types.CallbackQuery):
+@router.route(callbacks.TOPUP_REJECT)
+async def topup_reject_callback(callback_query: types.CallbackQuery, user_id):
     """
     Отклонение пополнения баланса администратором.
     """
-    user_id = int(callback_query.data.split("_")[2])
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
 
     # Уведомляем пользователя
     try:
@@ -477,35 +1089,35 @@ async def topup_reject_callback(callback_query: types.CallbackQuery):
     await callback_query.answer("Пополнение отклонено.")
 
 
-@dp.callback_query_handler(lambda c: c.data == "main_menu")
+@router.route(callbacks.MAIN_MENU)
 async def main_menu_button_callback(callback_query: types.CallbackQuery):
     """
     Обработка нажатия кнопки "Главное меню".
     """
     await callback_query.message.edit_text(
         "Выберите нужное действие:",
-        reply_markup=inline_main_menu()
+        reply_markup=keyboards.MAIN_MENU
     )
     await callback_query.answer()
 
 
-@dp.callback_query_handler(lambda c: c.data == "get_account")
+@router.route(callbacks.GET_ACCOUNT)
 async def get_account_button_callback(callback_query: types.CallbackQuery):
     """
     Получение данных учётной записи.
     """
     user_id = callback_query.from_user.id
     username = f"User{user_id}"
-    accs = load_json(ACCS_DB_PATH)
-    expiry = load_json(EXPIRY_DB_PATH)
+    password = store.get_password(username)
+    expiry_str = store.get_expiry(username)
 
-    if username in accs and username in expiry:
+    if password and expiry_str:
         try:
-            expiry_date = parse_expiry_date(expiry[username])  # Универсальная обработка времени
+            expiry_date = parse_expiry_date(expiry_str)  # Универсальная обработка времени
         except ValueError as e:
             await callback_query.message.edit_text(
                 f"Ошибка в данных учётной записи: {e}. Пожалуйста, свяжитесь с поддержкой.",
-                reply_markup=support_chat_button()
+                reply_markup=keyboards.SUPPORT_CHAT
             )
             return
 
@@ -515,7 +1127,7 @@ async def get_account_button_callback(callback_query: types.CallbackQuery):
                 f"*Ваши данные для подключения к TorrServer:*\n\n"
                 f"*Адрес:* {TORR_SERVER_ADDRESS}\n"
                 f"*Логин:* {username}\n"
-                f"*Пароль:* {accs[username]}\n"
+                f"*Пароль:* {password}\n"
                 f"*Срок действия подписки:* {expiry_date.strftime('%Y-%m-%d %H:%M:%S')}\n"
             )
             if is_trial:
@@ -525,14 +1137,14 @@ async def get_account_button_callback(callback_query: types.CallbackQuery):
 
             await callback_query.message.edit_text(
                 message,
-                reply_markup=back_to_main_menu(),
+                reply_markup=keyboards.BACK_TO_MAIN_MENU,
                 parse_mode="Markdown"
             )
             return
 
     await callback_query.message.edit_text(
         "У вас нет активной подписки. Оформите подписку через главное меню.",
-        reply_markup=back_to_main_menu()
+        reply_markup=keyboards.BACK_TO_MAIN_MENU
     )
     await callback_query.answer()
 
@@ -545,17 +1157,17 @@ async def get_account_command(message: types.Message):
     """
     user_id = message.from_user.id
     username = f"User{user_id}"
-    accs = load_json(ACCS_DB_PATH)
-    expiry = load_json(EXPIRY_DB_PATH)
+    password = store.get_password(username)
+    expiry_str = store.get_expiry(username)
 
-    if username in accs and username in expiry:
-        expiry_date = datetime.strptime(expiry[username], "%Y-%m-%d")
+    if password and expiry_str:
+        expiry_date = datetime.strptime(expiry_str, "%Y-%m-%d")
         if expiry_date > datetime.now():
             await message.reply(
                 f"Ваши данные для подключения к TorrServer:\n\n"
                 f"**Адрес:** {TORR_SERVER_ADDRESS}\n"
                 f"**Логин:** {username}\n"
-                f"**Пароль:** {accs[username]}\n"
+                f"**Пароль:** {password}\n"
                 f"**Срок действия подписки:** {expiry_date.strftime('%Y-%m-%d')}\n\n"
                 f"Спасибо, что пользуетесь нашим сервисом!",
                 parse_mode="Markdown"
@@ -586,21 +1198,15 @@ async def admin_create_account(message: types.Message):
         password = args[2] if len(args) > 2 else generate_password()
         days = int(args[3]) if len(args) > 3 else 30
 
-        accs = load_json(ACCS_DB_PATH)
-        expiry = load_json(EXPIRY_DB_PATH)
+        async with user_locks.lock(username):
+            # Проверка, существует ли уже такой логин
+            if store.has_account(username):
+                await message.reply(f"Учётная запись с логином `{username}` уже существует.")
+                return
 
-        # Проверка, существует ли уже такой логин
-        if username in accs:
-            await message.reply(f"Учётная запись с логином `{username}` уже существует.")
-            return
-
-        # Добавление новой учётной записи
-        accs[username] = password
-        expiry_date = datetime.now() + timedelta(days=days)
-        expiry[username] = expiry_date.strftime("%Y-%m-%d")
-
-        save_json(ACCS_DB_PATH, accs)
-        save_json(EXPIRY_DB_PATH, expiry)
+            # Добавление новой учётной записи
+            expiry_date = datetime.now() + timedelta(days=days)
+            store.set_account(username, password, expiry_date.strftime("%Y-%m-%d"))
 
         # Перезапуск TorrServer
         restart_torrserver()
@@ -611,7 +1217,7 @@ async def admin_create_account(message: types.Message):
             f"*Логин:* {username}\n"
             f"*Пароль:* {password}\n"
             f"*Срок действия:* {expiry_date.strftime('%Y-%m-%d')}\n"
-            f"TorrServer перезапущен."
+            f"TorrServer будет перезагружен в течение {int(TORRSERVER_RELOAD_WINDOW)} сек."
         )
     except ValueError:
         await message.reply("Использование команды:\n`/admin_create логин [пароль] [дней подписки]`", parse_mode="Markdown")
@@ -619,55 +1225,161 @@ async def admin_create_account(message: types.Message):
         logger.error(f"Ошибка при создании учётной записи: {e}")
         await message.reply("Произошла ошибка при создании учётной записи.")
 
-@dp.callback_query_handler(lambda c: c.data == "pay")
-async def pay_button_callback(callback_query: types.CallbackQuery):
+# ====== Массовые операции ======
+BULK_USAGE = (
+    "Массовые операции:\n"
+    "• создание и продление — отправьте файл CSV (логин,дней[,пароль]) или JSON "
+    "с подписью /admin_bulk;\n"
+    "• удаление — /admin_bulk delete [ID или начало логина] [from=ГГГГ-ММ-ДД] [to=ГГГГ-ММ-ДД]."
+)
+
+
+@dp.message_handler(
+    lambda m: (m.caption or "").startswith("/admin_bulk"), content_types=types.ContentType.DOCUMENT
+)
+async def admin_bulk_document(message: types.Message):
     """
-    Обработка нажатия кнопки "Оплатить подписку".
+    Массовое создание и продление учётных записей из файла (только для администратора).
+    Все изменения применяются одной пачкой с одной перезагрузкой TorrServer.
     """
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    keyboard.add(
-        InlineKeyboardButton("Оплата через СБП Озон Банк", callback_data="pay_sbp"),
-        InlineKeyboardButton("Оплата через Telegram-кошелёк", callback_data="pay_tg_wallet"),
-        InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+
+    document = message.document
+    if document.file_size and document.file_size > bulk.MAX_DOCUMENT_SIZE:
+        await message.reply(f"Файл слишком большой (максимум {bulk.MAX_DOCUMENT_SIZE // 1024 // 1024} МБ).")
+        return
+
+    started = time.monotonic()
+    data = (await document.download(destination_file=io.BytesIO())).getvalue()
+    try:
+        items, errors = bulk.parse_accounts_document(data, document.file_name or "")
+    except ValueError as e:
+        await message.reply(f"Не удалось разобрать файл: {e}\n\n{BULK_USAGE}")
+        return
+
+    accounts, reminders, report = [], [], []
+    async with user_locks.lock_many(login for login, _, _ in items):
+        now = datetime.now()
+        for login, days, password in items:
+            current_expiry_str = store.get_expiry(login)
+            existed = current_expiry_str is not None or store.has_account(login)
+            try:
+                current_expiry = parse_expiry_date(current_expiry_str) if current_expiry_str else now
+            except ValueError:
+                current_expiry = now
+            new_expiry = max(current_expiry, now) + timedelta(days=days)
+            expiry_str = new_expiry.strftime("%Y-%m-%d %H:%M:%S")
+            password = store.get_password(login) or password or generate_password()
+
+            accounts.append((login, password, expiry_str))
+            job = reminder_job(login, new_expiry)
+            if job is not None:
+                reminders.append(job)
+            report.append((login, password, expiry_str, "extended" if existed else "created"))
+
+        store.set_accounts(accounts)
+        job_scheduler.schedule_many(reminders)
+    await store.flush()
+    if accounts:
+        restart_torrserver()
+
+    extended = sum(1 for row in report if row[3] == "extended")
+    text = (
+        f"Обработано за {time.monotonic() - started:.2f} сек.\n"
+        f"Создано: {len(report) - extended}, продлено: {extended}, ошибок: {len(errors)}."
     )
+    if errors:
+        text += "\n\nОшибки (строка: причина):\n" + "\n".join(errors[:20])
+        if len(errors) > 20:
+            text += f"\n…и ещё {len(errors) - 20}."
+    await message.reply(text)
+    if report:
+        await message.reply_document(types.InputFile(io.BytesIO(bulk.accounts_csv(report)), filename="accounts.csv"))
+
 
+@dp.message_handler(commands=["admin_bulk"])
+async def admin_bulk_command(message: types.Message):
+    """
+    Массовое удаление учётных записей по фильтру (только для администратора).
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+
+    args = message.get_args().split(maxsplit=1)
+    if not args or args[0] != "delete":
+        await message.reply(BULK_USAGE)
+        return
+    try:
+        prefix, expiry_from, expiry_to = parse_subscribers_filter(args[1] if len(args) > 1 else "")
+    except ValueError:
+        await message.reply(BULK_USAGE)
+        return
+    if not (prefix or expiry_from or expiry_to):
+        await message.reply("Укажите фильтр: удаление всех учётных записей сразу не поддерживается.")
+        return
+
+    started = time.monotonic()
+    await store.flush()
+    found, after = [], None
+    while True:
+        rows, has_more = await db.run(db.browse_accounts, prefix, expiry_from, expiry_to, after, None, 1000)
+        found.extend(rows)
+        if not has_more:
+            break
+        after = rows[-1][0]
+
+    async with user_locks.lock_many(login for login, _ in found):
+        # Подписки, продлённые после выборки, под фильтр могли уже не попадать
+        removed = store.remove_many([login for login, expiry_str in found if store.get_expiry(login) == expiry_str])
+        job_ids = [f"trial_{login}" for login in removed]
+        job_ids += [f"reminder_{user_id}" for user_id in map(telegram_id_from_login, removed) if user_id is not None]
+        job_scheduler.cancel_many(job_ids)
+    await store.flush()
+    if removed:
+        restart_torrserver()
+
+    await message.reply(
+        f"Удалено учётных записей: {len(removed)} за {time.monotonic() - started:.2f} сек."
+    )
+
+
+@router.route(callbacks.PAY)
+async def pay_button_callback(callback_query: types.CallbackQuery):
+    """
+    Обработка нажатия кнопки "Оплатить подписку".
+    """
     await callback_query.message.edit_text(
         "Выберите способ оплаты подписки:",
-        reply_markup=keyboard
+        reply_markup=keyboards.PAY_METHODS
     )
     await callback_query.answer()
 
 # СБП ОЗОН БАНК -----------------------------------------------------------------------------------------------------
 
-@dp.callback_query_handler(lambda c: c.data == "pay_sbp")
+@router.route(callbacks.PAY_SBP)
 async def pay_sbp_callback(callback_query: types.CallbackQuery):
     """
     Выбор тарифа для оплаты через СБП Озон Банк.
     """
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    keyboard.add(
-        InlineKeyboardButton("1 месяц - 100 руб", callback_data="topup_sbp_amount_100"),
-        InlineKeyboardButton("3 месяца - 300 руб", callback_data="topup_sbp_amount_300"),
-        InlineKeyboardButton("6 месяцев - 600 руб", callback_data="topup_sbp_amount_600"),
-        InlineKeyboardButton("🔙 Назад", callback_data="pay")
-    )
-
     await callback_query.message.edit_text(
         f"Выберите тариф для оплаты через СБП Озон Банк. Переводите средства на номер:\n\n"
         f"💳 {SBP_PHONE}\n\n"
         "После перевода обязательно укажите уникальный идентификатор, который будет предоставлен на следующем шаге.",
-        reply_markup=keyboard
+        reply_markup=keyboards.SBP_TARIFFS
     )
     await callback_query.answer()
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_sbp_amount_"))
-async def handle_sbp_topup(callback_query: types.CallbackQuery):
+@router.route(callbacks.SBP_AMOUNT)
+async def handle_sbp_topup(callback_query: types.CallbackQuery, amount):
     """
     Обработка выбора тарифа для оплаты через СБП Озон Банк.
     """
-    amount = int(callback_query.data.split("_")[-1])
-    unique_id = str(uuid.uuid4())[:8]
+    unique_id = statements.new_payment_id()
     user_id = callback_query.from_user.id  # Получаем ID пользователя
+    await db.run(db.create_payment, unique_id, user_id, "sbp", amount)
 
     await callback_query.message.edit_text(
         f"Вы выбрали тариф на сумму *{amount} руб.*\n\n"
@@ -676,7 +1388,7 @@ async def handle_sbp_topup(callback_query: types.CallbackQuery):
         f"‼️ Укажите уникальный идентификатор в комментарии: `{unique_id}`\n\n"
         f"После перевода нажмите кнопку 'Оплатил'.",
         reply_markup=InlineKeyboardMarkup().add(
-            InlineKeyboardButton("Оплатил", callback_data=f"topup_sbp_paid_{amount}_{unique_id}")
+            InlineKeyboardButton("Оплатил", callback_data=callbacks.SBP_PAID.encode(amount=amount, payment_id=unique_id))
 
         ),
         parse_mode="Markdown"
@@ -685,67 +1397,56 @@ async def handle_sbp_topup(callback_query: types.CallbackQuery):
     await callback_query.answer()
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_sbp_paid_"))
-async def topup_sbp_paid_callback(callback_query: types.CallbackQuery):
+@router.route(callbacks.SBP_PAID)
+async def topup_sbp_paid_callback(callback_query: types.CallbackQuery, amount, payment_id):
     """
     Обработка нажатия кнопки "Оплатил" для оплаты через СБП.
     """
     try:
-        # Разбираем callback_data
-        data = callback_query.data.split("_")
-        amount = int(data[3])  # Сумма перевода
-        unique_id = data[4]    # Уникальный идентификатор
-
         user_id = callback_query.from_user.id
         username = callback_query.from_user.username or "Без имени"
 
-        # Уведомляем администратора
-        keyboard_admin = InlineKeyboardMarkup(row_width=1)
-        keyboard_admin.add(
-            InlineKeyboardButton(
-                "Подтвердить", callback_data=f"topup_confirm_sbp_{user_id}_{amount}_{unique_id}"
-            ),
-            InlineKeyboardButton(
-                "Отклонить", callback_data=f"topup_reject_sbp_{user_id}"
-            )
-        )
+        # Повторное нажатие «Оплатил» не дублирует запрос администратору
+        if not await db.run(db.submit_payment, payment_id, user_id, "sbp", amount):
+            await callback_query.answer("Запрос по этому платежу уже отправлен.")
+            return
 
-        await bot.send_message(
-            ADMIN_ID,
-            f"Пользователь @{username} (ID: {user_id}) сообщил о переводе через СБП.\n\n"
-            f"Сумма: *{amount} руб.*\n"
-            f"Уникальный идентификатор: `{unique_id}`",
-            reply_markup=keyboard_admin,
-            parse_mode="Markdown"
-        )
+        # Платёж попадает в очередь /pending, администратор получает общую сводку
+        logging.info(f"Платёж через СБП на проверке: @{username} (ID: {user_id}), {amount} руб., {payment_id}")
+        schedule_pending_digest()
 
         # Уведомляем пользователя
         await callback_query.message.edit_text(
             "Ваш запрос на оплату подписки отправлен на проверку.\nОжидайте подтверждения от администратора.",
-            reply_markup=back_to_main_menu()
+            reply_markup=keyboards.BACK_TO_MAIN_MENU
         )
         await callback_query.answer("Запрос отправлен администратору.")
     except Exception as e:
         logging.error(f"Ошибка при обработке оплаты через СБП: {e}")
         await callback_query.answer("Произошла ошибка. Пожалуйста, повторите попытку.", show_alert=True)
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_confirm_sbp_"))
-async def topup_confirm_sbp_callback(callback_query: types.CallbackQuery):
+@router.route(callbacks.CONFIRM_SBP)
+async def topup_confirm_sbp_callback(callback_query: types.CallbackQuery, user_id, amount, payment_id):
     """
     Обработка подтверждения оплаты через СБП администратором.
     """
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
     try:
-        # Разбираем данные из callback_data
-        data = callback_query.data.split("_")
-        user_id = int(data[3])  # ID пользователя
-        amount = int(data[4])  # Сумма
-        unique_id = data[5]    # Уникальный идентификатор
-
-        # Вычисляем дни подписки на основе суммы
-        days = calculate_subscription_days(amount)
+        # Платёж из сообщения, отправленного до появления журнала, регистрируем по данным кнопки
+        if not await register_legacy_payment(payment_id, user_id, "sbp", amount):
+            await callback_query.answer("Неверная сумма платежа.", show_alert=True)
+            return
 
-        # Создаём или продлеваем учётную запись
-        username, password, expiry_date = create_or_extend_torr_account(user_id, additional_days=days)
+        # Подтверждаем платёж и продлеваем подписку не более одного раза
+        payment, account = await confirm_payment(payment_id)
+        if account is None:
+            status = payment.status if payment else "не найден"
+            await callback_query.answer(f"Платёж уже обработан (статус: {status}).", show_alert=True)
+            return
+        username, password, expiry_date = account
+        user_id, amount = payment.user_id, payment.amount
 
         # Уведомляем пользователя
         await bot.send_message(
@@ -776,37 +1477,28 @@ async def topup_confirm_sbp_callback(callback_query: types.CallbackQuery):
 
 # TELEGRAM ------------------------------------------------------------------------------------------------------------------------------
 
-@dp.callback_query_handler(lambda c: c.data == "pay_tg_wallet")
+@router.route(callbacks.PAY_TG_WALLET)
 async def pay_tg_wallet_callback(callback_query: types.CallbackQuery):
     """
     Обработчик выбора оплаты через Telegram-кошелёк.
     """
-    keyboard = InlineKeyboardMarkup(row_width=1)
-    keyboard.add(
-        InlineKeyboardButton("1 месяц - 1 USDT", callback_data="topup_tg_wallet_amount_1"),
-        InlineKeyboardButton("3 месяца - 3 USDT", callback_data="topup_tg_wallet_amount_3"),
-        InlineKeyboardButton("6 месяцев - 6 USDT", callback_data="topup_tg_wallet_amount_6"),
-        InlineKeyboardButton("🔙 Назад", callback_data="pay")
-    )
-
     await callback_query.message.edit_text(
         "Выберите тариф для оплаты через Telegram-кошелёк. Переводите средства на:\n\n"
         f"💳 {ADMIN_WALLET}\n\n"
         "После перевода обязательно укажите уникальный идентификатор, который будет предоставлен на следующем шаге.",
-        reply_markup=keyboard
+        reply_markup=keyboards.TG_WALLET_TARIFFS
     )
     await callback_query.answer()
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_tg_wallet_amount_"))
-async def handle_tg_wallet_topup(callback_query: types.CallbackQuery):
+@router.route(callbacks.TG_WALLET_AMOUNT)
+async def handle_tg_wallet_topup(callback_query: types.CallbackQuery, amount):
     """
     Обработка выбора тарифа для оплаты через Telegram-кошелёк.
     """
     try:
-        # Извлекаем сумму из callback_data
-        amount = int(callback_query.data.split("_")[-1])  # Получаем сумму (1, 3, 6)
-        unique_id = str(uuid.uuid4())[:8]  # Генерация уникального идентификатора
+        unique_id = statements.new_payment_id()  # Генерация уникального идентификатора
+        await db.run(db.create_payment, unique_id, callback_query.from_user.id, "tg_wallet", amount)
 
         logging.info(f"Выбрана сумма: {amount} USDT")
 
@@ -818,7 +1510,9 @@ async def handle_tg_wallet_topup(callback_query: types.CallbackQuery):
             f"‼️ Укажите уникальный идентификатор в комментарии: `{unique_id}`\n\n"
             f"После перевода нажмите кнопку 'Оплатил'.",
             reply_markup=InlineKeyboardMarkup().add(
-                InlineKeyboardButton("Оплатил", callback_data=f"topup_tg_wallet_paid_{unique_id}_{amount}")
+                InlineKeyboardButton(
+                    "Оплатил", callback_data=callbacks.TG_WALLET_PAID.encode(amount=amount, payment_id=unique_id)
+                )
             ),
             parse_mode="Markdown"
         )
@@ -828,46 +1522,28 @@ async def handle_tg_wallet_topup(callback_query: types.CallbackQuery):
         await callback_query.answer("Произошла ошибка. Попробуйте ещё раз.", show_alert=True)
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_tg_wallet_paid_"))
-async def topup_tg_wallet_paid_callback(callback_query: types.CallbackQuery):
+@router.route(callbacks.TG_WALLET_PAID)
+async def topup_tg_wallet_paid_callback(callback_query: types.CallbackQuery, amount, payment_id):
     """
     Обработка нажатия кнопки "Оплатил" для оплаты через Telegram-кошелёк.
     """
     try:
-        # Разбираем данные из callback_data
-        data = callback_query.data.split("_")
-        unique_id = data[4]  # Уникальный идентификатор
-        amount = int(data[5])  # Сумма перевода
-
         user_id = callback_query.from_user.id
         username = callback_query.from_user.username or "Без имени"
 
-        # Уведомляем администратора
-        keyboard_admin = InlineKeyboardMarkup(row_width=1)
-        keyboard_admin.add(
-            InlineKeyboardButton(
-                "Подтвердить", callback_data=f"topup_confirm_tg_wallet_{user_id}_{amount}_{unique_id}"
-            ),
-            InlineKeyboardButton(
-                "Отклонить", callback_data=f"topup_reject_tg_wallet_{user_id}"
-            )
-        )
-
-        logging.info(f"Отправка уведомления админу о платеже Telegram-кошельком: user_id={user_id}, amount={amount}, unique_id={unique_id}")
+        # Повторное нажатие «Оплатил» не дублирует запрос администратору
+        if not await db.run(db.submit_payment, payment_id, user_id, "tg_wallet", amount):
+            await callback_query.answer("Запрос по этому платежу уже отправлен.")
+            return
 
-        await bot.send_message(
-            ADMIN_ID,
-            f"Пользователь @{username} (ID: {user_id}) сообщил о переводе через Telegram-кошелёк.\n\n"
-            f"Сумма: *{amount} USDT*\n"
-            f"Уникальный идентификатор: `{unique_id}`",
-            reply_markup=keyboard_admin,
-            parse_mode="Markdown"
-        )
+        # Платёж попадает в очередь /pending, администратор получает общую сводку
+        logging.info(f"Платёж Telegram-кошельком на проверке: @{username} (ID: {user_id}), {amount} USDT, {payment_id}")
+        schedule_pending_digest()
 
         # Уведомляем пользователя
         await callback_query.message.edit_text(
             "Ваш запрос на оплату подписки отправлен на проверку.\nОжидайте подтверждения от администратора.",
-            reply_markup=back_to_main_menu()
+            reply_markup=keyboards.BACK_TO_MAIN_MENU
         )
 
         await callback_query.answer("Запрос отправлен администратору.")
@@ -876,21 +1552,28 @@ async def topup_tg_wallet_paid_callback(callback_query: types.CallbackQuery):
         await callback_query.answer("Произошла ошибка. Проверьте логи.", show_alert=True)
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("topup_confirm_tg_wallet_"))
-async def topup_confirm_tg_wallet_callback(callback_query: types.CallbackQuery):
+@router.route(callbacks.CONFIRM_TG_WALLET)
+async def topup_confirm_tg_wallet_callback(callback_query: types.CallbackQuery, user_id, amount, payment_id):
     logging.info(f"Обработчик вызван с callback_data: {callback_query.data}")
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
     try:
-        # Разбираем callback_data
-        data = callback_query.data.split("_")
-        user_id = int(data[4])  # ID пользователя
-        amount = int(data[5])  # Сумма перевода
-        unique_id = data[6]    # Уникальный идентификатор
+        logging.info(f"Разобранные данные: user_id={user_id}, amount={amount}, payment_id={payment_id}")
 
-        logging.info(f"Разобранные данные: user_id={user_id}, amount={amount}, unique_id={unique_id}")
+        # Платёж из сообщения, отправленного до появления журнала, регистрируем по данным кнопки
+        if not await register_legacy_payment(payment_id, user_id, "tg_wallet", amount):
+            await callback_query.answer("Неверная сумма платежа.", show_alert=True)
+            return
 
-        # Логика подтверждения
-        days = calculate_subscription_days(amount)
-        username, password, expiry_date = create_or_extend_torr_account(user_id, additional_days=days)
+        # Подтверждаем платёж и продлеваем подписку не более одного раза
+        payment, account = await confirm_payment(payment_id)
+        if account is None:
+            status = payment.status if payment else "не найден"
+            await callback_query.answer(f"Платёж уже обработан (статус: {status}).", show_alert=True)
+            return
+        username, password, expiry_date = account
+        user_id, amount = payment.user_id, payment.amount
 
         # Отправляем данные пользователю
         await bot.send_message(
@@ -922,22 +1605,136 @@ async def topup_confirm_tg_wallet_callback(callback_query: types.CallbackQuery):
 
 # -------------------------------------------------------------------------------------------------------------
 
-@dp.callback_query_handler(lambda c: c.data == "status")
+@router.route(callbacks.PAYMENT_REJECT)
+async def payment_reject_callback(callback_query: types.CallbackQuery, payment_id):
+    """
+    Отклонение платежа администратором (pending → rejected). Повторное нажатие ничего не меняет.
+    """
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+
+    if not await db.run(db.set_payment_status, payment_id, "rejected", "pending"):
+        payment = await db.run(db.get_payment, payment_id)
+        status = payment.status if payment else "не найден"
+        await callback_query.answer(f"Платёж уже обработан (статус: {status}).", show_alert=True)
+        return
+    payment = await db.run(db.get_payment, payment_id)
+
+    # Уведомляем пользователя
+    try:
+        await bot.send_message(
+            payment.user_id,
+            "Ваш запрос на пополнение баланса был отклонён администратором.\n"
+            "Пожалуйста, проверьте данные перевода и попробуйте снова."
+        )
+    except Exception as e:
+        logging.error(f"Не удалось отправить сообщение пользователю {payment.user_id}: {e}")
+
+    # Уведомляем администратора
+    method, currency = PAYMENT_METHODS.get(payment.method, (payment.method, ""))
+    await callback_query.message.edit_text(
+        f"Платёж {payment.id} ({method}, {payment.amount} {currency}) пользователя с ID {payment.user_id} отклонён.",
+        reply_markup=None
+    )
+    await callback_query.answer("Платёж отклонён.")
+
+
+@dp.message_handler(commands=["pending"])
+async def pending_command(message: types.Message):
+    """
+    Очередь платежей, ожидающих проверки. Доступно только администратору.
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+    text, keyboard = await render_pending_page()
+    await message.reply(text, reply_markup=keyboard)
+
+
+@router.route(callbacks.PENDING)
+async def pending_callback(callback_query: types.CallbackQuery, op, anchor, payment_id, count):
+    """
+    Листание очереди платежей и подтверждение/отклонение по одному или всей страницей.
+    """
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+
+    anchor = anchor or ""
+    notice = None
+    if op in ("c", "r"):
+        process = approve_payments if op == "c" else reject_payments
+        done = await process([payment_id])
+        notice = ("Платёж подтверждён." if op == "c" else "Платёж отклонён.") if done else "Платёж уже обработан."
+    elif op in ("ca", "ra"):
+        # Пачка задаётся размером страницы и последним платежом на ней
+        payments, _ = await db.run(db.pending_payments, _unpack_anchor(anchor), count)
+        if len(payments) != count or payments[-1].id != payment_id:
+            notice = "Очередь изменилась, проверьте страницу ещё раз."
+        else:
+            process = approve_payments if op == "ca" else reject_payments
+            done = await process([payment.id for payment in payments])
+            notice = f"{'Подтверждено' if op == 'ca' else 'Отклонено'} платежей: {done}."
+
+    text, keyboard = await render_pending_page(anchor)
+    try:
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    except MessageNotModified:
+        pass
+    await callback_query.answer(notice)
+
+
+@dp.message_handler(commands=["payments"])
+async def payments_command(message: types.Message):
+    """
+    История платежей для сверки: /payments [ID пользователя].
+    Доступно только администратору.
+    """
+    if message.from_user.id != ADMIN_ID:
+        await message.reply("У вас нет прав для выполнения этой команды.")
+        return
+
+    args = message.get_args().strip()
+    user_id = int(args) if args.isdigit() else None
+    history = await db.run(db.payment_history, user_id, None, None, 20)
+
+    lines = [f"Последние платежи{f' пользователя {user_id}' if user_id else ''}:"]
+    for payment in history:
+        method, currency = PAYMENT_METHODS.get(payment.method, (payment.method, ""))
+        lines.append(
+            f"{payment.created_at} {payment.id} — {payment.user_id}, {method}, "
+            f"{payment.amount} {currency}, {payment.status}"
+        )
+    if not history:
+        lines.append("нет")
+
+    if user_id is None:
+        since = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d %H:%M:%S")
+        lines.append("\nЗа 30 дней (способ, статус: количество, сумма):")
+        for method, status, count, total in await db.run(db.payment_totals, since):
+            name, currency = PAYMENT_METHODS.get(method, (method, ""))
+            lines.append(f"{name}, {status}: {count}, {total} {currency}")
+
+    await message.reply("\n".join(lines))
+
+
+@router.route(callbacks.STATUS)
 async def status_button_callback(callback_query: types.CallbackQuery):
     """
     Проверка статуса подписки.
     """
     user_id = callback_query.from_user.id
     username = f"User{user_id}"
-    expiry = load_json(EXPIRY_DB_PATH)
+    expiry_str = store.get_expiry(username)
 
-    if username in expiry:
+    if expiry_str:
         try:
-            expiry_date = parse_expiry_date(expiry[username])  # Универсальная обработка времени
+            expiry_date = parse_expiry_date(expiry_str)  # Универсальная обработка времени
         except ValueError as e:
             await callback_query.message.edit_text(
                 f"Ошибка в данных подписки: {e}. Пожалуйста, свяжитесь с поддержкой.",
-                reply_markup=support_chat_button()
+                reply_markup=keyboards.SUPPORT_CHAT
             )
             return
 
@@ -955,16 +1752,16 @@ async def status_button_callback(callback_query: types.CallbackQuery):
 
             await callback_query.message.edit_text(
                 message,
-                reply_markup=back_to_main_menu(),
+                reply_markup=keyboards.BACK_TO_MAIN_MENU,
                 parse_mode="Markdown"
             )
             return
 
     await callback_query.message.edit_text(
         "У вас нет активной подписки. Оформите подписку через главное меню.",
-        reply_markup=back_to_main_menu()
+        reply_markup=keyboards.BACK_TO_MAIN_MENU
     )
-    await callback_query.answ
+    await callback_query.answer()
 
 
 
@@ -974,10 +1771,9 @@ async def status_command(message: types.Message):
     Проверка статуса подписки.
     """
     user_id = message.from_user.id
-    expiry = load_json(EXPIRY_DB_PATH)
     username = f"User{user_id}"
 
-    expiry_date = expiry.get(username)
+    expiry_date = store.get_expiry(username)
     if expiry_date:
         expiry_date = datetime.strptime(expiry_date, "%Y-%m-%d")
         if expiry_date > datetime.now():
@@ -994,12 +1790,14 @@ async def status_command(message: types.Message):
         await message.reply("У вас нет активной подписки. Оформите подписку через меню.")
 
 
-@dp.callback_query_handler(lambda c: c.data.startswith("reject_"))
-async def reject_callback(callback_query: types.CallbackQuery):
+@router.route(callbacks.REJECT)
+async def reject_callback(callback_query: types.CallbackQuery, user_id):
     """
     Отклонение администратора.
     """
-    user_id = int(callback_query.data.split("_")[1])
+    if callback_query.from_user.id != ADMIN_ID:
+        await callback_query.answer("У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
 
     # Уведомляем пользователя
     await bot.send_message(
@@ -1015,5 +1813,23 @@ async def reject_callback(callback_query: types.CallbackQuery):
 
 # ====== Основной запуск ======
 if __name__ == "__main__":
-    from aiogram import executor
-    executor.start_polling(dp, skip_updates=True)
+    from aiogram.utils.executor import Executor
+
+    # Накопившиеся за время перезапуска обновления не пропускаем
+    executor = Executor(dp, skip_updates=False)
+    executor.on_startup(on_startup)
+    executor.on_shutdown(on_shutdown)
+
+    if BOT_MODE == "webhook":
+        from aiohttp import web
+        from webhook import SecretWebhookRequestHandler
+
+        app = web.Application()
+        app["WEBHOOK_SECRET"] = WEBHOOK_SECRET
+        executor.set_webhook(webhook_path=WEBHOOK_PATH, request_handler=SecretWebhookRequestHandler, web_app=app)
+        # Несколько процессов могут слушать один порт, ядро распределяет соединения между ними
+        executor.run_app(
+            host=WEBAPP_HOST, port=WEBAPP_PORT, shutdown_timeout=SHUTDOWN_TIMEOUT, reuse_port=CLUSTER_MODE
+        )
+    else:
+        executor.start_polling()
@@ -0,0 +1,290 @@
+import bisect
+import time
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.utils.exceptions import RetryAfter, TelegramAPIError
+
+import callbacks
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Формат ответа Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Сверх этого числа наборов меток новые значения учитываются под меткой "other"
+MAX_LABEL_SETS = 200
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """
+        :param name: Имя метрики в формате Prometheus.
+        :param documentation: Описание для строки HELP.
+        :param labelnames: Имена меток.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        if key not in self._values and len(self._values) >= MAX_LABEL_SETS:
+            key = ("other",) * len(self.labelnames)
+        return key
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in list(self._values.items())
+        ]
+
+
+class Counter(_Metric):
+    """
+    Монотонно растущий счётчик.
+    """
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Текущее значение. Вместо set() можно задать функцию, которая вызывается при каждом запросе метрик.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def _samples(self):
+        if self.function is not None:
+            self._values = {(): self.function()}
+        return super()._samples()
+
+
+class CounterFunction(Gauge):
+    """
+    Счётчик, значение которого берётся из уже существующего атрибута (например, throttled_count).
+    """
+    kind = "counter"
+
+
+class Histogram(_Metric):
+    """
+    Гистограмма длительностей или размеров с накопительными корзинами.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # Счётчики по корзинам (последняя — +Inf), сумма и количество
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in list(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик процесса, отдаваемый в текстовом формате Prometheus.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ====== Метрики ======
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "bot_handler_seconds", "Время работы обработчиков по типу обновления и команде или префиксу callback_data.",
+    ("type", "prefix"),
+))
+TELEGRAM_REQUESTS = REGISTRY.register(Counter(
+    "bot_telegram_requests_total", "Запросы к Telegram Bot API по методам.", ("method",),
+))
+TELEGRAM_ERRORS = REGISTRY.register(Counter(
+    "bot_telegram_errors_total", "Ошибки Telegram Bot API по методам и видам (retry_after — ответ 429).",
+    ("method", "error"),
+))
+THROTTLED = REGISTRY.register(CounterFunction(
+    "bot_throttled_total", "Обновления, отклонённые ограничением частоты запросов.",
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "bot_updates_in_flight", "Обновления в обработке.",
+))
+JOBS_QUEUED = REGISTRY.register(Gauge(
+    "bot_scheduler_jobs", "Отложенные задачи в очереди планировщика.",
+))
+BROADCAST_QUEUED = REGISTRY.register(Gauge(
+    "bot_broadcast_queue", "Сообщения рассылок, ожидающие отправки.",
+))
+STORE_LOAD_SECONDS = REGISTRY.register(Gauge(
+    "bot_store_load_seconds", "Время загрузки хранилища учётных записей и применения журнала при старте.",
+))
+STORE_FLUSH_SECONDS = REGISTRY.register(Histogram(
+    "bot_store_flush_seconds", "Время записи пачки изменений хранилища в SQLite и accs.db.",
+))
+STORE_JOURNAL_BYTES = REGISTRY.register(Counter(
+    "bot_store_journal_bytes_total", "Байт дописано в журнал хранилища.",
+))
+JSON_LOAD_SECONDS = REGISTRY.register(Histogram(
+    "bot_json_load_seconds", "Время чтения JSON-файлов по имени файла.", ("file",),
+))
+JSON_SAVE_SECONDS = REGISTRY.register(Histogram(
+    "bot_json_save_seconds", "Время атомарной записи JSON-файлов (accs.db) по имени файла.", ("file",),
+))
+JSON_BYTES = REGISTRY.register(Gauge(
+    "bot_json_bytes", "Размер последнего записанного JSON-файла в байтах.", ("file",),
+))
+USER_LOCKS = REGISTRY.register(Gauge(
+    "bot_user_locks", "Пользователи, для которых сейчас выполняется или ожидает изменение учётной записи.",
+))
+TORRSERVER_RELOADS = REGISTRY.register(Counter(
+    "bot_torrserver_reloads_total", "Перезагрузки TorrServer по способу и результату.", ("method", "result"),
+))
+TORRSERVER_RELOAD_SECONDS = REGISTRY.register(Histogram(
+    "bot_torrserver_reload_seconds", "Длительность перезагрузки TorrServer по способу.", ("method",),
+))
+
+
+def callback_prefix(data):
+    """
+    Возвращает имя действия кнопки без идентификаторов и сумм, например "topup_sbp_paid".
+    """
+    action, _ = callbacks.decode(data)
+    return action.name if action is not None else "other"
+
+
+class MetricsMiddleware(BaseMiddleware):
+    def __init__(self):
+        """
+        Middleware, измеряющий время работы обработчиков сообщений и нажатий кнопок.
+        Отсчёт начинается после проверок ограничения частоты, поэтому отклонённые
+        запросы в гистограмму не попадают.
+        """
+        super(MetricsMiddleware, self).__init__()
+
+    async def on_process_message(self, message, data):
+        data.setdefault("metrics_started", time.monotonic())
+
+    async def on_post_process_message(self, message, results, data):
+        started = data.get("metrics_started")
+        if started is not None:
+            command = message.get_command(pure=True)
+            HANDLER_SECONDS.observe(
+                time.monotonic() - started, type="message", prefix=f"/{command}" if command else "text"
+            )
+
+    async def on_process_callback_query(self, callback_query, data):
+        data.setdefault("metrics_started", time.monotonic())
+
+    async def on_post_process_callback_query(self, callback_query, results, data):
+        started = data.get("metrics_started")
+        if started is not None:
+            HANDLER_SECONDS.observe(
+                time.monotonic() - started, type="callback_query", prefix=callback_prefix(callback_query.data)
+            )
+
+
+class InstrumentedBot(Bot):
+    """
+    Bot, считающий все запросы к Telegram Bot API и ошибки по методам,
+    включая ответы 429 (RetryAfter) из любых обработчиков и рассылок.
+    """
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        TELEGRAM_REQUESTS.inc(method=method)
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except RetryAfter:
+            TELEGRAM_ERRORS.inc(method=method, error="retry_after")
+            raise
+        except TelegramAPIError as e:
+            TELEGRAM_ERRORS.inc(method=method, error=type(e).__name__)
+            raise
+
+
+async def start_server(host, port):
+    """
+    Запускает HTTP-сервер, отдающий метрики по адресу /metrics.
+    :return: aiohttp.web.AppRunner для остановки сервера.
+    """
+    async def handle(request):
+        return web.Response(
+            body=REGISTRY.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE}
+        )
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,141 @@
+import csv
+import io
+import os
+import re
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+# Идентификатор платежа, который пользователь указывает в комментарии к переводу.
+# В идентификаторе обязательно есть буква, чтобы не принимать за него номера счетов,
+# телефонов и прочие восьмизначные числа из назначения платежа.
+PAYMENT_ID_RE = re.compile(r"(?<![0-9a-z])(?=[0-9]*[a-f])[0-9a-f]{8}(?![0-9a-z])", re.IGNORECASE)
+
+SUPPORTED_EXTENSIONS = (".csv", ".ofx", ".qfx")
+
+# Названия колонок в выгрузках банков (сравниваются без учёта регистра)
+AMOUNT_COLUMNS = ("сумма", "сумма операции", "сумма в валюте счёта", "сумма в валюте счета", "приход", "amount")
+TEXT_COLUMNS = (
+    "назначение платежа", "назначение", "комментарий", "описание", "описание операции",
+    "description", "comment", "memo",
+)
+
+# Поступление по выписке: сумма и текст (комментарий, назначение платежа)
+StatementEntry = namedtuple("StatementEntry", ["amount", "text"])
+
+
+def pending_files(directory):
+    """
+    Возвращает ещё не обработанные файлы выписок в каталоге (по времени изменения).
+    """
+    if not os.path.isdir(directory):
+        return []
+    paths = [
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.lower().endswith(SUPPORTED_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))
+    ]
+    return sorted(paths, key=os.path.getmtime)
+
+
+def archive(path, subdir):
+    """
+    Переносит обработанный файл в подкаталог (processed или failed), не затирая прежние.
+    """
+    target_dir = os.path.join(os.path.dirname(path), subdir)
+    os.makedirs(target_dir, exist_ok=True)
+    name, ext = os.path.splitext(os.path.basename(path))
+    target = os.path.join(target_dir, f"{name}.{datetime.now().strftime('%Y%m%d%H%M%S')}{ext}")
+    os.replace(path, target)
+    return target
+
+
+def parse_statement(path):
+    """
+    Разбирает выписку CSV или OFX.
+    :return: Список StatementEntry только для поступлений (сумма больше нуля).
+    """
+    text = _read_text(path)
+    if path.lower().endswith(".csv"):
+        entries = _parse_csv(text)
+    else:
+        entries = _parse_ofx(text)
+    return [entry for entry in entries if entry.amount > 0]
+
+
+def payment_ids(text):
+    """
+    Возвращает найденные в тексте идентификаторы платежей.
+    """
+    return {match.lower() for match in PAYMENT_ID_RE.findall(text or "")}
+
+
+def new_payment_id():
+    """
+    Создаёт идентификатор платежа для комментария к переводу: 8 шестнадцатеричных
+    символов, среди которых есть хотя бы одна буква (см. PAYMENT_ID_RE).
+    """
+    while True:
+        payment_id = uuid.uuid4().hex[:8]
+        if not payment_id.isdigit():
+            return payment_id
+
+
+def _read_text(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        return data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        # Российские банки нередко выгружают CSV в Windows-1251
+        return data.decode("cp1251")
+
+
+def _parse_amount(value):
+    value = (value or "").replace("\xa0", "").replace(" ", "").replace(",", ".")
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
+
+
+def _parse_csv(text):
+    # Запятая бывает десятичным разделителем, поэтому «;» и табуляция в приоритете
+    head = text[:4096]
+    delimiter = max(";\t", key=head.count) if head.count(";") or head.count("\t") else ","
+    rows = csv.reader(io.StringIO(text), delimiter=delimiter)
+
+    amount_index = text_index = None
+    entries = []
+    for row in rows:
+        names = [cell.strip().lower() for cell in row]
+        if amount_index is None:
+            # Пропускаем строки до заголовка таблицы
+            amount_index = next((i for i, name in enumerate(names) if name in AMOUNT_COLUMNS), None)
+            text_index = next((i for i, name in enumerate(names) if name in TEXT_COLUMNS), None)
+            if text_index is None:
+                amount_index = None
+            continue
+        if len(row) <= max(amount_index, text_index):
+            continue
+        amount = _parse_amount(row[amount_index])
+        if amount is not None:
+            entries.append(StatementEntry(amount, row[text_index]))
+    if amount_index is None:
+        raise ValueError("В CSV не найдены колонки суммы и назначения платежа.")
+    return entries
+
+
+def _parse_ofx(text):
+    entries = []
+    for block in re.findall(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|</BANKTRANLIST>)", text, re.S | re.I):
+        amount = _parse_amount(_ofx_field(block, "TRNAMT"))
+        if amount is not None:
+            entries.append(StatementEntry(amount, f"{_ofx_field(block, 'NAME')} {_ofx_field(block, 'MEMO')}"))
+    return entries
+
+
+def _ofx_field(block, name):
+    # В OFX 1.x (SGML) значения полей не закрываются тегом и заканчиваются переводом строки
+    match = re.search(rf"<{name}>([^<\r\n]*)", block, re.I)
+    return match.group(1).strip() if match else ""
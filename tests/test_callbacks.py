@@ -0,0 +1,67 @@
+import pytest
+
+import callbacks
+
+
+# ====== Новый формат ======
+def test_encode_decode_roundtrip():
+    data = callbacks.SBP_PAID.encode(amount=300, payment_id="1a2b3c4d")
+    assert data == "1sp|8c|1a2b3c4d"
+    assert callbacks.decode(data) == (callbacks.SBP_PAID, {"amount": 300, "payment_id": "1a2b3c4d"})
+
+
+def test_decode_omitted_trailing_fields():
+    data = callbacks.PENDING.encode(op="n")
+    assert callbacks.decode(data) == (
+        callbacks.PENDING, {"op": "n", "anchor": None, "payment_id": None, "count": None}
+    )
+
+
+def test_last_field_may_contain_separator():
+    data = callbacks.DELETE_SUBSCRIPTION.encode(username="a|b")
+    assert callbacks.decode(data) == (callbacks.DELETE_SUBSCRIPTION, {"username": "a|b"})
+
+
+def test_encode_rejects_long_data():
+    with pytest.raises(ValueError):
+        callbacks.DELETE_SUBSCRIPTION.encode(username="x" * 64)
+
+
+@pytest.mark.parametrize("data", ["", None, "9m", "1zz", "1sa|!!"])
+def test_decode_unknown(data):
+    assert callbacks.decode(data) == (None, None)
+
+
+# ====== Старый формат ======
+@pytest.mark.parametrize("data, action, values", [
+    ("main_menu", callbacks.MAIN_MENU, {}),
+    ("pay_sbp", callbacks.PAY_SBP, {}),
+    ("pay_tg_wallet", callbacks.PAY_TG_WALLET, {}),
+    ("topup_sbp_amount_300", callbacks.SBP_AMOUNT, {"amount": 300}),
+    ("topup_sbp_paid_300_1a2b3c4d", callbacks.SBP_PAID, {"amount": 300, "payment_id": "1a2b3c4d"}),
+    ("topup_tg_wallet_amount_3", callbacks.TG_WALLET_AMOUNT, {"amount": 3}),
+    ("topup_tg_wallet_paid_1a2b3c4d_3", callbacks.TG_WALLET_PAID, {"amount": 3, "payment_id": "1a2b3c4d"}),
+    ("topup_confirm_sbp_123456789_100_1a2b3c4d", callbacks.CONFIRM_SBP,
+     {"user_id": 123456789, "amount": 100, "payment_id": "1a2b3c4d"}),
+    ("topup_confirm_tg_wallet_123456789_6_1a2b3c4d", callbacks.CONFIRM_TG_WALLET,
+     {"user_id": 123456789, "amount": 6, "payment_id": "1a2b3c4d"}),
+    ("topup_reject_123456789", callbacks.TOPUP_REJECT, {"user_id": 123456789}),
+    ("topup_reject_sbp_123456789", callbacks.TOPUP_REJECT, {"user_id": 123456789}),
+    ("payment_reject_1a2b3c4d", callbacks.PAYMENT_REJECT, {"payment_id": "1a2b3c4d"}),
+    ("reject_123456789", callbacks.REJECT, {"user_id": 123456789}),
+    ("delete_User_123", callbacks.DELETE_SUBSCRIPTION, {"username": "User_123"}),
+    ("subs:n:User5:Us:2024-01-01:", callbacks.SUBSCRIBERS,
+     {"op": "n", "prefix": "Us", "expiry_from": "2024-01-01", "expiry_to": "", "anchor": "User5"}),
+    ("pend:n:", callbacks.PENDING, {"op": "n", "anchor": "", "payment_id": None, "count": None}),
+    ("pend:c:20240101100000abcdef12:1a2b3c4d", callbacks.PENDING,
+     {"op": "c", "anchor": "20240101100000abcdef12", "payment_id": "1a2b3c4d", "count": None}),
+    ("pend:ca:20240101100000abcdef12:5:1a2b3c4d", callbacks.PENDING,
+     {"op": "ca", "anchor": "20240101100000abcdef12", "payment_id": "1a2b3c4d", "count": 5}),
+])
+def test_decode_legacy(data, action, values):
+    assert callbacks.decode(data) == (action, values)
+
+
+@pytest.mark.parametrize("data", ["topup_sbp_amount_", "topup_sbp_amount_abc", "topup_confirm_sbp_1_2", "unknown"])
+def test_decode_legacy_malformed(data):
+    assert callbacks.decode(data) == (None, None)
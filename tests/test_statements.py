@@ -0,0 +1,90 @@
+from decimal import Decimal
+
+import pytest
+
+import statements
+
+
+# ====== payment_ids ======
+def test_payment_ids_finds_id_with_letter():
+    assert statements.payment_ids("Оплата подписки 1a2b3c4d, спасибо") == {"1a2b3c4d"}
+
+
+def test_payment_ids_is_case_insensitive():
+    assert statements.payment_ids("ID: 0A1B2C3D") == {"0a1b2c3d"}
+
+
+@pytest.mark.parametrize("text", [
+    "Перевод по номеру счёта 40817810",
+    "Договор 12345678 от 01.02.2024",
+    "Телефон 89161234",
+])
+def test_payment_ids_ignores_plain_numbers(text):
+    assert statements.payment_ids(text) == set()
+
+
+@pytest.mark.parametrize("text", [
+    "1a2b3c4d5",     # Длиннее 8 символов
+    "x1a2b3c4d",     # Часть другого слова
+    "1a2b3c4",       # Короче 8 символов
+    "1a2b3c4g",      # Не шестнадцатеричный символ
+])
+def test_payment_ids_requires_whole_token(text):
+    assert statements.payment_ids(text) == set()
+
+
+def test_payment_ids_empty_text():
+    assert statements.payment_ids(None) == set()
+    assert statements.payment_ids("") == set()
+
+
+def test_new_payment_id_matches_pattern():
+    for _ in range(1000):
+        payment_id = statements.new_payment_id()
+        assert len(payment_id) == 8
+        assert statements.payment_ids(f"комментарий {payment_id}") == {payment_id}
+
+
+# ====== parse_statement ======
+def _write(tmp_path, name, text, encoding="utf-8"):
+    path = tmp_path / name
+    path.write_bytes(text.encode(encoding))
+    return str(path)
+
+
+def test_parse_csv_semicolon_cp1251(tmp_path):
+    path = _write(tmp_path, "ozon.csv", (
+        "Выписка по счёту\n"
+        "Дата;Сумма;Назначение платежа\n"
+        "01.02.2024;100,00;Подписка 1a2b3c4d\n"
+        "02.02.2024;-50,00;Списание\n"
+        "03.02.2024;1 300,50;Подписка ffff0000\n"
+    ), encoding="cp1251")
+    assert statements.parse_statement(path) == [
+        statements.StatementEntry(Decimal("100.00"), "Подписка 1a2b3c4d"),
+        statements.StatementEntry(Decimal("1300.50"), "Подписка ffff0000"),
+    ]
+
+
+def test_parse_csv_comma_delimiter(tmp_path):
+    path = _write(tmp_path, "bank.csv", "date,amount,description\n2024-02-01,300,sub abcdef12\n")
+    entries = statements.parse_statement(path)
+    assert entries == [statements.StatementEntry(Decimal("300"), "sub abcdef12")]
+    assert statements.payment_ids(entries[0].text) == {"abcdef12"}
+
+
+def test_parse_csv_without_columns(tmp_path):
+    path = _write(tmp_path, "bad.csv", "a;b;c\n1;2;3\n")
+    with pytest.raises(ValueError):
+        statements.parse_statement(path)
+
+
+def test_parse_ofx_sgml(tmp_path):
+    path = _write(tmp_path, "bank.ofx", (
+        "OFXHEADER:100\n<OFX><BANKTRANLIST>\n"
+        "<STMTTRN>\n<TRNAMT>600.00\n<NAME>Иванов\n<MEMO>Подписка 0badcafe\n"
+        "<STMTTRN>\n<TRNAMT>-10.00\n<NAME>Комиссия\n"
+        "</BANKTRANLIST></OFX>\n"
+    ))
+    entries = statements.parse_statement(path)
+    assert entries == [statements.StatementEntry(Decimal("600.00"), "Иванов Подписка 0badcafe")]
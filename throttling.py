@@ -1,35 +1,84 @@
 import asyncio
+from collections import OrderedDict
+from aiogram.dispatcher.handler import CancelHandler
 from aiogram.dispatcher.middlewares import BaseMiddleware
-from aiogram.utils.exceptions import Throttled
 
 
 class ThrottlingMiddleware(BaseMiddleware):
-    def __init__(self, rate_limit=1.0):
+    def __init__(self, rate_limit=1.0, burst=1, max_users=10000, ttl=None):
         """
-        Middleware для ограничения частоты запросов пользователей.
+        Middleware для ограничения частоты запросов пользователей (сообщений и нажатий кнопок).
+        Работает как «корзина с токенами»: пользователь может сделать до burst запросов подряд,
+        после чего получает один запрос раз в rate_limit секунд.
         :param rate_limit: Время в секундах между запросами.
+        :param burst: Допустимое число запросов подряд (1 — строго один запрос за rate_limit).
+        :param max_users: Максимальное число пользователей, состояние которых хранится одновременно.
+        :param ttl: Время простоя, после которого состояние пользователя удаляется
+                    (по умолчанию — время полного восстановления корзины).
         """
         super(ThrottlingMiddleware, self).__init__()
         self.rate_limit = rate_limit
-        self.rate_limits = {}
+        self.burst = burst
+        self.max_users = max_users
+        self.ttl = ttl if ttl is not None else rate_limit * burst
+        # user_id -> [токены, время обновления, уведомлён ли пользователь]; порядок — по времени обращения
+        self.rate_limits = OrderedDict()
+        self.throttled_count = 0
+
+    def _evict(self, now):
+        """
+        Удаляет самые давние записи: простаивающие дольше ttl и сверх max_users.
+        """
+        while self.rate_limits:
+            user_id, state = next(iter(self.rate_limits.items()))
+            if now - state[1] < self.ttl and len(self.rate_limits) < self.max_users:
+                break
+            self.rate_limits.popitem(last=False)
+
+    def check(self, user_id):
+        """
+        Списывает токен пользователя.
+        :return: None, если запрос разрешён; иначе True, если о превышении лимита нужно
+                 сообщить пользователю (только первый раз подряд), и False — если нет.
+        """
+        now = asyncio.get_event_loop().time()
+        self._evict(now)
+        state = self.rate_limits.get(user_id)
+        if state is None:
+            state = self.rate_limits[user_id] = [self.burst, now, False]
+        else:
+            state[0] = min(self.burst, state[0] + (now - state[1]) / self.rate_limit)
+            state[1] = now
+            self.rate_limits.move_to_end(user_id)
+
+        if state[0] >= 1:
+            state[0] -= 1
+            state[2] = False
+            return None
+
+        self.throttled_count += 1
+        notify = not state[2]
+        state[2] = True
+        return notify
 
     async def on_pre_process_message(self, message, data):
         """
         Проверка перед обработкой сообщения.
         """
-        user_id = message.from_user.id
-        if user_id in self.rate_limits:
-            last_request = self.rate_limits[user_id]
-            if asyncio.get_event_loop().time() - last_request < self.rate_limit:
-                raise Throttled()
-        self.rate_limits[user_id] = asyncio.get_event_loop().time()
+        notify = self.check(message.from_user.id)
+        if notify is None:
+            return
+        if notify:
+            await message.reply("Слишком много запросов. Подождите немного!")
+        raise CancelHandler()
 
-    async def on_process_exception(self, update, exception):
+    async def on_pre_process_callback_query(self, callback_query, data):
         """
-        Обработка исключений, возникающих из-за частых запросов.
+        Проверка перед обработкой нажатия кнопки.
         """
-        if isinstance(exception, Throttled):
-            if update.message:
-                await update.message.reply("Слишком много запросов. Подождите немного!")
-            return True  # Исключение обработано
-        return False
+        notify = self.check(callback_query.from_user.id)
+        if notify is None:
+            return
+        # На callback-запрос нужно ответить, иначе у пользователя «висят» часики на кнопке
+        await callback_query.answer("Слишком много запросов. Подождите немного!" if notify else None)
+        raise CancelHandler()
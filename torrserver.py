@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import shlex
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import aiohttp
+
+import metrics
+
+logger = logging.getLogger("torrserver")
+
+RESTART_COMMAND = ["systemctl", "restart", "torrserver"]
+STATUS_COMMAND = ["systemctl", "is-active", "torrserver"]
+
+# Результат выполнения команды управления: код возврата None означает таймаут
+CommandResult = namedtuple("CommandResult", ["command", "returncode", "output", "duration"])
+
+
+async def run_command(command, timeout=30.0):
+    """
+    Запускает команду как асинхронный подпроцесс, не блокируя цикл событий.
+    Зависший процесс принудительно завершается по истечении timeout.
+    :return: CommandResult.
+    """
+    started = time.monotonic()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+        )
+    except OSError as e:
+        return CommandResult(command, -1, str(e), time.monotonic() - started)
+    try:
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return CommandResult(command, None, "", time.monotonic() - started)
+    return CommandResult(
+        command, process.returncode, output.decode(errors="replace").strip(), time.monotonic() - started
+    )
+
+
+class TorrServerReloader:
+    """
+    Планировщик перезагрузки TorrServer после изменения accs.db.
+    Запросы за окно window секунд объединяются, и TorrServer перезагружается
+    не чаще одного раза за окно. По возможности используется щадящий способ
+    (HTTP-запрос или отдельная команда, например сигнал), а полный рестарт
+    службы — только если он не задан или завершился ошибкой.
+    """
+
+    def __init__(self, before_reload=None, window=10.0, reload_url=None, reload_command=None, mode=None,
+                 timeout=30.0):
+        """
+        :param before_reload: Корутина, вызываемая перед перезагрузкой (сброс accs.db на диск).
+        :param window: Окно объединения запросов в секундах.
+        :param reload_url: URL для перезагрузки через HTTP API (POST).
+        :param reload_command: Команда щадящей перезагрузки, например "systemctl kill -s HUP torrserver".
+        :param mode: "http", "command", "restart" или "none" (заглушка для локального запуска).
+                     По умолчанию выбирается по заданным reload_url / reload_command.
+        :param timeout: Максимальное время выполнения команды управления в секундах.
+        """
+        self.before_reload = before_reload
+        self.window = window
+        self.reload_url = reload_url
+        self.reload_command = shlex.split(reload_command) if reload_command else None
+        if mode is None:
+            mode = "http" if reload_url else "command" if reload_command else "restart"
+        self.mode = mode
+        self.timeout = timeout
+        self.reload_count = 0
+        self.failure_count = 0
+        self.last_reload_at = None
+        self.last_result = None
+        self._timer = None
+        self._running = None
+        self._pending = False
+
+    def request(self):
+        """
+        Запрашивает перезагрузку. Повторные запросы до её выполнения объединяются.
+        """
+        self._pending = True
+        if self._timer is not None or self._running is not None:
+            return
+        loop = asyncio.get_running_loop()
+        self._timer = loop.call_later(self.window, self._start)
+
+    def _start(self):
+        self._timer = None
+        self._running = asyncio.get_running_loop().create_task(self._reload())
+
+    async def _reload(self):
+        try:
+            self._pending = False
+            if self.before_reload is not None:
+                await self.before_reload()
+            if not await self.reload_now():
+                self.failure_count += 1
+        except Exception as e:
+            self.failure_count += 1
+            logger.error(f"Ошибка при перезагрузке TorrServer: {e}")
+        finally:
+            self._running = None
+            # Изменения, пришедшие во время перезагрузки, ждут следующего окна
+            if self._pending:
+                self._pending = False
+                self.request()
+
+    async def flush(self):
+        """
+        Немедленно выполняет отложенную перезагрузку (при завершении работы).
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._start()
+        if self._running is not None:
+            await self._running
+
+    def status(self):
+        """
+        Сводка о перезагрузках для администратора.
+        """
+        return {
+            "mode": self.mode,
+            "window": self.window,
+            "pending": self._timer is not None or self._pending,
+            "running": self._running is not None,
+            "reloads": self.reload_count,
+            "failures": self.failure_count,
+            "last_reload_at": self.last_reload_at,
+            "last_result": self.last_result,
+        }
+
+    async def service_status(self):
+        """
+        Возвращает состояние службы TorrServer (systemctl is-active).
+        """
+        return await run_command(STATUS_COMMAND, self.timeout)
+
+    async def reload_now(self):
+        """
+        Перезагружает TorrServer выбранным способом, при неудаче — рестартом службы.
+        """
+        self.reload_count += 1
+        self.last_reload_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if self.mode == "none":
+            logger.info("Перезагрузка TorrServer пропущена (режим none).")
+            return True
+        if self.mode == "http" and await self._measured("http", self._reload_http()):
+            return True
+        if self.mode == "command" and await self._measured("command", self._run(self.reload_command)):
+            return True
+        return await self._measured("restart", self._run(RESTART_COMMAND))
+
+    async def _measured(self, method, reload):
+        """
+        Выполняет перезагрузку одним способом и учитывает её в метриках.
+        """
+        started = time.monotonic()
+        done = await reload
+        metrics.TORRSERVER_RELOAD_SECONDS.observe(time.monotonic() - started, method=method)
+        metrics.TORRSERVER_RELOADS.inc(method=method, result="ok" if done else "failed")
+        return done
+
+    async def _reload_http(self):
+        started = time.monotonic()
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+                async with session.post(self.reload_url) as response:
+                    self.last_result = CommandResult(
+                        ["POST", self.reload_url], response.status, "", time.monotonic() - started
+                    )
+                    if response.status < 400:
+                        logger.info("TorrServer перезагружен через HTTP API.")
+                        return True
+                    logger.error(f"HTTP API TorrServer вернул статус {response.status}.")
+        except Exception as e:
+            logger.error(f"Ошибка обращения к HTTP API TorrServer: {e}")
+        return False
+
+    async def _run(self, command):
+        result = await run_command(command, self.timeout)
+        self.last_result = result
+        if result.returncode == 0:
+            logger.info(f"TorrServer успешно перезагружен: {' '.join(command)} ({result.duration:.1f} сек.)")
+            return True
+        if result.returncode is None:
+            logger.error(f"Команда {' '.join(command)} не завершилась за {self.timeout} сек. и была прервана.")
+        else:
+            logger.error(f"Команда {' '.join(command)} завершилась с кодом {result.returncode}: {result.output}")
+        return False
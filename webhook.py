@@ -0,0 +1,17 @@
+from aiohttp import web
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class SecretWebhookRequestHandler(WebhookRequestHandler):
+    """
+    Обработчик вебхука, принимающий только запросы с секретным токеном,
+    который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token.
+    """
+
+    async def post(self):
+        secret = self.request.app.get("WEBHOOK_SECRET")
+        if secret and self.request.headers.get(SECRET_HEADER) != secret:
+            raise web.HTTPUnauthorized()
+        return await super().post()